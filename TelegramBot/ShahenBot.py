@@ -4,10 +4,9 @@ import logging
 import os
 import json
 from pathlib import Path
-import io
+import tempfile
 from dotenv import load_dotenv
 import httpx
-import requests
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
@@ -18,6 +17,10 @@ from telegram.ext import (
     filters,
 )
 
+from api_client import ApiClient
+from lang_cache import LanguageCache
+from update_ordering import BOT_CONCURRENCY, BOT_MAX_PENDING_UPDATES, ChatOrderedApplication
+
 # ───────────── Load .env ─────────────
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -26,10 +29,22 @@ if not BOT_TOKEN:
 
 API_BASE_URL = os.getenv("SHAHEN_API_URL", "http://localhost:5001")
 DISABLE_POLLING = os.getenv("DISABLE_POLLING", "").lower() == "true"
+# "polling" (getUpdates) or "webhook" (see webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "").rstrip("/")
+# "file_id": send only the photo's file_id, the web app fetches it on first view
+# "upload": stream the photo through a small spooled temp file to /api/upload_image
+PHOTO_UPLOAD_MODE = os.getenv("PHOTO_UPLOAD_MODE", "file_id").lower()
+PHOTO_SPOOL_BYTES = int(os.getenv("PHOTO_SPOOL_BYTES", str(256 * 1024)))
 BUILDING_LOGIN_URL = os.getenv(
     "BUILDING_LOGIN_URL",
     "https://shahenbotweb.up.railway.app/building-login"
 )
+api = ApiClient(API_BASE_URL)
+LANG_CACHE = LanguageCache(
+    maxsize=int(os.getenv("LANG_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("LANG_CACHE_TTL", "600")),
+)
 # ───────────── Logging ─────────────
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -57,14 +72,12 @@ def get_text(lang: str, key: str) -> str:
         data = MESSAGES.get("he", {})
     return data.get(key, key)
 
-def build_main_menu_keyboard(chat_id: int, lang: str):
-    tenant = api_get_tenant_by_chat_id(chat_id)
-
-    is_registered = bool(
-        tenant
-        and int(tenant.get("building_id") or 0) > 0
-        and (tenant.get("apartment") or "").strip()
-    )
+async def build_main_menu_keyboard(chat_id: int, lang: str, ctx: dict | None = None):
+    """ctx: the update's api_get_bot_context() result, if the handler already has it."""
+    if ctx is None:
+        ctx = await api_get_bot_context(chat_id)
+    tenant = ctx["tenant"]
+    is_registered = ctx["is_registered"]
 
     lang_row = [
         InlineKeyboardButton(get_text(lang, "lang_button_he"), callback_data="lang_he"),
@@ -89,6 +102,11 @@ def build_main_menu_keyboard(chat_id: int, lang: str):
                 InlineKeyboardButton(get_text(lang, "portal_open_btn"), callback_data="portal_open")
             ])
 
+    if ctx["payment_cta"]["show"]:
+        rows.append([
+            InlineKeyboardButton(get_text(lang, "btn_pay"), callback_data="pay_open")
+        ])
+
     # כפתור רישום דייר - אם לא רשום באמת
     if not is_registered:
         rows.append([
@@ -97,32 +115,38 @@ def build_main_menu_keyboard(chat_id: int, lang: str):
 
     return InlineKeyboardMarkup(rows)
 # ───────────── API helpers ─────────────
+# All calls share one pooled httpx.AsyncClient (api_client.py); always await them.
+
+async def api_get_user_language(chat_id: int, default_lang: str = "he") -> str:
+    cached = LANG_CACHE.get(chat_id)
+    if cached is not None:
+        return cached
 
-def api_get_user_language(chat_id: int, default_lang: str = "he") -> str:
     try:
-        url = f"{API_BASE_URL}/api/user/{chat_id}/language"
-        resp = requests.get(url, timeout=5)
-        if resp.ok:
+        resp = await api.get(f"/api/user/{chat_id}/language", timeout=5)
+        if resp.is_success:
             data = resp.json()
-            return data.get("language", default_lang)
+            lang = data.get("language", default_lang)
+            LANG_CACHE.set(chat_id, lang)
+            return lang
         else:
             logger.error("API get_language error: %s %s", resp.status_code, resp.text)
     except Exception as e:
         logger.exception("API get_language exception: %s", e)
     return default_lang
 
-def api_set_user_language(chat_id: int, lang: str):
+async def api_set_user_language(chat_id: int, lang: str):
+    # write-through: the user sees the new language at once, even if the API call fails
+    LANG_CACHE.set(chat_id, lang)
     try:
-        url = f"{API_BASE_URL}/api/user/{chat_id}/language"
-        resp = requests.post(url, json={"language": lang}, timeout=5)
-        if not resp.ok:
+        resp = await api.post(f"/api/user/{chat_id}/language", json={"language": lang}, timeout=5)
+        if not resp.is_success:
             logger.error("API set_language error: %s %s", resp.status_code, resp.text)
     except Exception as e:
         logger.exception("API set_language exception: %s", e)
 
-def api_create_ticket(chat_id: int, lang: str, category: str, description: str, image_url: str | None = None):
+async def api_create_ticket(chat_id: int, lang: str, category: str, description: str, image_url: str | None = None):
     try:
-        url = f"{API_BASE_URL}/api/tickets"
         payload = {
             "chat_id": chat_id,
             "category": category,
@@ -130,8 +154,8 @@ def api_create_ticket(chat_id: int, lang: str, category: str, description: str,
             "language": lang,
             "image_url": image_url,
         }
-        resp = requests.post(url, json=payload, timeout=5)
-        if resp.ok:
+        resp = await api.post("/api/tickets", json=payload, timeout=5)
+        if resp.is_success:
             return resp.json()
         else:
             logger.error("API create_ticket error: %s %s", resp.status_code, resp.text)
@@ -139,7 +163,7 @@ def api_create_ticket(chat_id: int, lang: str, category: str, description: str,
         logger.exception("API create_ticket exception: %s", e)
     return None
 
-def api_update_ticket_description(ticket_id: int, chat_id: int, new_description: str):
+async def api_update_ticket_description(ticket_id: int, chat_id: int, new_description: str):
     """
     Update ticket description via API.
     Returns a dict like:
@@ -148,11 +172,10 @@ def api_update_ticket_description(ticket_id: int, chat_id: int, new_description:
       { "success": False, "error": "ticket_closed" }
     """
     try:
-        url = f"{API_BASE_URL}/api/tickets/{ticket_id}/description"
         payload = {"chat_id": chat_id, "description": new_description}
-        resp = requests.post(url, json=payload, timeout=5)
+        resp = await api.post(f"/api/tickets/{ticket_id}/description", json=payload, timeout=5)
 
-        if resp.ok:
+        if resp.is_success:
             return {"success": True, "ticket": resp.json()}
 
         # try to understand error body
@@ -171,23 +194,21 @@ def api_update_ticket_description(ticket_id: int, chat_id: int, new_description:
         logger.exception("API update_ticket_description exception: %s", e)
         return {"success": False, "error": "exception"}
 
-def api_get_tenants_by_apartment(apartment: str, only_without_chat: bool = True):
+async def api_get_tenants_by_apartment(apartment: str, only_without_chat: bool = True):
     try:
-        url = f"{API_BASE_URL}/api/tenants/by_apartment/{apartment}"
         params = {"only_without_chat": "1"} if only_without_chat else {}
-        resp = requests.get(url, params=params, timeout=5)
-        if resp.ok:
+        resp = await api.get(f"/api/tenants/by_apartment/{apartment}", params=params, timeout=5)
+        if resp.is_success:
             data = resp.json()
             return data.get("tenants", [])
     except Exception as e:
         logger.exception("API get_tenants_by_apartment exception: %s", e)
     return []
 
-def api_link_tenant_chat(tenant_id: int, chat_id: int):
+async def api_link_tenant_chat(tenant_id: int, chat_id: int):
     try:
-        url = f"{API_BASE_URL}/api/tenants/{tenant_id}/link_chat"
-        resp = requests.post(url, json={"chat_id": chat_id}, timeout=5)
-        if resp.ok:
+        resp = await api.post(f"/api/tenants/{tenant_id}/link_chat", json={"chat_id": chat_id}, timeout=5)
+        if resp.is_success:
             return resp.json()
         else:
             logger.error(
@@ -199,20 +220,19 @@ def api_link_tenant_chat(tenant_id: int, chat_id: int):
         logger.exception("API link_tenant_chat exception: %s", e)
     return None
 
-def api_check_duplicate(building_id: int, category: str):
-    r = httpx.get(
-        f"{API_BASE_URL}/api/tickets/check_duplicate",
+async def api_check_duplicate(building_id: int, category: str):
+    r = await api.get(
+        "/api/tickets/check_duplicate",
         params={"building_id": building_id, "category": category},
         timeout=10,
     )
     r.raise_for_status()
     return r.json()
 
-def api_add_ticket_watcher(ticket_id: int, chat_id: int):
+async def api_add_ticket_watcher(ticket_id: int, chat_id: int):
     try:
-        url = f"{API_BASE_URL}/api/tickets/{ticket_id}/watchers"
-        resp = requests.post(url, json={"chat_id": chat_id}, timeout=5)
-        if resp.ok:
+        resp = await api.post(f"/api/tickets/{ticket_id}/watchers", json={"chat_id": chat_id}, timeout=5)
+        if resp.is_success:
             return {"success": True}
         try:
             data = resp.json()
@@ -223,24 +243,52 @@ def api_add_ticket_watcher(ticket_id: int, chat_id: int):
         logger.exception("API add_ticket_watcher exception: %s", e)
         return {"success": False, "error": "exception"}
 
-def api_get_tenant_by_chat_id(chat_id: int):
-    r = httpx.get(f"{API_BASE_URL}/api/tenants/by_chat/{chat_id}", timeout=10)
+async def api_get_tenant_by_chat_id(chat_id: int):
+    r = await api.get(f"/api/tenants/by_chat/{chat_id}", timeout=10)
     r.raise_for_status()
     return (r.json() or {}).get("tenant")
 
-def api_get_my_tickets(chat_id: int):
+def fallback_bot_context(chat_id: int) -> dict:
+    """What handlers assume while the API is unreachable: known language, no tenant."""
+    return {
+        "language": LANG_CACHE.get(chat_id) or "he",
+        "tenant": None,
+        "is_registered": False,
+        "is_fully_registered": False,
+        "payment_cta": {"show": False, "reason": None},
+    }
+
+async def api_get_bot_context(chat_id: int) -> dict:
+    """
+    Language, tenant, registration and payment-CTA state in one API call:
+    {"language", "tenant", "is_registered", "is_fully_registered", "payment_cta": {"show", "reason"}}
+    Falls back to fallback_bot_context() on API errors, so the user still gets a reply.
+    """
+    try:
+        resp = await api.get(f"/api/bot/context/{chat_id}", timeout=10)
+        if resp.is_success:
+            ctx = resp.json()
+            if not isinstance(ctx, dict) or not ctx.get("language"):
+                raise ValueError(f"unexpected bot context: {ctx!r:.200}")
+            LANG_CACHE.set(chat_id, ctx["language"])
+            return ctx
+        logger.error("API get_bot_context error: %s %s", resp.status_code, resp.text)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.exception("API get_bot_context exception: %s", e)
+    return fallback_bot_context(chat_id)
+
+async def api_get_my_tickets(chat_id: int):
     try:
-        url = f"{API_BASE_URL}/api/tickets/by_chat/{chat_id}"
-        resp = requests.get(url, timeout=8)
-        if resp.ok:
+        resp = await api.get(f"/api/tickets/by_chat/{chat_id}", timeout=8)
+        if resp.is_success:
             return resp.json()
     except Exception as e:
         logger.exception("api_get_my_tickets error: %s", e)
     return {"own": [], "watching": []}
 
-def api_resolve_building(street: str, number: str):
-    r = httpx.post(
-        f"{API_BASE_URL}/api/buildings/resolve",
+async def api_resolve_building(street: str, number: str):
+    r = await api.post(
+        "/api/buildings/resolve",
         json={"street": street, "number": number},
         timeout=10,
     )
@@ -248,9 +296,9 @@ def api_resolve_building(street: str, number: str):
         return None
     return r.json()
 
-def api_get_tenants_by_building_apartment(building_id: int, apartment: str, only_without_chat: bool = True):
-    r = httpx.get(
-        f"{API_BASE_URL}/api/tenants/by_building_apartment",
+async def api_get_tenants_by_building_apartment(building_id: int, apartment: str, only_without_chat: bool = True):
+    r = await api.get(
+        "/api/tenants/by_building_apartment",
         params={
             "building_id": building_id,
             "apartment": apartment,
@@ -261,9 +309,9 @@ def api_get_tenants_by_building_apartment(building_id: int, apartment: str, only
     r.raise_for_status()
     return (r.json() or {}).get("tenants", [])
 
-def api_create_tenant_auto(building_id: int, apartment: str, chat_id: int, language: str):
-    r = httpx.post(
-        f"{API_BASE_URL}/api/tenants/auto_register",
+async def api_create_tenant_auto(building_id: int, apartment: str, chat_id: int, language: str):
+    r = await api.post(
+        "/api/tenants/auto_register",
         json={
             "building_id": building_id,
             "apartment": apartment,
@@ -276,29 +324,86 @@ def api_create_tenant_auto(building_id: int, apartment: str, chat_id: int, langu
         return None
     return (r.json() or {}).get("tenant")
 
-def api_update_tenant_name(tenant_id: int, name: str) -> bool:
-    r = httpx.post(
-        f"{API_BASE_URL}/api/tenants/{tenant_id}/name",
+async def api_update_tenant_name(tenant_id: int, name: str) -> bool:
+    r = await api.post(
+        f"/api/tenants/{tenant_id}/name",
         json={"name": name},
         timeout=10,
     )
     return r.status_code == 200
 
+async def api_cast_poll_vote(chat_id: int, poll_id: int, option_id: int):
+    return await api.post(
+        "/api/polls/vote",
+        json={"chat_id": chat_id, "poll_id": poll_id, "option_id": option_id},
+        timeout=10,
+    )
+
+async def api_create_building_request(payload: dict):
+    return await api.post("/api/building_requests", json=payload, timeout=10)
+
+async def api_verify_admin_invite(email: str, code: str, chat_id: int):
+    return await api.post(
+        "/api/buildings/verify_invite",
+        json={"email": email, "invite_code": code, "chat_id": chat_id},
+        timeout=10,
+    )
+
+async def api_create_pending_payment(chat_id: int, amount_cents: int, method: str):
+    return await api.post(
+        "/api/payments/create_pending",
+        json={"chat_id": chat_id, "amount_cents": amount_cents, "method": method},
+        timeout=10,
+    )
+
+async def api_attach_payment_proof(payment_id: int, file_id: str, file_type: str):
+    return await api.post(
+        f"/api/payments/{payment_id}/attach_proof",
+        json={"file_id": file_id, "file_type": file_type},
+        timeout=10,
+    )
+
+async def api_upload_image(files: dict):
+    return await api.post("/api/upload_image", files=files, timeout=15)
+
+async def api_upload_image_ref(file_id: str, file_unique_id: str):
+    return await api.post(
+        "/api/upload_image_ref",
+        json={"file_id": file_id, "file_unique_id": file_unique_id},
+        timeout=10,
+    )
+
+async def upload_ticket_photo(photo) -> str | None:
+    """
+    Hand a ticket photo to the web app and return its URL (None on failure).
+    Neither mode holds the whole image in memory.
+    """
+    if PHOTO_UPLOAD_MODE == "upload":
+        tg_file = await photo.get_file()
+        # spills to disk past PHOTO_SPOOL_BYTES; httpx reads it back in chunks
+        with tempfile.SpooledTemporaryFile(max_size=PHOTO_SPOOL_BYTES) as buf:
+            await api.download(tg_file.file_path, buf, timeout=30)
+            buf.seek(0)
+            resp = await api_upload_image({"file": ("report.jpg", buf, "image/jpeg")})
+    else:
+        resp = await api_upload_image_ref(photo.file_id, photo.file_unique_id)
+
+    if not resp.is_success:
+        logger.error("Upload image error: %s %s", resp.status_code, resp.text)
+        return None
+    return resp.json().get("url")
+
 async def handle_poll_vote(update: Update, context: ContextTypes.DEFAULT_TYPE, poll_id: int, option_id: int):
     query = update.callback_query
     await query.answer()
 
     chat_id = query.message.chat_id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
     try:
-        resp = requests.post(
-            f"{API_BASE_URL}/api/polls/vote",
-            json={"chat_id": chat_id, "poll_id": poll_id, "option_id": option_id},
-            timeout=10,
-        )
+        resp = await api_cast_poll_vote(chat_id, poll_id, option_id)
 
-        if not resp.ok:
+        if not resp.is_success:
             data = {}
             try:
                 data = resp.json() or {}
@@ -327,13 +432,13 @@ async def handle_poll_vote(update: Update, context: ContextTypes.DEFAULT_TYPE, p
     except Exception:
         await query.message.reply_text(get_text(lang, "poll_vote_failed"))
 
-def api_create_portal_link(chat_id: int):
-    r = requests.post(
-        f"{API_BASE_URL}/api/tenant_portal/create_link",
+async def api_create_portal_link(chat_id: int):
+    r = await api.post(
+        "/api/tenant_portal/create_link",
         json={"chat_id": chat_id},
         timeout=10,
     )
-    if not r.ok:
+    if not r.is_success:
         try:
             return {"ok": False, **(r.json() or {})}
         except Exception:
@@ -397,9 +502,10 @@ def parse_amount_to_cents(s: str):
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    lang = api_get_user_language(chat_id)
+    ctx = await api_get_bot_context(chat_id)
+    lang = ctx["language"]
 
-    keyboard = build_main_menu_keyboard(chat_id, lang)
+    keyboard = await build_main_menu_keyboard(chat_id, lang, ctx)
 
     await update.message.reply_text(
         get_text(lang, "start"),
@@ -412,24 +518,24 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     chat_id = query.message.chat.id
 
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
     # Language change
     if data.startswith("lang_"):
         if data == "lang_he":
-            api_set_user_language(chat_id, "he")
+            await api_set_user_language(chat_id, "he")
             lang = "he"
             text = get_text(lang, "language_set")
         elif data == "lang_en":
-            api_set_user_language(chat_id, "en")
+            await api_set_user_language(chat_id, "en")
             lang = "en"
             text = get_text(lang, "language_set_en")
         elif data == "lang_fr":
-            api_set_user_language(chat_id, "fr")
+            await api_set_user_language(chat_id, "fr")
             lang = "fr"
             text = get_text(lang, "language_set_fr")
 
-        keyboard = build_main_menu_keyboard(chat_id, lang)
+        keyboard = await build_main_menu_keyboard(chat_id, lang)
 
         await query.edit_message_text(
             text=f"{text}\n\n{get_text(lang, 'main_menu')}",
@@ -501,7 +607,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pending_lang = pending.get("lang", lang)
         image_url = pending.get("image_url")
 
-        ticket = api_create_ticket(
+        ticket = await api_create_ticket(
             chat_id=chat_id,
             lang=pending_lang,
             category=category,
@@ -536,13 +642,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     if data in ("register", "go_register"):
-        tenant = api_get_tenant_by_chat_id(chat_id)
-
-        is_registered = bool(
-            tenant
-            and int(tenant.get("building_id") or 0) > 0
-            and (tenant.get("apartment") or "").strip()
-        )
+        ctx = await api_get_bot_context(chat_id)
+        tenant = ctx["tenant"]
+        is_registered = ctx["is_registered"]
 
         if is_registered:
             txt = get_text(lang, "register_already_linked").format(
@@ -565,10 +667,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if data == "dup_yes":
         dup_ticket_id = context.user_data.get("dup_ticket_id")
-        lang = api_get_user_language(chat_id)
+        lang = await api_get_user_language(chat_id)
 
         if dup_ticket_id:
-            result = api_add_ticket_watcher(dup_ticket_id, chat_id)
+            result = await api_add_ticket_watcher(dup_ticket_id, chat_id)
             if result.get("success"):
                 await query.edit_message_text(
                     get_text(lang, "dup_added_watcher").format(ticket_id=dup_ticket_id)
@@ -600,13 +702,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "dup_no":
-        lang = api_get_user_language(chat_id)
+        lang = await api_get_user_language(chat_id)
         await query.edit_message_text(get_text(lang, "dup_declined"))
         context.user_data.pop("dup_ticket_id", None)
         return
     
     if data == "portal_open":
-        res = api_create_portal_link(chat_id)
+        res = await api_create_portal_link(chat_id)
         if not res.get("ok"):
             await query.message.reply_text(get_text(lang, "portal_need_register"))
             return
@@ -628,9 +730,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("regtenant_"):
         tenant_id = int(data.split("_")[1])
         chat_id = query.message.chat.id
-        lang = api_get_user_language(chat_id)
+        lang = await api_get_user_language(chat_id)
 
-        linked = api_link_tenant_chat(tenant_id, chat_id)
+        linked = await api_link_tenant_chat(tenant_id, chat_id)
         if linked:
             text = get_text(lang, "register_success").format(
                 name=linked.get("name", ""),
@@ -655,7 +757,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = msg.text or ""
     chat = msg.chat
     chat_id = chat.id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
     chat_type = chat.type
     #add name to auto register
     # ==============================
@@ -708,12 +810,8 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         }
 
         try:
-            resp = requests.post(
-                f"{API_BASE_URL}/api/building_requests",
-                json=payload,
-                timeout=10,
-            )
-            if resp.ok:
+            resp = await api_create_building_request(payload)
+            if resp.is_success:
                 await msg.reply_text(get_text(lang, "req_sent_success"))
             else:
                 await msg.reply_text(get_text(lang, "req_sent_error"))
@@ -739,13 +837,9 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         code = text.strip()
 
         try:
-            resp = requests.post(
-                f"{API_BASE_URL}/api/buildings/verify_invite",
-                json={"email": email, "invite_code": code, "chat_id": chat_id},
-                timeout=10,
-            )
+            resp = await api_verify_admin_invite(email, code, chat_id)
 
-            if resp.ok:
+            if resp.is_success:
                 await msg.reply_text(get_text(lang, "verify_success"))
 
                 keyboard = InlineKeyboardMarkup([
@@ -780,14 +874,10 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         method = context.user_data.get("payment_method") or "bank_transfer"
 
         try:
-            resp = requests.post(
-                f"{API_BASE_URL}/api/payments/create_pending",
-                json={"chat_id": chat_id, "amount_cents": cents, "method": method},
-                timeout=10,
-            )
+            resp = await api_create_pending_payment(chat_id, cents, method)
             logger.info("PAY: create_pending status=%s text=%s", resp.status_code, resp.text)
 
-            if not resp.ok:
+            if not resp.is_success:
                 await msg.reply_text(get_text(lang, "payment_error_try_again"))
                 context.user_data.pop("payment_step", None)
                 context.user_data.pop("payment_method", None)
@@ -820,7 +910,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         tenant_id = context.user_data.get("name_tenant_id")
         name = text.strip()
 
-        ok = api_update_tenant_name(tenant_id, name)
+        ok = await api_update_tenant_name(tenant_id, name)
         if ok:
             await msg.reply_text(get_text(lang, "register_name_saved").format(name=name))
         else:
@@ -829,9 +919,11 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.clear()
         return   # ✅ REQUIRED
 
-    tenant = api_get_tenant_by_chat_id(chat_id)
+    # one call for tenant + registration + pay button; reused for the rest of this update
+    ctx = await api_get_bot_context(chat_id)
+    tenant = ctx["tenant"]
 
-    if tenant and int(tenant.get("building_id") or 0) > 0:
+    if tenant:
         # registered
         if not (tenant.get("name") or "").strip() or (tenant.get("name") or "").startswith("New Tenant"):
             # ask name only if missing/placeholder
@@ -847,7 +939,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ticket_id = context.user_data.get("editing_ticket_id")
         new_text = text
 
-        result = api_update_ticket_description(ticket_id, chat_id, new_text)
+        result = await api_update_ticket_description(ticket_id, chat_id, new_text)
 
         if result and result.get("success"):
             await msg.reply_text(
@@ -886,7 +978,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         apartment = text.strip()
 
         # Resolve building first (must exist or be created by admin/superadmin)
-        building = api_resolve_building(street=street, number=number)
+        building = await api_resolve_building(street=street, number=number)
         if not building:
             await msg.reply_text(get_text(lang, "register_building_not_found").format(street=street, number=number))
             context.user_data.clear()
@@ -895,11 +987,11 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         building_id = int(building["id"])
         logger.info(f"building_id={building_id} apartment={apartment}")        
         
-        tenants = api_get_tenants_by_building_apartment(building_id, apartment, only_without_chat=True)
+        tenants = await api_get_tenants_by_building_apartment(building_id, apartment, only_without_chat=True)
 
         if not tenants:
             # Auto create tenant and link chat_id
-            created = api_create_tenant_auto(
+            created = await api_create_tenant_auto(
                 building_id=building_id,
                 apartment=apartment,
                 chat_id=chat_id,
@@ -920,7 +1012,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if len(tenants) == 1:
             t = tenants[0]
-            linked = api_link_tenant_chat(t["id"], chat_id)
+            linked = await api_link_tenant_chat(t["id"], chat_id)
             if linked:
                 await msg.reply_text(
                     get_text(lang, "register_success").format(
@@ -969,7 +1061,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text,
         )
 
-        ticket = api_create_ticket(
+        ticket = await api_create_ticket(
             chat_id=chat_id,
             lang=lang,
             category=category,
@@ -1002,8 +1094,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if cat_key is not None and cat_label is not None:
      # ✅ Must be registered to do duplicate/watch logic
-        tenant = api_get_tenant_by_chat_id(chat_id)  # returns {id, building_id, name, apartment...} or None     
-        if not tenant or int(tenant.get("building_id") or 0) <= 0:
+        if not tenant:
             # Not registered -> do NOT check duplicates / do NOT create ticket
             text_need_reg = get_text(lang, "must_register_first")
             keyboard = [[InlineKeyboardButton(get_text(lang, "btn_register"), callback_data="go_register")]]
@@ -1012,7 +1103,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         building_id = int(tenant["building_id"])
         # First check duplicate
-        dup_info = api_check_duplicate(building_id, cat_label)
+        dup_info = await api_check_duplicate(building_id, cat_label)
         if dup_info.get("duplicate") and dup_info.get("ticket"):
             t = dup_info["ticket"]
             dup_id = t["id"]
@@ -1058,7 +1149,6 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ]
         ]
 
-        tenant = api_get_tenant_by_chat_id(chat_id)
         if not tenant:
             keyboard_rows.append(
                 [
@@ -1077,7 +1167,7 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
     # In private chat, show main menu
-    keyboard = build_main_menu_keyboard(chat_id, lang)
+    keyboard = await build_main_menu_keyboard(chat_id, lang, ctx)
     await msg.reply_text(
         get_text(lang, "main_menu"),
         reply_markup=keyboard,
@@ -1090,14 +1180,10 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.effective_message
     chat_id = update.effective_chat.id
 
-    lang = api_get_user_language(chat_id)  # or your existing language getter
-
-    tenant = api_get_tenant_by_chat_id(chat_id)
-    is_registered = bool(
-        tenant
-        and int(tenant.get("building_id") or 0) > 0
-        and (tenant.get("apartment") or "").strip()
-    )
+    ctx = await api_get_bot_context(chat_id)
+    lang = ctx["language"]
+    tenant = ctx["tenant"]
+    is_registered = ctx["is_registered"]
 
     if is_registered:
         txt = get_text(lang, "register_already_linked").format(
@@ -1116,7 +1202,7 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     chat_id = msg.chat_id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
     caption = msg.caption or ""
     if not caption.strip():
@@ -1126,22 +1212,12 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
        return
     # Get best resolution photo
     photo = msg.photo[-1]
-    tg_file = await photo.get_file()
-
-    bio = io.BytesIO()
-    await tg_file.download_to_memory(out=bio)
-    bio.seek(0)
-
-    files = {"file": ("report.jpg", bio, "image/jpeg")}
 
     try:
-        resp = requests.post(f"{API_BASE_URL}/api/upload_image", files=files, timeout=15)
-        if not resp.ok:
-            logger.error("Upload image error: %s %s", resp.status_code, resp.text)
+        image_url = await upload_ticket_photo(photo)
+        if not image_url:
             await msg.reply_text(get_text(lang, "photo_upload_fail"))
             return
-        data = resp.json()
-        image_url = data.get("url")
     except Exception as e:
         logger.exception("Upload image exception: %s", e)
         await msg.reply_text(get_text(lang, "photo_upload_fail"))
@@ -1191,8 +1267,8 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
     ]
 
-    tenant = api_get_tenant_by_chat_id(chat_id)
-    if not tenant:
+    ctx = await api_get_bot_context(chat_id)
+    if not ctx["tenant"]:
         keyboard_rows.append(
             [
                 InlineKeyboardButton(
@@ -1208,9 +1284,9 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def mytickets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
-    data = api_get_my_tickets(chat_id)
+    data = await api_get_my_tickets(chat_id)
     own = data.get("own", [])
     watching = data.get("watching", [])
 
@@ -1240,7 +1316,7 @@ async def mytickets(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
     text = (
         "ShahenBot – Available Commands:\n\n"
@@ -1262,7 +1338,7 @@ async def handle_pay_open(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     chat_id = query.message.chat_id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
     # reset state for payment flow
     context.user_data.pop("pending_ticket", None)
@@ -1285,7 +1361,7 @@ async def handle_pay_method(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     chat_id = query.message.chat_id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
     method = "bank_transfer" if query.data == "pay_method_bank" else "bit"
     logger.info("PAY: method selected=%s chat_id=%s", method, chat_id)    
@@ -1313,7 +1389,7 @@ async def payment_proof_handler(update: Update, context: ContextTypes.DEFAULT_TY
         return
 
     chat_id = msg.chat_id
-    lang = api_get_user_language(chat_id)
+    lang = await api_get_user_language(chat_id)
 
     payment_id = context.user_data.get("payment_id")
     if not payment_id:
@@ -1332,12 +1408,8 @@ async def payment_proof_handler(update: Update, context: ContextTypes.DEFAULT_TY
         return
 
     try:
-        resp = requests.post(
-            f"{API_BASE_URL}/api/payments/{payment_id}/attach_proof",
-            json={"file_id": file_id, "file_type": file_type},
-            timeout=10,
-        )
-        if not resp.ok:
+        resp = await api_attach_payment_proof(payment_id, file_id, file_type)
+        if not resp.is_success:
             logger.error("attach_proof error: %s %s", resp.status_code, resp.text)
             await msg.reply_text(get_text(lang, "payment_proof_upload_fail"))
             return
@@ -1356,12 +1428,12 @@ async def payment_proof_handler(update: Update, context: ContextTypes.DEFAULT_TY
 async def tenants_portal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.effective_message  # ✅ works even if update.message is None
     chat_id = update.effective_chat.id
-    lang = api_get_user_language(chat_id)
-
-    tenant = api_get_tenant_by_chat_id(chat_id)
+    ctx = await api_get_bot_context(chat_id)
+    lang = ctx["language"]
+    tenant = ctx["tenant"]
 
     # must be fully registered
-    if not tenant or int(tenant.get("building_id") or 0) <= 0:
+    if not tenant:
         await msg.reply_text(get_text(lang, "portal_need_register"))
         return
 
@@ -1371,7 +1443,7 @@ async def tenants_portal_command(update: Update, context: ContextTypes.DEFAULT_T
         await msg.reply_text(get_text(lang, "portal_need_register"))
         return
 
-    res = api_create_portal_link(chat_id)
+    res = await api_create_portal_link(chat_id)
     if not res or not res.get("ok") or not res.get("url"):
         await msg.reply_text(get_text(lang, "portal_error"))
         return
@@ -1383,16 +1455,29 @@ async def tenants_portal_command(update: Update, context: ContextTypes.DEFAULT_T
     await msg.reply_text(get_text(lang, "portal_link_ready"), reply_markup=kb)
 
 
-def main():
-    if DISABLE_POLLING:
-        logging.warning("🚫 Telegram polling is DISABLED (DISABLE_POLLING=true)")
-        # Keep process alive on Railway free plan
-        while True:
-            time.sleep(3600)
+async def close_api_client(app):
+    logger.info("Language cache stats: %s", LANG_CACHE.stats())
+    if isinstance(app, ChatOrderedApplication):
+        logger.info("Update processing stats: %s", app.update_stats())
+    await api.aclose()
 
-    load_messages()
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_application(webhook: bool = BOT_MODE == "webhook"):
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .post_shutdown(close_api_client)
+        # different chats in parallel, each chat's updates in order
+        .application_class(ChatOrderedApplication, {"max_concurrent": BOT_CONCURRENCY})
+        .concurrent_updates(BOT_MAX_PENDING_UPDATES)
+    )
+    if TELEGRAM_API_BASE:
+        # e.g. a local fake Bot API when replaying recorded updates
+        builder = builder.base_url(f"{TELEGRAM_API_BASE}/bot").base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+    if webhook:
+        # updates arrive through webhook.py, not getUpdates
+        builder = builder.updater(None)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("register", register))
@@ -1404,6 +1489,27 @@ def main():
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("tenantsportal", tenants_portal_command))
     app.add_error_handler(error_handler)
+    return app
+
+
+def main():
+    if BOT_MODE == "webhook":
+        from webhook import WebhookBridge, run_webhook_server
+
+        load_messages()
+        print(f"ShahenBot webhook mode. API base: {API_BASE_URL}")
+        run_webhook_server(WebhookBridge(build_application(webhook=True)))
+        return
+
+    if DISABLE_POLLING:
+        logging.warning("🚫 Telegram polling is DISABLED (DISABLE_POLLING=true)")
+        # Keep process alive on Railway free plan
+        while True:
+            time.sleep(3600)
+
+    load_messages()
+
+    app = build_application()
 
     print(f"ShahenBot is running. API base: {API_BASE_URL}")
     app.run_polling()   # ✅ NO await
@@ -0,0 +1,85 @@
+"""
+Shared async HTTP client for the ShahenBot web API.
+
+All api_* helpers in ShahenBot.py go through one httpx.AsyncClient, so
+handlers await the Flask API instead of blocking the bot's event loop, and
+every call reuses pooled keep-alive connections.
+"""
+import asyncio
+import os
+
+from dotenv import load_dotenv
+import httpx
+
+load_dotenv()
+
+API_BASE_URL = os.getenv("SHAHEN_API_URL", "http://localhost:5001")
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "20"))
+API_MAX_KEEPALIVE = int(os.getenv("API_MAX_KEEPALIVE", "10"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "3"))
+API_DEFAULT_TIMEOUT = float(os.getenv("API_DEFAULT_TIMEOUT", "10"))
+
+
+class ApiClient:
+    """
+    Thin wrapper over httpx.AsyncClient bound to the web API base URL.
+    timeout= on each call is the read/write budget for that call; connecting
+    is always capped at API_CONNECT_TIMEOUT.
+    """
+
+    def __init__(self, base_url: str = API_BASE_URL, transport: httpx.AsyncBaseTransport | None = None):
+        self.base_url = base_url.rstrip("/")
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        # an AsyncClient is tied to the loop it first ran on
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=API_MAX_CONNECTIONS,
+                    max_keepalive_connections=API_MAX_KEEPALIVE,
+                ),
+                timeout=httpx.Timeout(API_DEFAULT_TIMEOUT, connect=API_CONNECT_TIMEOUT),
+                transport=self._transport,
+            )
+            self._loop = loop
+        return self._client
+
+    def _timeout(self, timeout: float | None):
+        if timeout is None:
+            return httpx.USE_CLIENT_DEFAULT
+        return httpx.Timeout(timeout, connect=min(timeout, API_CONNECT_TIMEOUT))
+
+    async def get(self, path: str, params: dict | None = None, timeout: float | None = None) -> httpx.Response:
+        return await self._get_client().get(path, params=params, timeout=self._timeout(timeout))
+
+    async def post(
+        self,
+        path: str,
+        json: dict | None = None,
+        files: dict | None = None,
+        timeout: float | None = None,
+    ) -> httpx.Response:
+        return await self._get_client().post(path, json=json, files=files, timeout=self._timeout(timeout))
+
+    async def download(self, url: str, out, chunk_size: int = 64 * 1024, timeout: float | None = None) -> int:
+        """
+        Stream an absolute URL (e.g. a Telegram file) into the writable file
+        object `out`, one chunk at a time. Returns the number of bytes written.
+        """
+        size = 0
+        async with self._get_client().stream("GET", url, timeout=self._timeout(timeout)) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.aiter_bytes(chunk_size):
+                out.write(chunk)
+                size += len(chunk)
+        return size
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
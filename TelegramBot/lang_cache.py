@@ -0,0 +1,58 @@
+"""
+Bounded TTL + LRU cache for per-chat language codes.
+
+Almost every bot update starts by looking up the chat's language; caching it
+in-process removes that API round trip from the hot path. Entries expire
+after `ttl` seconds so a language changed elsewhere is picked up eventually,
+and the least recently used chats are dropped beyond `maxsize`.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class LanguageCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[int, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id: int) -> str | None:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(chat_id)
+            if item is None or item[1] <= now:
+                if item is not None:
+                    del self._data[chat_id]
+                self.misses += 1
+                return None
+            self._data.move_to_end(chat_id)
+            self.hits += 1
+            return item[0]
+
+    def set(self, chat_id: int, lang: str) -> None:
+        with self._lock:
+            self._data[chat_id] = (lang, time.monotonic() + self.ttl)
+            self._data.move_to_end(chat_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, chat_id: int) -> None:
+        with self._lock:
+            self._data.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
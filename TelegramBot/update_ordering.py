@@ -0,0 +1,113 @@
+"""
+Concurrent update handling with per-chat ordering.
+
+python-telegram-bot (20.3) either handles updates strictly one after
+another or fully concurrently. ChatOrderedApplication sits in between:
+updates from different chats run in parallel (at most `max_concurrent`
+handlers at once), while updates from the same chat are handled one at a
+time, in arrival order, so multi-step flows kept in context.user_data
+(building_request_step, verify_step, payment_step, ...) never interleave.
+"""
+import asyncio
+import os
+
+from telegram import Update
+from telegram.ext import Application
+
+BOT_CONCURRENCY = int(os.getenv("BOT_CONCURRENCY", "16"))
+# PTB's own cap on update tasks inside process_update (running + waiting for their chat)
+BOT_MAX_PENDING_UPDATES = int(os.getenv("BOT_MAX_PENDING_UPDATES", "512"))
+
+
+def update_chat_key(update: object) -> int | None:
+    """The chat (or, failing that, user) an update belongs to; None = no ordering needed."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedApplication(Application):
+    """
+    Build with
+        ApplicationBuilder()
+            .application_class(ChatOrderedApplication, {"max_concurrent": n})
+            .concurrent_updates(BOT_MAX_PENDING_UPDATES)
+    """
+
+    def __init__(self, *args, max_concurrent: int = BOT_CONCURRENCY, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_concurrent = max(1, max_concurrent)
+        self._handler_slots = asyncio.Semaphore(self.max_concurrent)
+        # chat_id -> [lock, updates holding or waiting for it]
+        self._chat_locks: dict[int, list] = {}
+        self._running_updates = 0
+        self._waiting_updates = 0
+        self._inflight = 0
+        self._peak_running = 0
+        self._peak_pending = 0
+        self._processed = 0
+
+    async def process_update(self, update: object) -> None:
+        self._inflight += 1
+        self._peak_pending = max(self._peak_pending, self._inflight - self._running_updates)
+        try:
+            await self._process_in_order(update)
+        finally:
+            self._inflight -= 1
+
+    async def _process_in_order(self, update: object) -> None:
+        key = update_chat_key(update)
+        if key is None:
+            await self._process_with_slot(update)
+            return
+
+        # take the chat's lock before yielding to the loop, so same-chat
+        # updates line up in the order the fetcher created their tasks
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self._waiting_updates += 1
+        waiting = True
+        try:
+            async with entry[0]:
+                self._waiting_updates -= 1
+                waiting = False
+                await self._process_with_slot(update)
+        finally:
+            if waiting:
+                self._waiting_updates -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chat_locks.pop(key, None)
+
+    async def _process_with_slot(self, update: object) -> None:
+        async with self._handler_slots:
+            self._running_updates += 1
+            self._peak_running = max(self._peak_running, self._running_updates)
+            try:
+                await super().process_update(update)
+            finally:
+                self._running_updates -= 1
+                self._processed += 1
+
+    def update_stats(self) -> dict:
+        """
+        Queue depth and concurrency metrics. queued: not yet picked up from
+        update_queue; pending: picked up, waiting for their chat or a slot.
+        """
+        return {
+            "queued": self.update_queue.qsize(),
+            "pending": self._inflight - self._running_updates,
+            "running": self._running_updates,
+            "waiting_for_chat": self._waiting_updates,
+            "active_chats": len(self._chat_locks),
+            "processed": self._processed,
+            "peak_running": self._peak_running,
+            "peak_pending": self._peak_pending,
+            "max_concurrent": self.max_concurrent,
+        }
@@ -0,0 +1,226 @@
+"""
+Webhook ingestion for ShahenBot.
+
+Telegram POSTs each update to WEBHOOK_PATH. The view checks the
+X-Telegram-Bot-Api-Secret-Token header, parses the update and drops it on
+the Application's update_queue, answering at once; the handlers run on
+the bot's own event loop in a background thread.
+
+Run it as its own process:
+    BOT_MODE=webhook python ShahenBot.py
+    gunicorn -w 1 --threads 8 "webhook:create_app()"
+or mount it next to the web app with BOT_WEBHOOK_MOUNT=1 (see mount_webhook).
+
+WEBHOOK_SECRET is required: the bridge refuses to start without one, and
+it is always registered with set_webhook, so only Telegram can post updates.
+
+Handlers keep conversation state in context.user_data, which lives in
+process memory, so exactly one process may ingest updates (one worker).
+"""
+import asyncio
+import hmac
+import logging
+import os
+import re
+import signal
+import threading
+
+from flask import Blueprint, Flask, jsonify, request
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# public URL Telegram should call, e.g. https://bot.example.com (path is appended)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "1000"))
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+
+# what Telegram accepts as secret_token
+_SECRET_RE = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+
+class WebhookBridge:
+    """
+    Runs a python-telegram-bot Application on a private event loop and
+    feeds it updates received over HTTP from any thread.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        secret: str = WEBHOOK_SECRET,
+        max_queue: int = WEBHOOK_MAX_QUEUE,
+        webhook_url: str = WEBHOOK_URL,
+    ):
+        self.application = application
+        self.secret = secret
+        self.max_queue = max_queue
+        self.webhook_url = webhook_url
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+        self._error: BaseException | None = None
+
+    # ---- lifecycle ----
+
+    def start(self, timeout: float = 30) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        if not _SECRET_RE.fullmatch(self.secret or ""):
+            raise RuntimeError("WEBHOOK_SECRET must be set (1-256 characters: A-Z, a-z, 0-9, _ or -)")
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name="bot-webhook-loop", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError("bot application did not start in time")
+        if self._error is not None:
+            raise RuntimeError("bot application failed to start") from self._error
+
+    def _run(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        try:
+            loop.run_until_complete(self._startup())
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            loop.close()
+            return
+        self._ready.set()
+        loop.run_forever()
+        loop.run_until_complete(self._shutdown())
+        loop.close()
+
+    async def _startup(self) -> None:
+        app = self.application
+        await app.initialize()
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()  # starts consuming app.update_queue
+        if self.webhook_url:
+            url = self.webhook_url.rstrip("/") + WEBHOOK_PATH
+            await app.bot.set_webhook(
+                url=url,
+                secret_token=self.secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info("Telegram webhook set to %s", url)
+
+    async def _shutdown(self) -> None:
+        app = self.application
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+    def stop(self, timeout: float | None = 30) -> None:
+        loop, thread = self._loop, self._thread
+        if loop is None or thread is None or not thread.is_alive():
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+    # ---- ingestion ----
+
+    def check_secret(self, header: str | None) -> bool:
+        if not self.secret:
+            return False
+        return hmac.compare_digest((header or "").encode(), self.secret.encode())
+
+    def submit(self, data: dict) -> bool:
+        """Queue one update (Telegram JSON). False when the queue is full."""
+        if self._loop is None or not self._ready.is_set():
+            raise RuntimeError("webhook bridge is not running")
+        queue = self.application.update_queue
+        depth = queue.qsize()
+        if hasattr(self.application, "update_stats"):
+            # picked up from the queue but still waiting for their chat or a slot
+            depth += self.application.update_stats()["pending"]
+        if depth >= self.max_queue:
+            return False
+        update = Update.de_json(data, self.application.bot)
+        self._loop.call_soon_threadsafe(queue.put_nowait, update)
+        return True
+
+
+def create_blueprint(bridge: WebhookBridge, path: str = WEBHOOK_PATH) -> Blueprint:
+    bp = Blueprint("telegram_webhook", __name__)
+
+    @bp.post(path)
+    def telegram_webhook():
+        if not bridge.check_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+            return jsonify({"ok": False, "error": "forbidden"}), 403
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or "update_id" not in data:
+            return jsonify({"ok": False, "error": "bad update"}), 400
+
+        if not bridge.submit(data):
+            # Telegram redelivers on non-2xx, so back off instead of dropping
+            logger.warning("webhook queue full, rejecting update %s", data.get("update_id"))
+            return jsonify({"ok": False, "error": "busy"}), 503, {"Retry-After": "5"}
+
+        return jsonify({"ok": True}), 200
+
+    return bp
+
+
+def _default_bridge() -> WebhookBridge:
+    # imported lazily: ShahenBot reads BOT_TOKEN and the API URL at import time
+    from ShahenBot import build_application, load_messages
+
+    load_messages()
+    return WebhookBridge(build_application(webhook=True))
+
+
+def create_app(bridge: WebhookBridge | None = None) -> Flask:
+    """Standalone webhook server (also a gunicorn app factory)."""
+    bridge = bridge or _default_bridge()
+    bridge.start()
+
+    app = Flask(__name__)
+    app.register_blueprint(create_blueprint(bridge))
+
+    @app.get("/healthz")
+    def healthz():
+        application = bridge.application
+        if hasattr(application, "update_stats"):
+            return jsonify({"ok": True, **application.update_stats()})
+        return jsonify({"ok": True, "queued": application.update_queue.qsize()})
+
+    app.extensions["telegram_webhook"] = bridge
+    return app
+
+
+def mount_webhook(flask_app: Flask, bridge: WebhookBridge | None = None) -> WebhookBridge:
+    """Serve the webhook from an existing Flask app (e.g. the ShahenBot web app)."""
+    bridge = bridge or _default_bridge()
+    bridge.start()
+    flask_app.register_blueprint(create_blueprint(bridge))
+    flask_app.extensions["telegram_webhook"] = bridge
+    return bridge
+
+
+def run_webhook_server(bridge: WebhookBridge, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+    from werkzeug.serving import make_server
+
+    def _terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    app = create_app(bridge)
+    server = make_server(host, port, app, threaded=True)
+    signal.signal(signal.SIGTERM, _terminate)
+    logger.info("Webhook server listening on %s:%s%s", host, port, WEBHOOK_PATH)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        bridge.stop()
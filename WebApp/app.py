@@ -8,11 +8,10 @@ import secrets
 import shutil
 import sqlite3
 import string
-from flask import Response, flash, send_file, session, abort
+from flask import Response, flash, send_file, send_from_directory, session, abort
 from dotenv import load_dotenv
 import requests
-import uuid
-from werkzeug.utils import secure_filename
+from urllib.parse import urlparse
 
 from flask import (
     Flask,
@@ -28,7 +27,6 @@ from shahenbot_db import (
     approve_payment_db,
     attach_payment_proof_db,
     cast_vote_db,
-    compute_missing_tenant_fields,
     create_announcement_db,
     create_building_request_db,
     create_or_update_building_admin_staff_user,
@@ -40,10 +38,20 @@ from shahenbot_db import (
     delete_building_request_db,
     get_building_by_unique_db,
     get_building_request_db,
+    get_bot_context_db,
+    change_ticket_status_db,
+    create_delivery_job_messages_db,
+    get_ticket_recipients_db,
+    get_telegram_media_db,
+    get_upload_blob_db,
+    mark_telegram_media_stored_db,
+    register_telegram_media_db,
     get_buildings_db,
-    get_due_tenants_db,
+    get_tenant_dues_db,
     get_payment_by_id_db,
     get_payments_history_db,
+    get_payments_history_totals_db,
+    rebuild_payments_rollup_db,
     get_pending_payments_db,
     get_poll_with_options_db,
     get_recipients_chat_ids_by_group_db,
@@ -51,8 +59,7 @@ from shahenbot_db import (
     get_tenant_by_id_db,
     get_tenant_portal_token_db,
     get_tenants_by_building_apartment_db,
-    get_tenants_due_this_month_db,
-    get_tenants_summary_db,
+    get_dashboard_summary_db,
     get_user_by_email_db,
     get_user_by_id_db,
     init_db,
@@ -68,7 +75,6 @@ from shahenbot_db import (
     list_polls_db,
     list_tenant_payments_db,
     list_tenant_tickets_db,
-    mark_poll_sent_db,
     mark_request_approved_db,
     mark_request_rejected_db,
     mark_tenant_portal_token_used_db,
@@ -81,8 +87,9 @@ from shahenbot_db import (
     set_user_language_db,
     create_ticket_db,
     get_tickets_db,
+    next_page_cursor,
+    ticket_cursor_keys,
     update_tenant_name_db,
-    update_ticket_status_db,
     update_ticket_description_db,
     get_ticket_by_id_db,
     get_tenants_db,
@@ -93,7 +100,6 @@ from shahenbot_db import (
     link_tenant_chat_db,
     find_open_ticket_by_category_db,
     add_ticket_watcher_db,              
-    get_ticket_watchers_db,
     get_tickets_for_chat_db,
     create_building_db,
     list_buildings_db,
@@ -110,23 +116,47 @@ from shahenbot_db import (
     backfill_building_ids_db,
         get_tenant_by_chat_id_db,
     should_add_payment_cta,
+    checkpoint_db,
+    release_thread_connection,
+    create_delivery_job_db,
+    get_delivery_job_db,
+    get_poll_delivery_db,
+    list_delivery_messages_db,
+    queue_poll_delivery_db,
 )
+from delivery import configure_dispatcher, ensure_dispatcher, wake_dispatcher
+from images import is_image, output_extension, submit_image, thumb_name
+from proof_cache import get_proof_cache
+from reminders import REMINDER_DAYS_AHEAD, run_payment_reminders, start_reminder_scheduler
+from upload_store import blob_sha256, gc_uploads, process_upload, store_chunks, store_upload
+from telegram_client import get_telegram_client
 
 
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), "static", "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Telegram bots may download files up to 20 MB
+TELEGRAM_MEDIA_MAX_BYTES = int(os.getenv("TELEGRAM_MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+MEDIA_CHUNK_SIZE = 64 * 1024
+# largest request body accepted at all (Flask answers 413 beyond it)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(12 * 1024 * 1024)))
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
 
 # Initialize Flask app
 app = Flask(__name__)
 
 app.secret_key = os.getenv("FLASK_SECRET", "change_me_please")
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
 
 
-# Initialize DB tables on startup
+@app.teardown_appcontext
+def release_db_connection(exc):
+    # hand this worker thread's pooled SQLite connection back after every request
+    release_thread_connection()
+
+
+# Apply pending schema migrations (one query when already up to date)
 init_db()
 
 def ensure_super_admin():
@@ -140,7 +170,6 @@ def ensure_super_admin():
         create_staff_user_db(username, password, "super_admin", None)
 
 # call after init_db()
-init_db()
 ensure_super_admin()
 
 
@@ -155,21 +184,36 @@ def send_telegram_message(chat_id: int, text: str, buttons: list | None = None):
         print("BOT_TOKEN not set, cannot send Telegram messages")
         return
 
-    payload = {"chat_id": chat_id, "text": text}
-    if buttons:
-        payload["reply_markup"] = {"inline_keyboard": buttons}
+    reply_markup = {"inline_keyboard": buttons} if buttons else None
 
     try:
-        resp = requests.post(
-            f"{TELEGRAM_API}/sendMessage",
-            json=payload,
-            timeout=10,
-        )
+        resp = get_telegram_client().send_message(chat_id, text, reply_markup)
         if not resp.ok:
             print("Telegram sendMessage error:", resp.status_code, resp.text)
     except Exception as e:
         print("Telegram sendMessage exception:", e)
 
+def deliver_telegram_message(chat_id: int, text: str, reply_markup: dict | None = None) -> dict:
+    """sendMessage for the outbox dispatcher (see TelegramClient.deliver)."""
+    return get_telegram_client().deliver(chat_id, text, reply_markup)
+
+# Drain the Telegram outbox in the background (set OUTBOX_DISPATCHER=0 to run it elsewhere).
+# Each worker starts its dispatcher on its first request, not here at import.
+if os.getenv("OUTBOX_DISPATCHER", "1") != "0":
+    configure_dispatcher(deliver_telegram_message)
+
+    @app.before_request
+    def start_outbox_dispatcher():
+        ensure_dispatcher()
+
+# Queue due payment reminders every REMINDER_INTERVAL_SECONDS (opt-in). Started on
+# each worker's first request; a lease in the database lets only one of them run it.
+if os.getenv("PAYMENT_REMINDERS", "0") == "1":
+
+    @app.before_request
+    def start_payment_reminders():
+        start_reminder_scheduler(on_queued=wake_dispatcher)
+
 # User Helper
 def current_user():
     # 1) staff user (super_admin / system admin)
@@ -462,14 +506,17 @@ def api_get_tickets():
     status = request.args.get("status")  # optional
     category = request.args.get("category")  # optional
     search = request.args.get("search")  # optional
+    cursor = request.args.get("cursor")  # optional, next_cursor of the previous page
 
     tickets = get_tickets_db(
         limit=limit,
         status=status,
         category=category,
         search=search,
+        cursor=cursor,
     )
-    return jsonify({"tickets": tickets})
+    next_cursor = next_page_cursor(tickets, limit, *ticket_cursor_keys(search))
+    return jsonify({"tickets": tickets, "next_cursor": next_cursor})
 
 @app.get("/api/tickets/by_chat/<int:chat_id>")
 def api_tickets_by_chat(chat_id: int):
@@ -524,15 +571,108 @@ def api_upload_image():
     if f.filename == "":
         return jsonify({"error": "empty_filename"}), 400
 
-    ext = os.path.splitext(f.filename)[1] or ".jpg"
-    filename = secure_filename(f"{uuid.uuid4().hex}{ext}")
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
-    f.save(save_path)
+    if not is_image(f.stream):
+        return jsonify({"error": "not_an_image"}), 400
+
+    # content-addressed, stored under the extension of the format it gets re-encoded to
+    rel_path, created = store_upload(f.stream, UPLOAD_FOLDER, output_extension())
+    blob = None if created else get_upload_blob_db(blob_sha256(rel_path))
+    if blob and blob["processed_rel_path"]:
+        # the same photo was uploaded and processed before
+        rel_path = blob["processed_rel_path"]
+    else:
+        # resize / strip EXIF / thumbnail in the image pool; the original is served meanwhile
+        submit_image(process_upload, UPLOAD_FOLDER, rel_path)
 
     # public URL (assuming /static is served)
-    url = url_for("static", filename=f"uploads/{filename}", _external=True)
+    url = url_for("static", filename=f"uploads/{rel_path}", _external=True)
     return jsonify({"url": url})
 
+@app.post("/api/upload_image_ref")
+def api_upload_image_ref():
+    """
+    Register a Telegram photo by file_id instead of uploading its bytes.
+    The file is fetched from Telegram the first time its URL is opened.
+    """
+    data = request.json or {}
+    file_id = (data.get("file_id") or "").strip()
+    file_unique_id = (data.get("file_unique_id") or "").strip()
+    if not file_id or not file_unique_id:
+        return jsonify({"error": "missing_fields"}), 400
+
+    register_telegram_media_db(file_id, file_unique_id)
+    url = url_for("telegram_media", file_unique_id=file_unique_id, _external=True)
+    return jsonify({"url": url})
+
+def fetch_telegram_media(file_id: str, file_unique_id: str) -> str | None:
+    """
+    Stream a Telegram file into the upload store chunk by chunk (memory stays
+    at one chunk whatever the file size). Returns its path there, or None.
+    """
+    file_path = tg_get_file_path(file_id)
+    if not file_path:
+        return None
+
+    try:
+        r = get_telegram_client().download_file(file_path)
+    except requests.RequestException:
+        return None
+    try:
+        if not r.ok:
+            return None
+        ext = os.path.splitext(file_path)[1].lower() or ".jpg"
+        rel_path, _created = store_chunks(
+            r.iter_content(chunk_size=MEDIA_CHUNK_SIZE), UPLOAD_FOLDER, ext, max_bytes=TELEGRAM_MEDIA_MAX_BYTES
+        )
+        return rel_path
+    except (requests.RequestException, ValueError, OSError) as e:
+        app.logger.warning("fetching telegram media %s failed: %s", file_unique_id, e)
+        return None
+    finally:
+        r.close()
+
+@app.get("/media/telegram/<file_unique_id>")
+def telegram_media(file_unique_id: str):
+    m = get_telegram_media_db(file_unique_id)
+    if not m:
+        abort(404)
+
+    stored_name = m.get("stored_name")
+    if not m.get("blob_sha256") or not os.path.exists(os.path.join(UPLOAD_FOLDER, stored_name)):
+        # first view, collected by gc_uploads, or fetched before media went through the store
+        fetched = fetch_telegram_media(m["file_id"], file_unique_id)
+        stored_name = fetched and mark_telegram_media_stored_db(file_unique_id, blob_sha256(fetched))
+        if not stored_name:
+            abort(404)
+        if stored_name == fetched:
+            # not processed yet: resize / strip EXIF / thumbnail like uploaded photos
+            submit_image(process_upload, UPLOAD_FOLDER, fetched)
+
+    if request.args.get("thumb") and os.path.exists(os.path.join(UPLOAD_FOLDER, thumb_name(stored_name))):
+        stored_name = thumb_name(stored_name)
+    return send_from_directory(UPLOAD_FOLDER, stored_name, max_age=86400)
+
+@app.errorhandler(413)
+def request_too_large(e):
+    if request.path.startswith("/api/"):
+        return jsonify({"error": "too_large", "max_bytes": MAX_UPLOAD_BYTES}), 413
+    return e
+
+@app.template_filter("thumb_url")
+def thumb_url_filter(image_url: str | None) -> str | None:
+    """Thumbnail for a ticket image URL, or the image itself if it has none (yet)."""
+    if not image_url:
+        return image_url
+    path = urlparse(image_url).path
+    if path.startswith("/media/telegram/"):
+        return f"{image_url}?thumb=1"
+    if path.startswith("/static/uploads/"):
+        name = thumb_name(os.path.basename(path))
+        rel_dir = os.path.dirname(path[len("/static/uploads/"):])
+        if os.path.exists(os.path.join(UPLOAD_FOLDER, rel_dir, name)):
+            return image_url[: len(image_url) - len(os.path.basename(path))] + name
+    return image_url
+
 # ───────────────────────────────────────────────
 #   Building ADMIN DASHBOARD (HTML) – TICKETS
 # ───────────────────────────────────────────────
@@ -550,29 +690,25 @@ def building_admin_dashboard():
     category = request.args.get("category") or ""
     search = request.args.get("search") or ""
     limit = int(request.args.get("limit") or "100")
+    cursor = request.args.get("cursor") or None
 
     status_options = ["","open", "in_progress", "closed"]
     category_options = ["","🚗 בעיית חניה","🛗 בעיית מעלית","🚰 מים / אינסטלציה", "🔊 רעש / שכנים מרעישים"]
 
 
     building_filter = scoped_building_id(u)
-    tenants = get_tenants_summary_db(building_filter)
-    due_tenants = get_tenants_due_this_month_db(building_filter)
+    summary = get_dashboard_summary_db(building_filter)
     buildings = list_buildings_db() if role == "super_admin" else []
 
-    tenants_missing = []
-    for t in tenants:
-        miss = compute_missing_tenant_fields(t)
-        if miss:
-            tenants_missing.append({**t, "missing": miss})
-
     tickets = get_tickets_db(
         limit=limit,
         status=status if status else None,
         category=category if category else None,
         search=search if search else None,
         building_id=building_filter,
+        cursor=cursor,
     )
+    next_cursor = next_page_cursor(tickets, limit, *ticket_cursor_keys(search or None))
 
     return render_template(
         "building_admin_dashboard.html",
@@ -582,11 +718,11 @@ def building_admin_dashboard():
         status_options=status_options,
         category_options=category_options,        
         search=search,
-        tenants=tenants,
-        tenants_missing=tenants_missing,
-        due_tenants=due_tenants,
+        summary=summary,
         buildings=buildings,
         limit=limit,
+        cursor=cursor,
+        next_cursor=next_cursor,
         current_user=u,
     )
 
@@ -632,52 +768,45 @@ def api_create_building_request():
 # ───────────────────────────────────────────────
 #   ADMIN: UPDATE TICKET STATUS + Telegram notify
 # ───────────────────────────────────────────────
-@app.post("/admin/tickets/<int:ticket_id>/status")
-def admin_update_status(ticket_id):
-    new_status = request.form.get("status")
-
-    old_ticket = get_ticket_by_id_db(ticket_id)
-    old_status = old_ticket["status"] if old_ticket else None
+def build_status_notifications(ticket: dict, recipients: list[dict]) -> list[dict]:
+    """Per-recipient status message (+ pay button when due), built in memory."""
+    # Simple text in Hebrew for now, can be multilingual later
+    notify_text = (
+        f"עדכון דיווח #{ticket['id']}:\n"
+        f"קטגוריה: {ticket['category']}\n"
+        f"סטטוס חדש: {ticket['status']}\n\n"
+        f"תיאור:\n{ticket['description']}"
+    )
 
-    update_ticket_status_db(ticket_id, new_status)
-    ticket = get_ticket_by_id_db(ticket_id)
+    messages = []
+    for rcp in recipients:
+        text = notify_text
+        reply_markup = None
 
-    # Notify only if status actually changed
-    if ticket and old_status != new_status:
-        chat_id_reporter = ticket["chat_id"]
-        watchers = get_ticket_watchers_db(ticket_id)
-
-        recipients = set(watchers)
-        if chat_id_reporter:
-            recipients.add(chat_id_reporter)
-
-        # Simple text in Hebrew for now, can be multilingual later
-        category = ticket["category"]
-        desc = ticket["description"]
-        status_txt = new_status
-
-        notify_text = (
-            f"עדכון דיווח #{ticket_id}:\n"
-            f"קטגוריה: {category}\n"
-            f"סטטוס חדש: {status_txt}\n\n"
-            f"תיאור:\n{desc}"
-        )
+        tenant = rcp["tenant"]
+        show_pay, reason = should_add_payment_cta(tenant, has_pending=rcp["has_pending"]) if tenant else (False, None)
+        if show_pay:
+            text += f"\n\n💡 {reason}"
+            reply_markup = {"inline_keyboard": [[{"text": "💳 תשלום ועד", "callback_data": "pay_open"}]]}
 
-        #for cid in recipients:
-        #    send_telegram_message(cid, notify_text)
+        messages.append({"chat_id": rcp["chat_id"], "text": text, "reply_markup": reply_markup})
+    return messages
 
-        for cid in recipients:
-            text = notify_text
-            buttons = None
-
-            tenant = get_tenant_by_chat_id_db(cid)
-            show_pay, reason = should_add_payment_cta(tenant) if tenant else (False, None)
+@app.post("/admin/tickets/<int:ticket_id>/status")
+def admin_update_status(ticket_id):
+    new_status = request.form.get("status")
 
-            if show_pay:
-                text += f"\n\n💡 {reason}"
-                buttons = [[{"text": "💳 תשלום ועד", "callback_data": "pay_open"}]]
+    changed = change_ticket_status_db(ticket_id, new_status)
 
-            send_telegram_message(cid, text, buttons=buttons)
+    # Notify only if status actually changed
+    if changed and changed["old_status"] != new_status:
+        ticket = changed["ticket"]
+        recipients = get_ticket_recipients_db(ticket_id, ticket["chat_id"])
+        messages = build_status_notifications(ticket, recipients)
+        if messages:
+            # the outbox dispatcher sends them; the admin doesn't wait for Telegram
+            create_delivery_job_messages_db("ticket_status", ticket_id, ticket["building_id"], messages)
+            wake_dispatcher()
 
     return redirect(url_for("building_admin_dashboard"))
 
@@ -703,6 +832,7 @@ def admin_tenants():
 
     search = (request.args.get("search") or "").strip()
     limit = int(request.args.get("limit") or "200")
+    cursor = request.args.get("cursor") or None
 
     building_filter = scoped_building_id(u)
     buildings = list_buildings_db(limit=500)
@@ -711,13 +841,17 @@ def admin_tenants():
         limit=limit,
         search=search if search else None,
         building_id=building_filter,
+        cursor=cursor,
     )
+    next_cursor = next_page_cursor(tenants, limit, "sort_apartment", "name", "id")
 
     return render_template(
         "tenants.html",
         tenants=tenants,
         search=search,
         limit=limit,
+        cursor=cursor,
+        next_cursor=next_cursor,
         current_user=u,
         scoped_building_id_value=building_filter,
                 buildings = buildings,
@@ -801,6 +935,11 @@ def api_tenants_by_apartment(apartment: str):
     tenants = get_tenants_by_apartment_db(apartment, only_without_chat=only_without_chat)
     return jsonify({"tenants": tenants})
 
+@app.get("/api/bot/context/<int:chat_id>")
+def api_bot_context(chat_id: int):
+    """Language + tenant + registration + payment CTA for one bot update, in one round trip."""
+    return jsonify(get_bot_context_db(chat_id)), 200
+
 @app.get("/api/tenants/by_chat/<int:chat_id>")
 def api_tenant_by_chat(chat_id: int):
     t = get_tenant_by_chat_id_db(chat_id)
@@ -1097,23 +1236,32 @@ def admin_payments():
 
     year = request.args.get("year", type=int)
     month = request.args.get("month", type=int)
+    pending_cursor = request.args.get("pending_cursor") or None
+    history_cursor = request.args.get("history_cursor") or None
+    page_size = 50
 
-    payments = get_pending_payments_db(building_id)
-    due_now = get_due_tenants_db(building_id, days_ahead=0)
-    due_soon = get_due_tenants_db(building_id, days_ahead=14)
-    history = get_payments_history_db(building_id, year, month)
+    payments = get_pending_payments_db(building_id, limit=page_size, cursor=pending_cursor)
+    dues = get_tenant_dues_db(building_id, days_ahead=14)
+    history = get_payments_history_db(building_id, year, month, limit=page_size, cursor=history_cursor)
 
-    total_sum = sum((p["amount_cents"] or 0) for p in history) / 100.0
+    totals = get_payments_history_totals_db(building_id, year, month)
+    total_sum = totals["sum_cents"] / 100.0
 
     return render_template(
         "admin_payments.html",
         buildings=buildings,
         building_id=building_id,
         payments=payments,
-        due_now=due_now,
-        due_soon=due_soon,
+        due_now=dues["due_now"],
+        due_soon=dues["due_soon"],
         history=history,
         total_sum=total_sum,
+        history_count=totals["count"],
+        totals_by_method=totals["by_method"],
+        pending_cursor=pending_cursor,
+        history_cursor=history_cursor,
+        next_pending_cursor=next_page_cursor(payments, page_size, "created_ts", "id"),
+        next_history_cursor=next_page_cursor(history, page_size, "created_ts", "id"),
         year=year,
         month=month,
         current_user=u,
@@ -1188,11 +1336,10 @@ def admin_reject_payment(payment_id):
 
 
 def tg_get_file_path(file_id: str) -> str | None:
-    r = requests.get(f"{TELEGRAM_API}/getFile", params={"file_id": file_id}, timeout=10)
-    if not r.ok:
+    try:
+        return get_telegram_client().get_file_path(file_id)
+    except requests.RequestException:
         return None
-    j = r.json() or {}
-    return (j.get("result") or {}).get("file_path")
 
 @app.get("/admin/payments/<int:payment_id>/proof")
 def admin_payment_proof(payment_id):
@@ -1204,17 +1351,43 @@ def admin_payment_proof(payment_id):
     if not file_id or file_id == "TEMP":
         abort(404)
 
-    file_path = tg_get_file_path(file_id)
-    if not file_path:
-        abort(404)
-
-    file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
-    r = requests.get(file_url, stream=True, timeout=20)
-    if not r.ok:
-        abort(404)
+    cache = get_proof_cache()
+    entry = cache.get(file_id)
+    if entry is None:
+        file_path = cache.file_path(file_id, tg_get_file_path)
+        if not file_path:
+            abort(404)
 
-    content_type = r.headers.get("Content-Type", "application/octet-stream")
-    return Response(r.iter_content(chunk_size=8192), content_type=content_type)
+        try:
+            r = get_telegram_client().download_file(file_path)
+        except requests.RequestException:
+            abort(502)
+        try:
+            if not r.ok:
+                abort(404)
+            entry = cache.put(
+                file_id,
+                r.iter_content(chunk_size=MEDIA_CHUNK_SIZE),
+                r.headers.get("Content-Type"),
+                file_path,
+            )
+        except requests.RequestException:
+            abort(502)
+        finally:
+            # hand the keep-alive connection back to the pool
+            r.close()
+
+    # conditional=True: If-None-Match -> 304, Range -> 206
+    resp = send_file(
+        entry["path"],
+        mimetype=entry["content_type"],
+        etag=entry["etag"],
+        conditional=True,
+        max_age=3600,
+    )
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
 
 @app.post("/api/tenants/auto_register")
 def api_tenants_auto_register():
@@ -1290,19 +1463,31 @@ def admin_announcements_create():
         flash("חסרים פרטים", "danger")
         return redirect(url_for("admin_announcements", building_id=building_id_scope))
 
-    create_announcement_db(building_id, title, body, target_group)
+    announcement_id = create_announcement_db(building_id, title, body, target_group)
 
     chat_ids = get_recipients_chat_ids_by_group_db(building_id, target_group)
     text = f"📢 {title}\n\n{body}"
 
-    sent = 0
-    for cid in chat_ids:
-        send_telegram_message(cid, text)
-        sent += 1
+    # queued in the outbox; the background dispatcher does the actual sending
+    job_id = create_delivery_job_db("announcement", announcement_id, building_id, chat_ids, text)
+    wake_dispatcher()
 
-    flash(f"ההודעה נשלחה ({sent} נמענים).", "success")
+    flash(f"ההודעה נכנסה לתור השליחה ({len(set(chat_ids))} נמענים, משימה #{job_id}).", "success")
     return redirect(url_for("admin_announcements", building_id=building_id))
 
+@app.get("/admin/delivery_jobs/<int:job_id>")
+@admin_required
+def admin_delivery_job(job_id: int):
+    staff, role, building_id_scope = get_staff_scope()
+
+    job = get_delivery_job_db(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "not_found"}), 404
+    if role == "building_admin" and job["building_id"] != building_id_scope:
+        abort(403)
+
+    return jsonify({"ok": True, "job": job})
+
 # POLLS 
 @app.get("/admin/polls")
 @admin_required
@@ -1356,8 +1541,8 @@ def admin_polls_send(poll_id: int):
     if role == "building_admin" and int(poll["building_id"]) != int(building_id_scope):
         abort(403)
 
-    # ✅ אם כבר נשלח פעם אחת – לא שולחים שוב, עוברים לתוצאות
-    if poll.get("sent_at"):
+    # ✅ נשלח לפני שהיה תור שליחה – אין רשומות משלוח, לא שולחים שוב
+    if poll.get("sent_at") and not get_poll_delivery_db(poll_id):
         flash("ההצבעה כבר נשלחה. מציג תוצאות.", "info")
         return redirect(url_for("admin_poll_results", poll_id=poll_id))
 
@@ -1367,13 +1552,14 @@ def admin_polls_send(poll_id: int):
     text = f"🗳️ הצבעה חדשה:\n{poll['title']}\n\n{poll.get('description') or ''}\n\nבחר/י אפשרות:"
     buttons = [[{"text": opt["text"], "callback_data": f"poll_{poll_id}_{opt['id']}"}] for opt in poll["options"]]
 
-    for cid in chat_ids:
-        send_telegram_message(cid, text, buttons=buttons)
+    # one delivery row per tenant; sending again only queues tenants who have no row yet
+    res = queue_poll_delivery_db(poll_id, building_id, chat_ids, text, {"inline_keyboard": buttons})
+    wake_dispatcher()
 
-    # מסמן שנשלח
-    mark_poll_sent_db(poll_id)
-
-    flash(f"נשלח לדיירים ({len(chat_ids)}).", "success")
+    if res["created"]:
+        flash(f"ההצבעה נכנסה לתור השליחה ({res['queued']} נמענים).", "success")
+    else:
+        flash(f"ההצבעה כבר בתור השליחה – נוספו {res['queued']} נמענים חדשים.", "info")
     return redirect(url_for("admin_poll_results", poll_id=poll_id))
 
 
@@ -1412,7 +1598,15 @@ def admin_poll_results(poll_id: int):
         abort(403)
 
     results = poll_results_db(poll_id)
-    return render_template("admin_poll_results.html", poll=poll, results=results)
+    delivery = get_poll_delivery_db(poll_id)
+    failed_deliveries = list_delivery_messages_db(delivery["id"], status="failed") if delivery and delivery["failed"] else []
+    return render_template(
+        "admin_poll_results.html",
+        poll=poll,
+        results=results,
+        delivery=delivery,
+        failed_deliveries=failed_deliveries,
+    )
 
 #---Portal---#
 
@@ -1456,7 +1650,7 @@ def tenant_login():
         print("TENANT_LOGIN: rec not found -> /tenant")
         return redirect("/tenant")
 
-    if is_token_expired(rec["expires_at"]):
+    if is_token_expired(rec.get("expires_ts") or rec["expires_at"]):
         print("TENANT_LOGIN: expired -> /tenant")
         return redirect("/tenant")
 
@@ -1665,6 +1859,39 @@ def admin_reset_user():
 
     return redirect(url_for("admin_dashboard"))
 
+@app.post("/admin/dev/uploads/gc")
+def admin_uploads_gc():
+    u = require_super_admin()
+    if not isinstance(u, dict):
+        return u
+
+    dry_run = request.args.get("dry_run") == "1"
+    return jsonify(gc_uploads(UPLOAD_FOLDER, dry_run=dry_run)), 200
+
+@app.post("/admin/dev/reminders/run")
+def admin_run_payment_reminders():
+    u = require_super_admin()
+    if not isinstance(u, dict):
+        return u
+
+    dry_run = request.args.get("dry_run") == "1"
+    report = run_payment_reminders(
+        dry_run=dry_run,
+        days_ahead=request.args.get("days", type=int, default=REMINDER_DAYS_AHEAD),
+        building_id=request.args.get("building_id", type=int),
+    )
+    if report["queued"] and not dry_run:
+        wake_dispatcher()
+    return jsonify(report), 200
+
+@app.post("/admin/dev/payments/rollup/rebuild")
+def admin_rebuild_payments_rollup():
+    u = require_super_admin()
+    if not isinstance(u, dict):
+        return u
+
+    return jsonify({"ok": True, "rows": rebuild_payments_rollup_db()}), 200
+
 @app.get("/admin/dev/download-db")
 def admin_download_db():
     u = require_super_admin()
@@ -1678,6 +1905,8 @@ def admin_download_db():
     if not db_path.exists():
         abort(404, "Database file not found")
 
+    # WAL mode: recent commits may still live in shahenbot.db-wal
+    checkpoint_db()
     shutil.copy2(db_path, backup_path)
 
     return send_file(
@@ -1685,6 +1914,14 @@ def admin_download_db():
         as_attachment=True,
         download_name="shahenbot-backup.db"
     )
+# Optionally ingest the bot's Telegram webhook in this process as well.
+# Conversation state lives in the bot's memory, so run a single worker then.
+if os.getenv("BOT_WEBHOOK_MOUNT") == "1":
+    import sys
+    sys.path.insert(0, os.getenv("BOT_DIR", str(Path(__file__).resolve().parent.parent / "TelegramBot")))
+    from webhook import mount_webhook
+    mount_webhook(app)
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "5001"))
     app.run(host="0.0.0.0", port=port)    
\ No newline at end of file
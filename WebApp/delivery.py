@@ -0,0 +1,246 @@
+"""
+Background sender for the Telegram outbox (outbox_messages / delivery_jobs).
+
+Admin routes only queue a delivery job and return; an OutboxDispatcher
+thread leases due messages from SQLite, sends them from a small thread pool
+within Telegram's rate limits, and records sent / retry / failed.
+
+Every web worker starts a dispatcher, lazily (ensure_dispatcher() on a
+request, or wake_dispatcher() after queueing), never at import: under
+gunicorn --preload an import-time thread would live only in the master.
+Only one of them sends, though: the holder of the "outbox_dispatcher" row in
+scheduler_leases. The rate limits are kept in that process's RateLimiter,
+so N sending workers would mean N times the allowed rate; the others stand
+by and take over once the holder stops renewing. Messages are still claimed
+atomically, so an extra run_once() (tests, a manual drain) never sends a
+message twice. Jobs flagged at_most_once (poll broadcasts) additionally
+never retry a send whose outcome is unknown.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+from shahenbot_db import (
+    acquire_scheduler_lease_db,
+    claim_outbox_batch_db,
+    mark_outbox_failed_db,
+    mark_outbox_retry_db,
+    mark_outbox_sent_db,
+    now_utc_ts,
+    release_scheduler_lease_db,
+    release_thread_connection,
+)
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_LEASE_SECONDS = int(os.getenv("DELIVERY_LEASE_SECONDS", "60"))
+DELIVERY_POLL_SECONDS = float(os.getenv("DELIVERY_POLL_SECONDS", "2"))
+# don't start a send this close to the end of its lease (send timeout + margin)
+DELIVERY_LEASE_MARGIN = int(os.getenv("DELIVERY_LEASE_MARGIN", "15"))
+# Telegram: ~30 messages/s per bot overall, ~1 message/s into the same chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", "1.0"))
+# the sending dispatcher renews its lease between batches once half of it is used, so it
+# must outlast half a lease plus one batch (a batch stops sending after DELIVERY_LEASE_SECONDS)
+DISPATCHER_LEASE = "outbox_dispatcher"
+DISPATCHER_LEASE_SECONDS = int(os.getenv("DISPATCHER_LEASE_SECONDS", str(2 * DELIVERY_LEASE_SECONDS + 30)))
+
+
+class RateLimiter:
+    """
+    Hands out send slots: at most `per_second` overall and one per
+    `per_chat_interval` seconds for any single chat. acquire() blocks
+    until the caller's slot comes up. Counts this process's sends only.
+    """
+
+    def __init__(self, per_second: float, per_chat_interval: float):
+        self._interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._chat_interval = per_chat_interval
+        self._lock = threading.Lock()
+        self._next_global = 0.0
+        self._next_chat: dict[int, float] = {}
+
+    def acquire(self, chat_id: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+            self._next_global = at + self._interval
+            self._next_chat[chat_id] = at + self._chat_interval
+            if len(self._next_chat) > 10000:
+                self._next_chat = {c: t for c, t in self._next_chat.items() if t > now}
+        delay = at - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def penalize(self, chat_id: int, seconds: float) -> None:
+        """Telegram answered 429 for this chat: keep away from it for `seconds`."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._next_chat[chat_id] = max(self._next_chat.get(chat_id, 0.0), until)
+
+
+def retry_delay(attempts: int) -> int:
+    """Exponential backoff with jitter: ~2s, 4s, 8s ... capped at 10 minutes."""
+    base = min(2 ** attempts, 600)
+    return int(base + random.uniform(0, base / 2))
+
+
+class OutboxDispatcher:
+    """
+    send(chat_id, text, reply_markup) -> dict with keys
+        ok: bool, message_id: int | None,
+        retry_after: int | None (Telegram 429), permanent: bool, error: str,
+        ambiguous: bool (no answer from Telegram – it may or may not have sent)
+    """
+
+    def __init__(self, send, workers: int = DELIVERY_WORKERS, limiter: RateLimiter | None = None):
+        self.send = send
+        self.workers = max(1, workers)
+        self.limiter = limiter or RateLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_INTERVAL)
+        self.pid = os.getpid()
+        self.owner = f"{socket.gethostname()}:{self.pid}:{uuid.uuid4().hex[:8]}"
+        self._renew_at = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self) -> None:
+        """New messages were queued – skip the rest of the idle wait."""
+        self._wake.set()
+
+    def run_once(self) -> int:
+        """Claim and deliver one batch inline (no lease); returns how many messages it handled."""
+        with ThreadPoolExecutor(self.workers) as pool:
+            return self._drain_batch(pool)
+
+    def holds_lease(self) -> bool:
+        """Take or renew the sending lease; renewed at half its length, not on every batch."""
+        if time.monotonic() < self._renew_at:
+            return True
+        try:
+            held = acquire_scheduler_lease_db(DISPATCHER_LEASE, self.owner, DISPATCHER_LEASE_SECONDS)
+        finally:
+            release_thread_connection()
+        self._renew_at = time.monotonic() + DISPATCHER_LEASE_SECONDS / 2 if held else 0.0
+        return held
+
+    def _run(self) -> None:
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="outbox-send") as pool:
+            while not self._stop.is_set():
+                held, handled = False, 0
+                try:
+                    held = self.holds_lease()
+                    if held:
+                        handled = self._drain_batch(pool)
+                except Exception:
+                    logger.exception("outbox dispatcher batch failed")
+                if not held:
+                    # standby: check back a few times per lease, whatever wakes us
+                    self._stop.wait(DISPATCHER_LEASE_SECONDS / 4)
+                elif not handled:
+                    self._wake.wait(DELIVERY_POLL_SECONDS)
+                    self._wake.clear()
+        try:
+            release_scheduler_lease_db(DISPATCHER_LEASE, self.owner)
+        finally:
+            release_thread_connection()
+
+    def _drain_batch(self, pool: ThreadPoolExecutor) -> int:
+        try:
+            batch = claim_outbox_batch_db(self.workers * 4, DELIVERY_LEASE_SECONDS)
+        finally:
+            release_thread_connection()
+        if batch:
+            list(pool.map(self._deliver, batch))
+        return len(batch)
+
+    def _deliver(self, msg: dict) -> None:
+        try:
+            self.limiter.acquire(msg["chat_id"])
+            if now_utc_ts() + DELIVERY_LEASE_MARGIN > msg["lease_until_ts"]:
+                # waited too long for a slot – hand it back rather than race the lease
+                mark_outbox_retry_db(msg["id"], now_utc_ts(), "lease expired before send")
+                return
+
+            try:
+                res = self.send(msg["chat_id"], msg["text"], msg["reply_markup"])
+            except Exception as e:
+                res = {"ok": False, "error": str(e), "ambiguous": True}
+
+            if res.get("ok"):
+                mark_outbox_sent_db(msg["id"], res.get("message_id"))
+                return
+
+            error = res.get("error") or "send failed"
+            retry_after = res.get("retry_after")
+            if retry_after:
+                self.limiter.penalize(msg["chat_id"], retry_after)
+
+            if msg["at_most_once"] and res.get("ambiguous"):
+                mark_outbox_failed_db(msg["id"], f"outcome unknown, not retried: {error}")
+            elif res.get("permanent") or msg["attempts"] >= DELIVERY_MAX_ATTEMPTS:
+                mark_outbox_failed_db(msg["id"], error)
+            else:
+                delay = retry_after or retry_delay(msg["attempts"])
+                mark_outbox_retry_db(msg["id"], now_utc_ts() + int(delay), error)
+        except Exception:
+            # row stays leased; claim_outbox_batch_db settles it once the lease runs out
+            logger.exception("outbox delivery of message %s failed", msg.get("id"))
+        finally:
+            release_thread_connection()
+
+
+_DISPATCHER: OutboxDispatcher | None = None
+_DISPATCHER_SEND = None
+_DISPATCHER_LOCK = threading.Lock()
+
+
+def start_dispatcher(send) -> OutboxDispatcher:
+    """Start (once per process, again after a fork) the background outbox dispatcher."""
+    global _DISPATCHER
+    with _DISPATCHER_LOCK:
+        if _DISPATCHER is None or _DISPATCHER.pid != os.getpid():
+            _DISPATCHER = OutboxDispatcher(send)
+        _DISPATCHER.start()
+        return _DISPATCHER
+
+
+def configure_dispatcher(send) -> None:
+    """Register the send function; the thread starts on first use in each process."""
+    global _DISPATCHER_SEND
+    _DISPATCHER_SEND = send
+
+
+def ensure_dispatcher() -> OutboxDispatcher | None:
+    """This process's running dispatcher, started now if needed (None if not configured)."""
+    d = _DISPATCHER
+    if d is not None and d.pid == os.getpid():
+        return d
+    if _DISPATCHER_SEND is None:
+        return None
+    return start_dispatcher(_DISPATCHER_SEND)
+
+
+def wake_dispatcher() -> None:
+    d = ensure_dispatcher()
+    if d is not None:
+        d.wake()
@@ -0,0 +1,116 @@
+"""
+Local stand-in for the Telegram Bot API, for trying the outbox and payment
+reminders without sending real messages.
+
+    python fake_telegram.py --port 8081
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 BOT_TOKEN=test python app.py
+
+Every sendMessage is answered with ok and a fresh message_id and kept in
+FakeTelegramServer.sent. Chats in fail_chat_ids get 403 (bot blocked), and
+with rate_limit_every=n every n-th call gets 429 (retry_after 1).
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeTelegramServer"
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, params: dict) -> None:
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        self._reply(*self.server.answer(method, params))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            params = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            params = {}
+        self._handle(params)
+
+    def do_GET(self):
+        self._handle({k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fail_chat_ids=(), rate_limit_every: int = 0, verbose: bool = False):
+        super().__init__((host, port), _Handler)
+        self.fail_chat_ids = {int(c) for c in fail_chat_ids}
+        self.rate_limit_every = rate_limit_every
+        self.verbose = verbose
+        self.sent: list[dict] = []
+        self._calls = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def answer(self, method: str, params: dict) -> tuple[int, dict]:
+        if self.rate_limit_every and next(self._calls) % self.rate_limit_every == 0:
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": 1}}
+
+        if method == "sendMessage":
+            chat_id = int(params.get("chat_id") or 0)
+            if chat_id in self.fail_chat_ids:
+                return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            with self._lock:
+                message_id = next(self._message_ids)
+                self.sent.append({"message_id": message_id, **params})
+            if self.verbose:
+                print(f"sendMessage -> {chat_id}: {params.get('text')!r}")
+            return 200, {"ok": True, "result": {"message_id": message_id, "chat": {"id": chat_id}}}
+
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}}
+
+        return 200, {"ok": True, "result": True}
+
+    def start(self) -> "FakeTelegramServer":
+        """Serve from a background thread (in-process use)."""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fail-chat", type=int, action="append", default=[], help="answer 403 for this chat_id")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer 429 to every n-th call")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(args.host, args.port, args.fail_chat, args.rate_limit_every, verbose=True)
+    print(f"Fake Telegram Bot API on {server.base_url} (TELEGRAM_API_BASE={server.base_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
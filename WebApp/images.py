@@ -0,0 +1,154 @@
+"""
+Ingest pipeline for ticket photos.
+
+Uploads are stored as received and answered right away; a small worker pool
+then renders each one as a size-bounded JPEG/WebP (orientation applied, EXIF
+and other metadata dropped) plus a thumbnail, and upload_store.process_upload
+stores the result as a blob of its own, "<sha256><ext>" with
+"<sha256>_thumb<ext>" next to it. Until the worker is done the original is
+served.
+
+Needs Pillow; without it files are kept exactly as uploaded and there are
+no thumbnails.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+import io
+import logging
+import os
+import threading
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow is in requirements.txt
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()  # jpeg / webp
+IMAGE_MAX_DIM = int(os.getenv("IMAGE_MAX_DIM", "1600"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(400 * 1024)))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "82"))
+THUMB_DIM = int(os.getenv("THUMB_DIM", "320"))
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "70"))
+# refuse decompression bombs (a 50 MP phone photo is fine)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(64 * 1000 * 1000)))
+
+HAS_PIL = Image is not None
+if HAS_PIL:
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+
+_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp"}
+_PIL_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP"}
+
+
+def output_extension() -> str:
+    """Extension new uploads are stored under (the format they are re-encoded to)."""
+    if not HAS_PIL:
+        return ".jpg"
+    return _EXTENSIONS.get(IMAGE_FORMAT, ".jpg")
+
+
+def thumb_name(name: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}_thumb{ext}"
+
+
+def is_image(stream) -> bool:
+    """Cheap header check (no full decode); True when Pillow is unavailable."""
+    if not HAS_PIL:
+        return True
+    pos = stream.tell()
+    try:
+        with Image.open(stream) as im:
+            return im.width * im.height <= IMAGE_MAX_PIXELS
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return False
+    finally:
+        stream.seek(pos)
+
+
+def _encode(im, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    params = {"quality": quality}
+    if fmt == "JPEG":
+        params.update(optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        params.update(method=4)
+    # no exif= / icc_profile= here, so no metadata is written
+    im.save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+def render_image(path: str, ext: str | None = None) -> dict | None:
+    """
+    Re-encode the image at `path` and its thumbnail in the format of `ext`
+    (default: the file's own extension). Returns {"data", "thumb"} bytes plus
+    sizes, or None if it is not a readable image. The file is left alone.
+    """
+    if not HAS_PIL:
+        return None
+    fmt = _PIL_FORMATS.get((ext or os.path.splitext(path)[1]).lower(), "JPEG")
+    original_size = os.path.getsize(path)
+
+    try:
+        with Image.open(path) as src:
+            # let JPEG decode straight at a reduced scale instead of full size
+            src.draft("RGB", (IMAGE_MAX_DIM, IMAGE_MAX_DIM))
+            im = ImageOps.exif_transpose(src)
+            im = im.convert("RGBA" if fmt == "WEBP" and "A" in im.getbands() else "RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        logger.warning("not processing %s: %s", path, e)
+        return None
+
+    im.thumbnail((IMAGE_MAX_DIM, IMAGE_MAX_DIM), Image.LANCZOS)
+    quality = IMAGE_QUALITY
+    data = _encode(im, fmt, quality)
+    while len(data) > IMAGE_MAX_BYTES and quality > 45:
+        quality -= 10
+        data = _encode(im, fmt, quality)
+
+    thumb = im.copy()
+    thumb.thumbnail((THUMB_DIM, THUMB_DIM), Image.LANCZOS)
+    thumb_data = _encode(thumb, fmt, THUMB_QUALITY)
+
+    return {
+        "data": data,
+        "thumb": thumb_data,
+        "original_bytes": original_size,
+        "bytes": len(data),
+        "thumb_bytes": len(thumb_data),
+        "width": im.width,
+        "height": im.height,
+        "quality": quality,
+    }
+
+
+def _run_logged(job, *args):
+    try:
+        return job(*args)
+    except Exception:
+        logger.exception("image job %s%r failed", job.__name__, args)
+        return None
+
+
+_POOL: ThreadPoolExecutor | None = None
+_POOL_PID: int | None = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Per-process pool (re-created after a gunicorn fork)."""
+    global _POOL, _POOL_PID
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_PID != os.getpid():
+            _POOL = ThreadPoolExecutor(max(1, IMAGE_WORKERS), thread_name_prefix="image")
+            _POOL_PID = os.getpid()
+        return _POOL
+
+
+def submit_image(job, *args) -> Future | None:
+    """Run job(*args) (e.g. upload_store.process_upload) off the request thread."""
+    if not HAS_PIL:
+        return None
+    return _get_pool().submit(_run_logged, job, *args)
@@ -0,0 +1,180 @@
+"""
+Size-bounded on-disk LRU cache for payment proof files.
+
+A proof is a Telegram file_id. The first view resolves it (getFile),
+streams the file from Telegram onto local disk and serves it from there;
+later views, from any worker, are plain local file responses with ETag and
+Range support. Files are evicted least-recently-viewed first once the
+cache holds more than PROOF_CACHE_MAX_BYTES. Telegram file contents never
+change for a given file_id, so entries need no expiry.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+from pathlib import Path
+import threading
+import time
+import uuid
+
+PROOF_CACHE_DIR = os.getenv("PROOF_CACHE_DIR", str(Path(__file__).with_name("proof_cache")))
+PROOF_CACHE_MAX_BYTES = int(os.getenv("PROOF_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+# Telegram guarantees a getFile download path for at least an hour
+FILE_PATH_TTL = int(os.getenv("PROOF_FILE_PATH_TTL", "3000"))
+CHUNK_SIZE = 64 * 1024
+
+
+class ProofCache:
+    """
+    Entries are "<key>.bin" (the bytes) plus "<key>.json" (content type and
+    size). Recency is the .bin file's mtime, bumped on every hit, so all
+    workers share one LRU order.
+    """
+
+    def __init__(self, root: str = PROOF_CACHE_DIR, max_bytes: int = PROOF_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._paths: dict[str, tuple[str, float]] = {}
+        self._total: int | None = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(file_id: str) -> str:
+        return hashlib.sha256(file_id.encode()).hexdigest()
+
+    def _bin(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.bin")
+
+    def _meta(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    # ---- file_path resolution ----
+
+    def file_path(self, file_id: str, resolve) -> str | None:
+        """Telegram file_path for file_id, via resolve(file_id) at most once per TTL."""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._paths.get(file_id)
+            if hit and hit[1] > now:
+                return hit[0]
+        path = resolve(file_id)
+        if path:
+            with self._lock:
+                if len(self._paths) > 10000:
+                    self._paths = {k: v for k, v in self._paths.items() if v[1] > now}
+                self._paths[file_id] = (path, now + FILE_PATH_TTL)
+        return path
+
+    # ---- entries ----
+
+    def get(self, file_id: str) -> dict | None:
+        """{"path", "content_type", "size", "etag"} for a cached proof, else None."""
+        key = self.key(file_id)
+        path = self._bin(key)
+        try:
+            with open(self._meta(key), encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(path)  # mark as recently used
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return {"path": path, "content_type": meta["content_type"], "size": meta["size"], "etag": key}
+
+    def put(self, file_id: str, chunks, content_type: str | None, file_path: str | None = None) -> dict:
+        """Write an entry from an iterable of byte chunks and return it like get()."""
+        key = self.key(file_id)
+        tmp = os.path.join(self.root, f".{uuid.uuid4().hex}.part")
+        size = 0
+        try:
+            with open(tmp, "wb") as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    size += len(chunk)
+            if not content_type or content_type == "application/octet-stream":
+                # Telegram mostly answers octet-stream; the file name knows better
+                content_type = mimetypes.guess_type(file_path or "")[0] or "application/octet-stream"
+            os.replace(tmp, self._bin(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        # metadata last: an entry counts as cached only once its .json exists
+        meta_tmp = f"{self._meta(key)}.{uuid.uuid4().hex}.part"
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump({"content_type": content_type, "size": size}, f)
+        os.replace(meta_tmp, self._meta(key))
+
+        self._account(size)
+        return {"path": self._bin(key), "content_type": content_type, "size": size, "etag": key}
+
+    # ---- eviction ----
+
+    def _account(self, added: int) -> None:
+        with self._lock:
+            if self._total is None:
+                self._total = self._disk_usage()
+            else:
+                self._total += added
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+
+    def _disk_usage(self) -> int:
+        total = 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".bin"):
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def evict(self) -> int:
+        """Drop least recently used entries until under max_bytes; returns bytes freed."""
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".bin"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.name[:-4]))
+        entries.sort()
+
+        total = sum(e[1] for e in entries)
+        freed = 0
+        for _mtime, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in (self._meta(key), self._bin(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            freed += size
+        with self._lock:
+            self._total = total
+        return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+_CACHE: ProofCache | None = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_proof_cache() -> ProofCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ProofCache()
+        return _CACHE
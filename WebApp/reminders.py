@@ -0,0 +1,183 @@
+"""
+Proactive payment reminders.
+
+run_payment_reminders() reads all due tenants with a single dues query
+(get_tenant_dues_db), drops the ones with a payment awaiting approval, and
+queues one Telegram reminder per tenant, payment period and stage
+("upcoming" before the due date, "overdue" after it). payment_reminders
+remembers what was queued, so running it again – hourly, from several web
+workers, or from cron – never reminds anyone twice. Sending is left to the
+outbox dispatcher (delivery.py), which batches and rate-limits the messages.
+
+Run it with PAYMENT_REMINDERS=1 in the web app (ReminderScheduler), from
+the admin route, or by hand / from cron:
+    python reminders.py --dry-run
+Every web worker may start a ReminderScheduler, but only the holder of the
+"payment_reminders" row in scheduler_leases runs it; another worker takes
+over once the holder stops renewing (it exited or hung).
+To try it without Telegram, start fake_telegram.py and point the web app's
+TELEGRAM_API_BASE at it.
+"""
+import argparse
+from datetime import date
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from shahenbot_db import (
+    acquire_scheduler_lease_db,
+    get_tenant_dues_db,
+    is_fully_registered,
+    pending_payment_tenant_ids_db,
+    queue_payment_reminders_db,
+    release_scheduler_lease_db,
+    release_thread_connection,
+)
+
+logger = logging.getLogger(__name__)
+
+# remind this many days before next_payment_date
+REMINDER_DAYS_AHEAD = int(os.getenv("REMINDER_DAYS_AHEAD", "3"))
+REMINDER_INTERVAL_SECONDS = int(os.getenv("REMINDER_INTERVAL_SECONDS", "3600"))
+# scheduler only logs what it would queue
+REMINDER_DRY_RUN = os.getenv("REMINDER_DRY_RUN", "0") == "1"
+
+PAY_BUTTON = {"inline_keyboard": [[{"text": "💳 תשלום ועד", "callback_data": "pay_open"}]]}
+
+
+def reminder_text(stage: str, tenant: dict) -> str:
+    # Hebrew like the other outbox messages, can be multilingual later
+    due = tenant["next_payment_date"]
+    if stage == "overdue":
+        return f"שלום {tenant['name']},\nתשלום ועד הבית שהיה לתשלום ב-{due} עדיין לא התקבל."
+    return f"שלום {tenant['name']},\nתזכורת: תשלום ועד הבית לתשלום ב-{due}."
+
+
+def _chat_id(value) -> int | None:
+    try:
+        cid = int(value)
+    except (TypeError, ValueError):
+        return None
+    return cid if cid > 0 else None
+
+
+def build_payment_reminders(dues: dict, pending_tenant_ids: set[int]) -> list[dict]:
+    """Reminder rows for queue_payment_reminders_db from a get_tenant_dues_db result."""
+    reminders = []
+    for tenant in dues["due_now"] + dues["due_soon"]:
+        chat_id = _chat_id(tenant["chat_id"])
+        if chat_id is None or tenant["id"] in pending_tenant_ids or not is_fully_registered(tenant):
+            continue
+        stage = "overdue" if tenant["next_payment_date"] < dues["today"] else "upcoming"
+        reminders.append({
+            "tenant_id": tenant["id"],
+            "building_id": tenant["building_id"],
+            "chat_id": chat_id,
+            "period_ym": tenant["next_payment_date"][:7],
+            "stage": stage,
+            "text": reminder_text(stage, tenant),
+            "reply_markup": PAY_BUTTON,
+        })
+    return reminders
+
+
+def run_payment_reminders(
+    dry_run: bool = False,
+    days_ahead: int = REMINDER_DAYS_AHEAD,
+    building_id: int | None = None,
+    today: date | None = None,
+) -> dict:
+    """Queue every reminder that is due and not yet sent; returns a report."""
+    dues = get_tenant_dues_db(building_id, days_ahead=days_ahead, today=today)
+    reminders = build_payment_reminders(dues, pending_payment_tenant_ids_db())
+    res = queue_payment_reminders_db(reminders, dry_run=dry_run)
+    return {
+        "today": dues["today"],
+        "until": dues["until"],
+        "candidates": len(dues["due_now"]) + len(dues["due_soon"]),
+        "eligible": len(reminders),
+        "dry_run": dry_run,
+        **res,
+    }
+
+
+REMINDER_LEASE = "payment_reminders"
+
+
+class ReminderScheduler:
+    """
+    Runs run_payment_reminders every `interval` seconds on a background
+    thread, in whichever process holds the scheduler lease.
+    """
+
+    def __init__(self, interval: int = REMINDER_INTERVAL_SECONDS, dry_run: bool = REMINDER_DRY_RUN, on_queued=None):
+        self.interval = max(60, interval)
+        self.dry_run = dry_run
+        self.on_queued = on_queued
+        self.pid = os.getpid()
+        self.owner = f"{socket.gethostname()}:{self.pid}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="payment-reminders", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self) -> dict | None:
+        """One tick: the report if this process holds the lease and ran, else None."""
+        # the lease outlives one interval, so a live holder always renews in time
+        if not acquire_scheduler_lease_db(REMINDER_LEASE, self.owner, 2 * self.interval):
+            return None
+        report = run_payment_reminders(dry_run=self.dry_run)
+        if report["queued"]:
+            logger.info("payment reminders: %s", report)
+            if self.on_queued and not self.dry_run:
+                self.on_queued()
+        return report
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("payment reminder run failed")
+            finally:
+                release_thread_connection()
+            self._stop.wait(self.interval)
+        try:
+            release_scheduler_lease_db(REMINDER_LEASE, self.owner)
+        finally:
+            release_thread_connection()
+
+
+_SCHEDULER: ReminderScheduler | None = None
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def start_reminder_scheduler(on_queued=None) -> ReminderScheduler:
+    """Start (once per process, again after a fork) the background reminder scheduler."""
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None or _SCHEDULER.pid != os.getpid():
+            _SCHEDULER = ReminderScheduler(on_queued=on_queued)
+        _SCHEDULER.start()
+        return _SCHEDULER
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue due payment reminders in the Telegram outbox.")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be queued, change nothing")
+    parser.add_argument("--days", type=int, default=REMINDER_DAYS_AHEAD, help="remind this many days ahead")
+    parser.add_argument("--building", type=int, default=None, help="only this building")
+    args = parser.parse_args()
+    print(json.dumps(run_payment_reminders(args.dry_run, args.days, args.building), ensure_ascii=False, indent=2))
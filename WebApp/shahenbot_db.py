@@ -1,27 +1,223 @@
 # shahenbot_db.py
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta, timezone
+import base64
+import json
+import os
+import queue
+import re
 import secrets
 import sqlite3
+import threading
 from pathlib import Path
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 
 def now_utc_iso():
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+def now_utc_ts() -> int:
+    """Canonical sortable timestamp (epoch seconds, UTC) stored in *_ts columns."""
+    return int(datetime.now(timezone.utc).timestamp())
 DB_PATH = Path(__file__).with_name("shahenbot.db")
 
+# ─────────── Connection pool ───────────
 
-def get_connection():
-    """Return a new SQLite connection."""
-    #return sqlite3.connect(DB_PATH)
-    conn = sqlite3.connect(DB_PATH)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+
+
+class _Connection(sqlite3.Connection):
+    """sqlite3.Connection that can carry per-connection state (see the tenant cache)."""
+
+
+def _open_connection() -> sqlite3.Connection:
+    """Open a raw connection and apply the per-connection PRAGMAs (once)."""
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,  # pooled connections move between threads
+        factory=_Connection,
+    )
     conn.row_factory = sqlite3.Row
-    return conn 
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    return conn
 
-def init_db():
-    """Create tables if they don't exist."""
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+    A thread borrows one connection and reuses it for every nested helper call
+    until the outermost borrower releases it (or the request teardown forces it back).
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, int(max_size))
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def acquire(self) -> sqlite3.Connection:
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None:
+            local.depth += 1
+            return conn
+
+        conn = self._take()
+        local.conn = conn
+        local.depth = 1
+        return conn
+
+    def _take(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return _open_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=DB_POOL_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError("connection pool exhausted")
+
+    def depth(self) -> int:
+        return getattr(self._local, "depth", 0) if getattr(self._local, "conn", None) is not None else 0
+
+    def release(self, force: bool = False):
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            return
+
+        local.depth = 0 if force else local.depth - 1
+        if local.depth > 0:
+            return
+
+        local.conn = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # broken connection – drop it and let the pool open a fresh one
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        self._idle.put(conn)
+
+
+_POOL: ConnectionPool | None = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool (re-created after a gunicorn fork)."""
+    global _POOL
+    pool = _POOL
+    if pool is None or pool.pid != os.getpid():
+        with _POOL_LOCK:
+            if _POOL is None or _POOL.pid != os.getpid():
+                # never reuse connections inherited from the parent process
+                _POOL = ConnectionPool(DB_POOL_SIZE)
+            pool = _POOL
+    return pool
+
+
+class PooledConnection:
+    """
+    Handle returned by get_connection().
+    Behaves like sqlite3.Connection; close() hands the connection back to the pool.
+    """
+
+    __slots__ = ("_conn", "_closed")
+
+    def __init__(self, conn: sqlite3.Connection):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_closed", False)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def close(self):
+        if self._closed:
+            return
+        object.__setattr__(self, "_closed", True)
+        get_pool().release()
+
+
+def get_connection():
+    """Borrow this thread's pooled SQLite connection (close() returns it)."""
+    return PooledConnection(get_pool().acquire())
+
+
+@contextmanager
+def db():
+    """
+    Shared context manager for *_db helpers:
+
+        with db() as conn:
+            conn.execute(...)
+
+    Only the outermost block commits (or rolls back on error), so helpers
+    called inside another helper's transaction join it instead of committing early.
+    """
     conn = get_connection()
-    cur = conn.cursor()
+    outermost = get_pool().depth() == 1
+    try:
+        yield conn
+        if outermost:
+            conn.commit()
+    except Exception:
+        if outermost:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def release_thread_connection():
+    """Force this thread's connection back to the pool (call at request teardown)."""
+    get_pool().release(force=True)
+
+
+def checkpoint_db():
+    """Fold the WAL into the main database file (before copying shahenbot.db)."""
+    with db() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+# ─────────── Schema migrations ───────────
+
+def _migrate_001_base_schema(cur):
+    """Initial schema. Also upgrades databases created before schema_version existed."""
 
     # User settings table (language per chat_id)
     cur.execute(
@@ -297,8 +493,637 @@ def init_db():
     ensure_column(cur, "tenants", "building_id", "INTEGER")
     ensure_column(cur, "polls", "closed_at", "TEXT")
     ensure_column(cur, "polls", "sent_at", "TEXT")
-    conn.commit()
-    conn.close()
+
+
+def _migrate_002_hot_path_indexes(cur):
+    """Composite / covering indexes for the lookups the bot and dashboards hit most."""
+    # get_tenant_by_chat_id_db, link_tenant_chat_db, LEFT JOIN in get_tickets_db
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tenants_chat_id ON tenants(chat_id)")
+    # get_recipients_chat_ids_by_group_db (covering: no table lookup)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tenants_building_type_chat ON tenants(building_id, tenant_type, chat_id)"
+    )
+    # get_tenants_db / get_tenants_summary_db / by_building_apartment
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tenants_building_apartment ON tenants(building_id, apartment, name)"
+    )
+    # dues: get_tenant_dues_db
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tenants_building_next_payment ON tenants(building_id, next_payment_date)"
+    )
+
+    # get_tickets_for_chat_db / list_tenant_tickets_db
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_chat_created ON tickets(chat_id, created_at)")
+    # get_ticket_watchers lookup by watcher (PK is ticket_id, chat_id)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ticket_watchers_chat ON ticket_watchers(chat_id, ticket_id)")
+    # find_open_ticket_by_category_db
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tickets_building_status_category "
+        "ON tickets(building_id, status, category, created_at)"
+    )
+    # get_tickets_db scoped to one building
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_building_created ON tickets(building_id, created_at)")
+
+    # get_pending_payments_db
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_building_created ON payments(status, building_id, created_at)"
+    )
+
+    # polls / announcements per building, poll results
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_polls_building_created ON polls(building_id, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_poll_options_poll ON poll_options(poll_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_poll_votes_poll_option ON poll_votes(poll_id, option_id)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_announcements_building_created ON announcements(building_id, created_at)"
+    )
+
+
+# tickets_fts mirrors each ticket (rowid = tickets.id) plus its tenant's name/apartment.
+# Plain-column FTS5 table; triggers below keep it in sync with tickets and tenants.
+# chat_id and building_id are only there to scope a search (building_id:"7");
+# build_fts_query keeps the user's words to the text columns (_FTS_TEXT_COLUMNS).
+_TICKET_FTS_ROW = """
+    SELECT t.id, t.description, t.category,
+           COALESCE(tn.name, ''), COALESCE(tn.apartment, ''),
+           CAST(t.chat_id AS TEXT), CAST(COALESCE(t.building_id, 0) AS TEXT)
+    FROM tickets t
+    LEFT JOIN tenants tn ON tn.chat_id = t.chat_id
+"""
+
+
+def _migrate_003_tickets_fts(cur):
+    """
+    FTS5 index for the admin ticket search: description, category, tenant
+    name and apartment are searched; chat_id and building_id scope it.
+    """
+    try:
+        cur.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5(
+                description, category, tenant_name, apartment, chat_id, building_id,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """
+        )
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5 – get_tickets_db keeps the LIKE search
+        return
+
+    cur.execute("DELETE FROM tickets_fts")
+    cur.execute(
+        "INSERT INTO tickets_fts (rowid, description, category, tenant_name, apartment, chat_id, building_id)"
+        + _TICKET_FTS_ROW
+    )
+
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_fts_insert AFTER INSERT ON tickets
+        BEGIN
+            INSERT INTO tickets_fts (rowid, description, category, tenant_name, apartment, chat_id, building_id)
+            {_TICKET_FTS_ROW} WHERE t.id = new.id LIMIT 1;
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_fts_update
+        AFTER UPDATE OF description, category, chat_id, building_id ON tickets
+        BEGIN
+            DELETE FROM tickets_fts WHERE rowid = old.id;
+            INSERT INTO tickets_fts (rowid, description, category, tenant_name, apartment, chat_id, building_id)
+            {_TICKET_FTS_ROW} WHERE t.id = new.id LIMIT 1;
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_fts_delete AFTER DELETE ON tickets
+        BEGIN
+            DELETE FROM tickets_fts WHERE rowid = old.id;
+        END
+        """
+    )
+
+    # tenant rename / relink changes the searchable name+apartment of that chat's tickets
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tenants_fts_update
+        AFTER UPDATE OF name, apartment, chat_id ON tenants
+        BEGIN
+            UPDATE tickets_fts SET tenant_name = '', apartment = ''
+            WHERE old.chat_id IS NOT new.chat_id
+              AND rowid IN (SELECT id FROM tickets WHERE chat_id = old.chat_id);
+            UPDATE tickets_fts SET tenant_name = COALESCE(new.name, ''), apartment = COALESCE(new.apartment, '')
+            WHERE rowid IN (SELECT id FROM tickets WHERE chat_id = new.chat_id);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tenants_fts_insert AFTER INSERT ON tenants
+        WHEN new.chat_id IS NOT NULL
+        BEGIN
+            UPDATE tickets_fts SET tenant_name = COALESCE(new.name, ''), apartment = COALESCE(new.apartment, '')
+            WHERE rowid IN (SELECT id FROM tickets WHERE chat_id = new.chat_id);
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_tenants_fts_delete AFTER DELETE ON tenants
+        WHEN old.chat_id IS NOT NULL
+        BEGIN
+            UPDATE tickets_fts SET tenant_name = '', apartment = ''
+            WHERE rowid IN (SELECT id FROM tickets WHERE chat_id = old.chat_id);
+        END
+        """
+    )
+
+
+# Tables that get the canonical created_ts column (epoch seconds).
+_EPOCH_TABLES = ("tickets", "payments", "polls", "announcements", "tenant_portal_tokens")
+
+
+def _migrate_004_epoch_timestamps(cur):
+    """
+    Integer created_ts next to the mixed-format created_at text
+    (now_utc_iso() vs datetime('now')), so ORDER BY / ranges can use indexes.
+    """
+    for table in _EPOCH_TABLES:
+        ensure_column(cur, table, "created_ts", "INTEGER")
+        cur.execute(
+            f"""
+            UPDATE {table}
+            SET created_ts = COALESCE(CAST(strftime('%s', created_at) AS INTEGER), 0)
+            WHERE created_ts IS NULL
+            """
+        )
+        # safety net for inserts that don't pass created_ts explicitly
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_created_ts AFTER INSERT ON {table}
+            WHEN new.created_ts IS NULL
+            BEGIN
+                UPDATE {table}
+                SET created_ts = COALESCE(CAST(strftime('%s', new.created_at) AS INTEGER),
+                                          CAST(strftime('%s', 'now') AS INTEGER))
+                WHERE id = new.id;
+            END
+            """
+        )
+
+    ensure_column(cur, "tenant_portal_tokens", "expires_ts", "INTEGER")
+    cur.execute(
+        """
+        UPDATE tenant_portal_tokens
+        SET expires_ts = COALESCE(CAST(strftime('%s', expires_at) AS INTEGER), 0)
+        WHERE expires_ts IS NULL
+        """
+    )
+
+    # re-key the created_at indexes from migration 2 on created_ts
+    for name in (
+        "idx_tickets_chat_created",
+        "idx_tickets_building_created",
+        "idx_tickets_building_status_category",
+        "idx_payments_status_building_created",
+        "idx_polls_building_created",
+        "idx_announcements_building_created",
+    ):
+        cur.execute(f"DROP INDEX IF EXISTS {name}")
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_chat_created_ts ON tickets(chat_id, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_building_created_ts ON tickets(building_id, created_ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tickets_created_ts ON tickets(created_ts)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tickets_building_status_category_ts "
+        "ON tickets(building_id, status, category, created_ts)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_status_building_created_ts "
+        "ON payments(status, building_id, created_ts)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_polls_building_created_ts ON polls(building_id, created_ts)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_announcements_building_created_ts ON announcements(building_id, created_ts)"
+    )
+
+
+def _migrate_005_poll_tallies(cur):
+    """
+    Per-option vote counters plus polls.total_votes, kept by cast_vote_db,
+    so results read one row per option instead of counting poll_votes.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS poll_option_tallies (
+            poll_id INTEGER NOT NULL,
+            option_id INTEGER NOT NULL,
+            votes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (poll_id, option_id),
+            FOREIGN KEY (option_id) REFERENCES poll_options(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        """
+    )
+    ensure_column(cur, "polls", "total_votes", "INTEGER NOT NULL DEFAULT 0")
+
+    cur.execute(
+        """
+        INSERT OR REPLACE INTO poll_option_tallies (poll_id, option_id, votes)
+        SELECT o.poll_id, o.id,
+               (SELECT COUNT(*) FROM poll_votes v WHERE v.poll_id = o.poll_id AND v.option_id = o.id)
+        FROM poll_options o
+        """
+    )
+    cur.execute(
+        "UPDATE polls SET total_votes = (SELECT COUNT(*) FROM poll_votes v WHERE v.poll_id = polls.id)"
+    )
+
+
+def _migrate_006_delivery_outbox(cur):
+    """
+    Durable Telegram outbox: one delivery_jobs row per broadcast (with live
+    counters) and one outbox_messages row per recipient, drained by delivery.py.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS delivery_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            ref_id INTEGER,
+            building_id INTEGER,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_ts INTEGER NOT NULL,
+            finished_ts INTEGER
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_delivery_jobs_kind_ref ON delivery_jobs(kind, ref_id)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',   -- queued / sending / sent / failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ts INTEGER NOT NULL,
+            lease_until_ts INTEGER,
+            message_id INTEGER,
+            last_error TEXT,
+            sent_ts INTEGER,
+            UNIQUE (job_id, chat_id),
+            FOREIGN KEY (job_id) REFERENCES delivery_jobs(id) ON DELETE CASCADE
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox_messages(status, next_attempt_ts)"
+    )
+
+
+def _migrate_007_poll_deliveries(cur):
+    """
+    Poll broadcasts go through the outbox: at most one delivery job per poll,
+    and at_most_once jobs never resend a message whose outcome is unknown.
+    """
+    ensure_column(cur, "delivery_jobs", "at_most_once", "INTEGER NOT NULL DEFAULT 0")
+    cur.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_delivery_jobs_poll ON delivery_jobs(kind, ref_id) WHERE kind = 'poll'"
+    )
+
+
+def _migrate_008_cache_generations(cur):
+    """
+    Generation counters for in-process caches. Triggers bump 'tenants' on
+    every tenants write, from any worker, so a cache can tell it is stale.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            name TEXT PRIMARY KEY,
+            gen INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("INSERT OR IGNORE INTO cache_generations (name, gen) VALUES ('tenants', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_tenants_gen_{event.lower()}
+            AFTER {event} ON tenants
+            BEGIN
+                UPDATE cache_generations SET gen = gen + 1 WHERE name = 'tenants';
+            END
+            """
+        )
+
+
+def _migrate_009_telegram_media(cur):
+    """
+    Photos the bot reports by Telegram file_id only; the web app downloads
+    each one on first view and remembers where it stored it.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS telegram_media (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            stored_name TEXT,
+            size_bytes INTEGER,
+            created_ts INTEGER NOT NULL,
+            fetched_ts INTEGER
+        )
+        """
+    )
+
+
+def _migrate_010_upload_blobs(cur):
+    """
+    Content-addressed uploads: one upload_blobs row per distinct file, with
+    ref_count kept by triggers on tickets.image_blob (the blob a ticket's
+    image_url points at).
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_blobs (
+            sha256 TEXT PRIMARY KEY,
+            rel_path TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_ts INTEGER NOT NULL,
+            last_seen_ts INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_upload_blobs_orphans ON upload_blobs(ref_count, last_seen_ts)")
+    ensure_column(cur, "tickets", "image_blob", "TEXT")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tickets_image_blob ON tickets(image_blob) WHERE image_blob IS NOT NULL"
+    )
+    # one execute() per trigger: executescript() would commit init_db's transaction
+    triggers = {
+        "insert": """
+            AFTER INSERT ON tickets WHEN NEW.image_blob IS NOT NULL
+            BEGIN
+                UPDATE upload_blobs SET ref_count = ref_count + 1 WHERE sha256 = NEW.image_blob;
+            END
+        """,
+        "delete": """
+            AFTER DELETE ON tickets WHEN OLD.image_blob IS NOT NULL
+            BEGIN
+                UPDATE upload_blobs SET ref_count = ref_count - 1 WHERE sha256 = OLD.image_blob;
+            END
+        """,
+        "update": """
+            AFTER UPDATE OF image_blob ON tickets WHEN OLD.image_blob IS NOT NEW.image_blob
+            BEGIN
+                UPDATE upload_blobs SET ref_count = ref_count - 1 WHERE sha256 = OLD.image_blob;
+                UPDATE upload_blobs SET ref_count = ref_count + 1 WHERE sha256 = NEW.image_blob;
+            END
+        """,
+    }
+    for event, body in triggers.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_tickets_blob_{event} {body}")
+
+
+def _migrate_011_payments_monthly(cur):
+    """
+    Per building / month / status / method payment totals, kept up to date
+    by approve_payment_db and reject_payment_db, so history totals don't
+    scan payments.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments_monthly (
+            building_id INTEGER NOT NULL,
+            ym TEXT NOT NULL,              -- 'YYYY-MM' of created_ts (UTC)
+            status TEXT NOT NULL,
+            method TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            sum_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (building_id, ym, status, method)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payments_monthly_ym ON payments_monthly(ym, status)")
+    cur.execute("DELETE FROM payments_monthly")
+    cur.execute(_PAYMENTS_ROLLUP_REBUILD_SQL)
+
+
+def _migrate_012_dues_index(cur):
+    # get_tenant_dues_db across all buildings (super admin) ranges on the date alone
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tenants_next_payment ON tenants(next_payment_date)"
+    )
+
+
+def _migrate_013_payment_reminders(cur):
+    """One row per reminder queued, so a tenant gets each stage once per payment period."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_reminders (
+            tenant_id INTEGER NOT NULL,
+            period_ym TEXT NOT NULL,       -- 'YYYY-MM' of the next_payment_date reminded about
+            stage TEXT NOT NULL,           -- 'upcoming' / 'overdue'
+            chat_id INTEGER,
+            building_id INTEGER,
+            job_id INTEGER,                -- delivery_jobs row that carries the message
+            created_ts INTEGER NOT NULL,
+            PRIMARY KEY (tenant_id, period_ym, stage)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_payment_reminders_created_ts ON payment_reminders(created_ts)")
+
+
+# tables whose writes change a dashboard summary, and the columns that matter on UPDATE
+_SUMMARY_WATCHED = {
+    "tenants": "",
+    "tickets": " OF status, building_id",
+    "payments": " OF status, building_id",
+}
+
+
+def _migrate_014_dashboard_summaries(cur):
+    """
+    Cached building_admin_dashboard summary per building (0 = all buildings).
+    Triggers delete a building's row – and the all-buildings row – on every
+    tenant, ticket and payment write that can change it, from any worker.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dashboard_summaries (
+            building_id INTEGER PRIMARY KEY,
+            as_of TEXT NOT NULL,           -- 'YYYY-MM-DD' (UTC) the date-dependent parts are for
+            computed_ts INTEGER NOT NULL,
+            summary TEXT NOT NULL          -- JSON
+        )
+        """
+    )
+    for table, columns in _SUMMARY_WATCHED.items():
+        for event, rows in (("INSERT", ("NEW",)), ("UPDATE", ("OLD", "NEW")), ("DELETE", ("OLD",))):
+            ids = ", ".join(f"COALESCE({r}.building_id, 0)" for r in rows)
+            cur.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_{event.lower()}
+                AFTER {event}{columns if event == "UPDATE" else ""} ON {table}
+                BEGIN
+                    DELETE FROM dashboard_summaries WHERE building_id IN ({ids}, 0);
+                END
+                """
+            )
+
+
+def _migrate_015_lookup_expression_indexes(cur):
+    # get_building_by_code_db / get_staff_user_by_email_db / get_user_by_email_db
+    # match on UPPER()/LOWER(), which only an index on the same expression serves
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_buildings_code_upper ON buildings(UPPER(building_code))")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_staff_users_email_lower ON staff_users(LOWER(email))")
+
+
+def _migrate_016_scheduler_leases(cur):
+    """Which process currently owns a periodic job (e.g. the payment reminder scheduler)."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            until_ts INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _migrate_017_processed_uploads(cur):
+    # original upload -> the blob holding its re-encoded version (upload_store.process_upload)
+    ensure_column(cur, "upload_blobs", "processed_sha256", "TEXT")
+
+
+def _migrate_018_telegram_media_blobs(cur):
+    """
+    Fetched Telegram media lives in the upload store (telegram_media.blob_sha256),
+    and tickets showing it (tickets.image_media) reference that blob like uploads do.
+    """
+    ensure_column(cur, "telegram_media", "blob_sha256", "TEXT")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_telegram_media_blob ON telegram_media(blob_sha256) WHERE blob_sha256 IS NOT NULL"
+    )
+    ensure_column(cur, "tickets", "image_media", "TEXT")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tickets_image_media ON tickets(image_media) WHERE image_media IS NOT NULL"
+    )
+    cur.execute(
+        """
+        UPDATE tickets SET image_media = substr(image_url, instr(image_url, '/media/telegram/') + 16)
+        WHERE image_url LIKE '%/media/telegram/%'
+        """
+    )
+
+
+def _migrate_019_dashboard_summary_gens(cur):
+    """
+    A generation per dashboard summary, bumped by the same writes that drop
+    the cached row. get_dashboard_summary_db builds a summary without a write
+    lock and stores it only if the generation it started from is current.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dashboard_summary_gens (
+            building_id INTEGER PRIMARY KEY,
+            gen INTEGER NOT NULL
+        )
+        """
+    )
+    for table, columns in _SUMMARY_WATCHED.items():
+        for event, rows in (("INSERT", ("NEW",)), ("UPDATE", ("OLD", "NEW")), ("DELETE", ("OLD",))):
+            ids = [f"COALESCE({r}.building_id, 0)" for r in rows]
+            bumps = ", ".join(f"({i}, 1)" for i in ids + ["0"])
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_{table}_summary_{event.lower()}")
+            cur.execute(
+                f"""
+                CREATE TRIGGER trg_{table}_summary_{event.lower()}
+                AFTER {event}{columns if event == "UPDATE" else ""} ON {table}
+                BEGIN
+                    DELETE FROM dashboard_summaries WHERE building_id IN ({", ".join(ids)}, 0);
+                    INSERT INTO dashboard_summary_gens (building_id, gen) VALUES {bumps}
+                    ON CONFLICT (building_id) DO UPDATE SET gen = gen + 1;
+                END
+                """
+            )
+
+
+# Ordered and append-only: each step runs once, inside the migration
+# transaction, and is recorded in schema_version. Never edit a shipped
+# step – add a new one instead.
+MIGRATIONS = [
+    (1, "base schema", _migrate_001_base_schema),
+    (2, "hot path indexes", _migrate_002_hot_path_indexes),
+    (3, "tickets full-text search", _migrate_003_tickets_fts),
+    (4, "epoch timestamps", _migrate_004_epoch_timestamps),
+    (5, "poll tallies", _migrate_005_poll_tallies),
+    (6, "delivery outbox", _migrate_006_delivery_outbox),
+    (7, "poll deliveries", _migrate_007_poll_deliveries),
+    (8, "cache generations", _migrate_008_cache_generations),
+    (9, "telegram media", _migrate_009_telegram_media),
+    (10, "upload blobs", _migrate_010_upload_blobs),
+    (11, "payments monthly rollup", _migrate_011_payments_monthly),
+    (12, "tenant dues index", _migrate_012_dues_index),
+    (13, "payment reminders", _migrate_013_payment_reminders),
+    (14, "dashboard summaries", _migrate_014_dashboard_summaries),
+    (15, "lookup expression indexes", _migrate_015_lookup_expression_indexes),
+    (16, "scheduler leases", _migrate_016_scheduler_leases),
+    (17, "processed uploads", _migrate_017_processed_uploads),
+    (18, "telegram media blobs", _migrate_018_telegram_media_blobs),
+    (19, "dashboard summary generations", _migrate_019_dashboard_summary_gens),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version_db(conn) -> int:
+    try:
+        r = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        # no schema_version table yet – fresh or pre-migration database
+        return 0
+    return int(r[0] or 0)
+
+
+def init_db():
+    """
+    Apply pending schema migrations.
+    An up-to-date database costs a single query; only a stale one pays for DDL.
+    """
+    with db() as conn:
+        if get_schema_version_db(conn) >= SCHEMA_VERSION:
+            return
+
+        # serialize concurrent gunicorn workers; re-read the version under the lock
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+            """
+        )
+        current = get_schema_version_db(conn)
+
+        for version, name, step in MIGRATIONS:
+            if version <= current:
+                continue
+            step(cur)
+            cur.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, now_utc_iso()),
+            )
 
 def get_user_language_db(chat_id: int, default_lang: str = "he") -> str:
     """
@@ -340,6 +1165,139 @@ def set_user_language_db(chat_id: int, lang: str):
     conn.commit()
     conn.close()
 
+# ─────────── Pagination helpers ───────────
+# Listings page with keyset cursors instead of OFFSET: the cursor is the sort
+# key of the last row already shown, so every page is an index seek.
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str | None, size: int) -> list | None:
+    """Sort key from a cursor, or None if missing/garbled (= first page)."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+def next_page_cursor(rows: list, limit: int, *keys: str) -> str | None:
+    """Cursor for the page after rows, or None when this was the last page."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(*(last[k] for k in keys))
+
+# ─────────── Tenant-by-chat cache ───────────
+
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "5000"))
+
+_MISSING = object()
+
+
+class TenantChatCache:
+    """
+    Read-through LRU cache of get_tenant_by_chat_id_db results (None included).
+
+    Entries belong to one value of cache_generations.tenants, which triggers
+    bump on every tenants write by any process; a lookup that sees another
+    generation drops everything. To skip even that read, each connection
+    remembers (data_version, total_changes) from its last check: if neither
+    moved, nobody - this connection or another - has committed since.
+    """
+
+    def __init__(self, maxsize: int = TENANT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: OrderedDict[int, dict | None] = OrderedDict()
+        self._gen: int | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, conn) -> int | None:
+        """Current tenants generation as seen by conn (None before migration 8)."""
+        raw = getattr(conn, "_conn", conn)
+        marker = (raw.execute("PRAGMA data_version").fetchone()[0], raw.total_changes)
+        seen = getattr(raw, "tenant_cache_seen", None)
+        if seen is not None and seen[0] == marker:
+            return seen[1]
+
+        try:
+            r = raw.execute("SELECT gen FROM cache_generations WHERE name = 'tenants'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        gen = int(r[0]) if r else None
+        if isinstance(raw, _Connection):
+            raw.tenant_cache_seen = (marker, gen)
+        return gen
+
+    def get(self, chat_id: int, gen: int | None):
+        with self._lock:
+            if gen is None or gen != self._gen:
+                self.misses += 1
+                return _MISSING
+            value = self._data.get(chat_id, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(chat_id)
+            self.hits += 1
+            return dict(value) if value else None
+
+    def put(self, chat_id: int, gen: int | None, value: dict | None) -> None:
+        if gen is None:
+            return
+        with self._lock:
+            if gen != self._gen:
+                self._data.clear()
+                self._gen = gen
+            self._data[chat_id] = dict(value) if value else None
+            self._data.move_to_end(chat_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, chat_id: int | None = None, tenant_id: int | None = None) -> None:
+        """Drop one chat, every chat of one tenant, or (no arguments) everything."""
+        with self._lock:
+            if chat_id is None and tenant_id is None:
+                self._data.clear()
+                return
+            if chat_id is not None:
+                try:
+                    self._data.pop(int(chat_id), None)
+                except (TypeError, ValueError):
+                    pass
+            if tenant_id is not None:
+                for k in [k for k, v in self._data.items() if v and v["id"] == tenant_id]:
+                    del self._data[k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "generation": self._gen,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+TENANT_CACHE = TenantChatCache()
+
+
+def invalidate_tenant_cache(chat_id: int | None = None, tenant_id: int | None = None) -> None:
+    """
+    Evict right away in this worker. Other workers notice the generation bump
+    made by the tenants triggers on their next lookup.
+    """
+    TENANT_CACHE.invalidate(chat_id=chat_id, tenant_id=tenant_id)
+
 # ─────────── Tenant helpers ───────────
 
 def create_tenant_db(
@@ -416,43 +1374,56 @@ def get_tenant_by_chat_id_db(chat_id: int) -> dict | None:
     if not chat_id or int(chat_id) <= 0:
         return None
 
+    chat_id = int(chat_id)
+
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, building_id, name, apartment, tenant_type, email, payment_type,
-               next_payment_date, parking_slots, chat_id
-        FROM tenants
-        WHERE chat_id = ?
-        """,
-        (chat_id,),
-    )
-    r = cur.fetchone()
-    conn.close()
-    if not r:
-        return None
+    try:
+        # read the generation first: the row read below is at least that new
+        gen = TENANT_CACHE.generation(conn)
+        cached = TENANT_CACHE.get(chat_id, gen)
+        if cached is not _MISSING:
+            return cached
+
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, building_id, name, apartment, tenant_type, email, payment_type,
+                   next_payment_date, parking_slots, chat_id
+            FROM tenants
+            WHERE chat_id = ?
+            """,
+            (chat_id,),
+        )
+        r = cur.fetchone()
+    finally:
+        conn.close()
 
+    tenant = None
     # building_id must be valid
-    if not r[1] or int(r[1]) <= 0:
-        return None
+    if r and r[1] and int(r[1]) > 0:
+        tenant = {
+            "id": r[0], "building_id": r[1], "name": r[2], "apartment": r[3],
+            "tenant_type": r[4], "email": r[5], "payment_type": r[6],
+            "next_payment_date": r[7], "parking_slots": r[8], "chat_id": r[9],
+        }
 
-    return {
-        "id": r[0], "building_id": r[1], "name": r[2], "apartment": r[3],
-        "tenant_type": r[4], "email": r[5], "payment_type": r[6],
-        "next_payment_date": r[7], "parking_slots": r[8], "chat_id": r[9],
-    }
+    TENANT_CACHE.put(chat_id, gen, tenant)
+    return tenant
 
 def get_tenants_db(
     limit: int = 200,
     search: str | None = None,
     building_id: int | None = None,
+    cursor: str | None = None,
 ) -> list:
+    """Tenants ordered by (apartment, name, id); page on with next_page_cursor(rows, limit, "sort_apartment", "name", "id")."""
     conn = get_connection()
     cur = conn.cursor()
 
     query = """
         SELECT id, name, apartment, tenant_type, email,
-               payment_type, next_payment_date, parking_slots, chat_id, building_id
+               payment_type, next_payment_date, parking_slots, chat_id, building_id,
+               COALESCE(apartment, '') AS sort_apartment
         FROM tenants
         WHERE 1=1
     """
@@ -473,7 +1444,12 @@ def get_tenants_db(
         like = f"%{search}%"
         params.extend([like, like, like])
 
-    query += " ORDER BY apartment, name LIMIT ?"
+    after = decode_cursor(cursor, 3)
+    if after:
+        query += " AND (COALESCE(apartment, ''), name, id) > (?, ?, ?)"
+        params.extend(after)
+
+    query += " ORDER BY COALESCE(apartment, ''), name, id LIMIT ?"
     params.append(limit)
 
     cur.execute(query, params)
@@ -494,6 +1470,7 @@ def get_tenants_db(
                 "parking_slots": r[7],
                 "chat_id": r[8],
                 "building_id": r[9],
+                "sort_apartment": r[10],
             }
         )
     return tenants
@@ -538,6 +1515,7 @@ def update_tenant_db(
     )
     conn.commit()
     conn.close()
+    invalidate_tenant_cache(tenant_id=tenant_id)
 
     # ─────────── Tickets helpers ───────────
 
@@ -548,6 +1526,7 @@ def update_tenant_name_db(tenant_id: int, name: str) -> bool:
     conn.commit()
     ok = cur.rowcount > 0
     conn.close()
+    invalidate_tenant_cache(tenant_id=tenant_id)
     return ok
 
 def get_tenants_summary_db(building_id: int | None = None) -> list[dict]:
@@ -564,52 +1543,191 @@ def get_tenants_summary_db(building_id: int | None = None) -> list[dict]:
     LEFT JOIN buildings b ON b.id = tn.building_id
     WHERE 1=1
     """
-    params = []
-    if building_id is not None:
-      q += " AND tn.building_id = ?"
-      params.append(building_id)
+    params = []
+    if building_id is not None:
+      q += " AND tn.building_id = ?"
+      params.append(building_id)
+
+    q += " ORDER BY tn.building_id, tn.apartment, tn.name"
+
+    cur.execute(q, params)
+    rows = cur.fetchall()
+    conn.close()
+
+    out = []
+    for r in rows:
+        out.append({
+            "id": r[0], "name": r[1], "apartment": r[2], "tenant_type": r[3],
+            "email": r[4], "payment_type": r[5], "next_payment_date": r[6],
+            "parking_slots": r[7], "chat_id": r[8], "building_id": r[9],
+            "building_street": r[10], "building_number": r[11], "building_city": r[12],
+        })
+    return out
+
+# ─────────── Ticket helpers ───────────
+
+def create_ticket_db(chat_id: int, category: str, description: str, language: str = "he", image_url: str | None = None, status="open") -> dict:
+    tenant = get_tenant_by_chat_id_db(chat_id)
+    if not tenant:
+        raise ValueError("not_registered")
+
+    building_id = int(tenant["building_id"])
+    if building_id <= 0:
+        raise ValueError("not_registered")
+
+    now = datetime.now(timezone.utc)
+    created_at = now.isoformat(timespec="seconds")
+    with db() as conn:
+        # write lock first: an upload finishing processing now either sees this ticket or is seen by it
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        image_media = telegram_media_key(image_url)
+        image_blob = upload_blob_key(image_url)
+        if image_media:
+            # None until the file is first fetched; mark_telegram_media_stored_db fills it in then
+            r = conn.execute("SELECT blob_sha256 FROM telegram_media WHERE file_unique_id = ?", (image_media,)).fetchone()
+            image_blob = r[0] if r else None
+        image_url, image_blob = _processed_image(conn, image_url, image_blob)
+        cur = conn.execute(
+            """
+            INSERT INTO tickets (building_id, chat_id, category, description, language, status, created_at, created_ts,
+                                 image_url, image_blob, image_media)
+            VALUES (?, ?, ?, ?, ?, 'open', ?, ?, ?, ?, ?)
+            """,
+            (building_id, chat_id, category, description, language, created_at, int(now.timestamp()),
+             image_url, image_blob, image_media),
+        )
+        tid = cur.lastrowid
+    return get_ticket_by_id_db(tid)
+
+_TICKETS_FTS_AVAILABLE = None
+
+
+def tickets_fts_available() -> bool:
+    """True when migration 3 could create tickets_fts (SQLite built with FTS5)."""
+    global _TICKETS_FTS_AVAILABLE
+    if _TICKETS_FTS_AVAILABLE is None:
+        with db() as conn:
+            r = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='tickets_fts'"
+            ).fetchone()
+        _TICKETS_FTS_AVAILABLE = bool(r)
+    return _TICKETS_FTS_AVAILABLE
+
+
+_FTS_TEXT_COLUMNS = "{description category tenant_name apartment}"
+
+
+def build_fts_query(search: str) -> str | None:
+    """
+    Turn free text into a safe FTS5 MATCH expression: every word must match,
+    as a prefix ("מעל" finds "מעלית"), in the ticket's text columns – never
+    in chat_id / building_id. Returns None if nothing searchable is left.
+    """
+    terms = []
+    for word in (search or "").split():
+        word = word.replace('"', "")
+        if word:
+            terms.append(f'"{word}"*')
+    return f"{_FTS_TEXT_COLUMNS} : ({' '.join(terms)})" if terms else None
+
+
+# bm25 in millionths: an exact integer sort key for the search cursor
+_FTS_RANK_KEY = "CAST(ROUND(f.rank * 1000000) AS INTEGER)"
+
+def search_tickets_db(
+    search: str,
+    limit: int = 100,
+    status: str | None = None,
+    category: str | None = None,
+    building_id: int | None = None,
+    cursor: str | None = None,
+) -> list:
+    """Ranked full-text ticket search (bm25), scoped to a building inside the FTS index.
+
+    Pages on (rank_key, id, search_upto), see ticket_cursor_keys(). rank_key
+    is bm25 scaled to an integer, so the cursor compares exactly (no float
+    round-trip) and equal ranks fall through to id. search_upto is the
+    highest ticket id when the first page was read: later pages only look
+    at tickets that existed then, so tickets filed mid-paging don't land
+    in the middle of the list. (Edits to the index between pages still
+    shift bm25 itself, as with any ranked result.)
+    """
+    match = build_fts_query(search)
+    if not match:
+        return []
+    if building_id is not None:
+        match = f'({match}) AND building_id:"{int(building_id)}"'
+
+    after = decode_cursor(cursor, 3)
+    if after:
+        upto = after[2]
+    else:
+        with db() as conn:
+            upto = conn.execute("SELECT COALESCE(MAX(id), 0) FROM tickets").fetchone()[0]
+
+    query = f"""
+    SELECT
+        t.id,
+        t.chat_id,
+        t.category,
+        t.description,
+        t.language,
+        t.status,
+        t.created_at,
+        t.image_url,
+        tn.id AS tenant_id,
+        tn.name AS tenant_name,
+        tn.apartment AS tenant_apartment,
+        t.created_ts,
+        f.rank,
+        {_FTS_RANK_KEY} AS rank_key
+    FROM tickets_fts f
+    JOIN tickets t ON t.id = f.rowid
+    LEFT JOIN tenants tn ON t.chat_id = tn.chat_id
+    WHERE tickets_fts MATCH ? AND f.rowid <= ?
+    """
+    params = [match, upto]
 
-    q += " ORDER BY tn.building_id, tn.apartment, tn.name"
+    if status and status != "all":
+        query += " AND t.status = ?"
+        params.append(status)
 
-    cur.execute(q, params)
-    rows = cur.fetchall()
-    conn.close()
+    if category and category != "all":
+        query += " AND t.category = ?"
+        params.append(category)
 
-    out = []
-    for r in rows:
-        out.append({
-            "id": r[0], "name": r[1], "apartment": r[2], "tenant_type": r[3],
-            "email": r[4], "payment_type": r[5], "next_payment_date": r[6],
-            "parking_slots": r[7], "chat_id": r[8], "building_id": r[9],
-            "building_street": r[10], "building_number": r[11], "building_city": r[12],
-        })
-    return out
+    if after:
+        query += f" AND ({_FTS_RANK_KEY}, t.id) > (?, ?)"
+        params.extend(after[:2])
 
-# ─────────── Ticket helpers ───────────
+    query += f" ORDER BY {_FTS_RANK_KEY}, t.id LIMIT ?"
+    params.append(limit)
 
-def create_ticket_db(chat_id: int, category: str, description: str, language: str = "he", image_url: str | None = None, status="open") -> dict:
-    tenant = get_tenant_by_chat_id_db(chat_id)
-    if not tenant:
-        raise ValueError("not_registered")
+    with db() as conn:
+        rows = conn.execute(query, params).fetchall()
 
-    building_id = int(tenant["building_id"])
-    if building_id <= 0:
-        raise ValueError("not_registered")
+    return [
+        {
+            "id": r[0],
+            "chat_id": r[1],
+            "category": r[2],
+            "description": r[3],
+            "language": r[4],
+            "status": r[5],
+            "created_at": r[6],
+            "image_url": r[7],
+            "tenant_id": r[8],
+            "tenant_name": r[9],
+            "tenant_apartment": r[10],
+            "created_ts": r[11],
+            "rank": r[12],
+            "rank_key": r[13],
+            "search_upto": upto,
+        }
+        for r in rows
+    ]
 
-    conn = get_connection()
-    cur = conn.cursor()
-    created_at = now_utc_iso()
-    cur.execute(
-        """
-        INSERT INTO tickets (building_id, chat_id, category, description, language, status, created_at, image_url)
-        VALUES (?, ?, ?, ?, ?, 'open', ?, ?)
-        """,
-        (building_id, chat_id, category, description, language, created_at, image_url),
-    )
-    conn.commit()
-    tid = cur.lastrowid
-    conn.close()
-    return get_ticket_by_id_db(tid)
 
 def get_tickets_db(
     limit: int = 100,
@@ -617,7 +1735,19 @@ def get_tickets_db(
     category: str = None,
     search: str = None,
     building_id: int | None = None,
+    cursor: str | None = None,
 ) -> list:
+    """Newest tickets first; page on with next_page_cursor(rows, limit, *ticket_cursor_keys(search))."""
+    if search and tickets_fts_available():
+        return search_tickets_db(
+            search,
+            limit=limit,
+            status=status,
+            category=category,
+            building_id=building_id,
+            cursor=cursor,
+        )
+
     conn = get_connection()
     cur = conn.cursor()
 
@@ -633,7 +1763,8 @@ def get_tickets_db(
         t.image_url,
         tn.id AS tenant_id,
         tn.name AS tenant_name,
-        tn.apartment AS tenant_apartment
+        tn.apartment AS tenant_apartment,
+        t.created_ts
     FROM tickets t
     LEFT JOIN tenants tn ON t.chat_id = tn.chat_id
     WHERE 1=1
@@ -665,7 +1796,12 @@ def get_tickets_db(
         """
         params.extend([like, like, like, like, like])
 
-    query += " ORDER BY datetime(t.created_at) DESC LIMIT ?"
+    after = decode_cursor(cursor, 2)
+    if after:
+        query += " AND (t.created_ts, t.id) < (?, ?)"
+        params.extend(after)
+
+    query += " ORDER BY t.created_ts DESC, t.id DESC LIMIT ?"
     params.append(limit)
 
     cur.execute(query, params)
@@ -685,10 +1821,17 @@ def get_tickets_db(
             "tenant_id": r[8],
             "tenant_name": r[9],
             "tenant_apartment": r[10],
+            "created_ts": r[11],
         }
         for r in rows
     ]
 
+def ticket_cursor_keys(search: str | None = None) -> tuple[str, ...]:
+    """Sort key get_tickets_db pages on: rank for FTS search, otherwise time."""
+    if search and tickets_fts_available():
+        return ("rank_key", "id", "search_upto")
+    return ("created_ts", "id")
+
 def get_ticket_by_id_db(ticket_id: int) -> dict | None:
     conn = get_connection()
     cur = conn.cursor()
@@ -719,16 +1862,75 @@ def get_ticket_by_id_db(ticket_id: int) -> dict | None:
         "tenant_id": r[8],
     }
 
-def update_ticket_status_db(ticket_id: int, status: str):
+def change_ticket_status_db(ticket_id: int, status: str) -> dict | None:
+    """
+    Set a ticket's status and return {"old_status", "ticket"} (the updated
+    row), read and written in one transaction; None if there is no such ticket.
+    """
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        r = conn.execute("SELECT status FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+        if not r:
+            return None
+        t = conn.execute(
+            """
+            UPDATE tickets SET status = ? WHERE id = ?
+            RETURNING id, building_id, chat_id, category, description, language, status
+            """,
+            (status, ticket_id),
+        ).fetchone()
+
+    return {
+        "old_status": r[0],
+        "ticket": {
+            "id": t[0], "building_id": t[1], "chat_id": t[2], "category": t[3],
+            "description": t[4], "language": t[5], "status": t[6],
+        },
+    }
+
+def get_ticket_recipients_db(ticket_id: int, reporter_chat_id: int | None = None) -> list[dict]:
+    """
+    Everyone to notify about a ticket (watchers + reporter), each with the
+    tenant row and pending-payment flag should_add_payment_cta needs –
+    one query for all of them.
+    Returns [{"chat_id", "tenant": dict | None, "has_pending": bool}].
+    """
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE tickets SET status = ? WHERE id = ?",
-        (status, ticket_id),
-    )
-    conn.commit()
+    rows = conn.execute(
+        """
+        WITH r(chat_id) AS (
+            SELECT chat_id FROM ticket_watchers WHERE ticket_id = ?
+            UNION
+            SELECT ? WHERE ? IS NOT NULL
+        )
+        SELECT r.chat_id,
+               t.id, t.building_id, t.name, t.apartment, t.tenant_type, t.email,
+               t.payment_type, t.next_payment_date, t.parking_slots,
+               EXISTS (
+                   SELECT 1 FROM payments p WHERE p.tenant_id = t.id AND p.status = 'pending'
+               )
+        FROM r
+        LEFT JOIN tenants t ON t.chat_id = r.chat_id AND r.chat_id > 0
+        """,
+        (ticket_id, reporter_chat_id, reporter_chat_id),
+    ).fetchall()
     conn.close()
 
+    out = {}
+    for r in rows:
+        if not r[0] or r[0] in out:
+            continue
+        tenant = None
+        # same rule as get_tenant_by_chat_id_db: a tenant needs a real building
+        if r[1] is not None and int(r[2] or 0) > 0:
+            tenant = {
+                "id": r[1], "building_id": r[2], "name": r[3], "apartment": r[4],
+                "tenant_type": r[5], "email": r[6], "payment_type": r[7],
+                "next_payment_date": r[8], "parking_slots": r[9], "chat_id": r[0],
+            }
+        out[r[0]] = {"chat_id": r[0], "tenant": tenant, "has_pending": bool(r[10])}
+    return list(out.values())
+
 def update_ticket_description_db(ticket_id: int, description: str):
     conn = get_connection()
     cur = conn.cursor()
@@ -799,6 +2001,8 @@ def link_tenant_chat_db(tenant_id: int, chat_id: int) -> dict | None:
     )
     conn.commit()
     conn.close()
+    # the chat moved to this tenant, and the tenant's previous chat lost it
+    invalidate_tenant_cache(chat_id=chat_id, tenant_id=tenant_id)
 
     return get_tenant_by_id_db(tenant_id)
 
@@ -815,7 +2019,7 @@ def get_tickets_for_chat_db(chat_id: int) -> dict:
         SELECT id, category, description, status, created_at
         FROM tickets
         WHERE chat_id = ?
-        ORDER BY datetime(created_at) DESC
+        ORDER BY created_ts DESC, id DESC
         """,
         (chat_id,),
     )
@@ -828,7 +2032,7 @@ def get_tickets_for_chat_db(chat_id: int) -> dict:
         FROM ticket_watchers w
         JOIN tickets t ON t.id = w.ticket_id
         WHERE w.chat_id = ?
-        ORDER BY datetime(t.created_at) DESC
+        ORDER BY t.created_ts DESC, t.id DESC
         """,
         (chat_id,),
     )
@@ -873,7 +2077,7 @@ def find_open_ticket_by_category_db(building_id: int, category: str) -> dict | N
         SELECT id, building_id, chat_id, category, description, status, created_at
         FROM tickets
         WHERE building_id=? AND status='open' AND category=?
-        ORDER BY datetime(created_at) DESC
+        ORDER BY created_ts DESC
         LIMIT 1
         """,
         (building_id, category),
@@ -1266,43 +2470,6 @@ def list_staff_users_db(limit: int = 200) -> list[dict]:
         for r in rows
     ]
 
-def get_tenants_due_this_month_db(building_id: int | None = None) -> list[dict]:    
-    today = date.today().isoformat()          # 'YYYY-MM-DD'
-    month_start = date.today().replace(day=1)
-    next_month = (month_start + timedelta(days=32)).replace(day=1)
-    month_end = next_month - timedelta(days=1)
-
-    month_start_str = month_start.isoformat()
-    month_end_str = month_end.isoformat()
-
-    conn = get_connection()
-    cur = conn.cursor()
-
-    q = """
-    SELECT id, name, apartment, next_payment_date, payment_type, building_id
-    FROM tenants
-    WHERE next_payment_date IS NOT NULL
-      AND next_payment_date >= ?
-      AND next_payment_date <= ?
-    """
-    params = [month_start_str, month_end_str]
-
-    if building_id is not None:
-        q += " AND building_id = ?"
-        params.append(building_id)
-
-    q += " ORDER BY next_payment_date ASC"
-
-    cur.execute(q, params)
-    rows = cur.fetchall()
-    conn.close()
-
-    return [{
-        "id": r[0], "name": r[1], "apartment": r[2],
-        "next_payment_date": r[3], "payment_type": r[4],
-        "building_id": r[5],
-    } for r in rows]
-
 def compute_missing_tenant_fields(tenant: dict) -> list[str]:
     missing = []
     if not (tenant.get("tenant_type") or "").strip():
@@ -1319,14 +2486,14 @@ def compute_missing_tenant_fields(tenant: dict) -> list[str]:
 
 # Payments Helpers
 
-def get_pending_payments_db(building_id: int | None = None):
+def get_pending_payments_db(building_id: int | None = None, limit: int = 50, cursor: str | None = None):
     conn = get_connection()
     cur = conn.cursor()
 
     sql = """
     SELECT p.id, p.building_id, p.tenant_id, p.amount_cents, p.currency, p.method,
            p.status, p.period_ym, p.proof_file_id, p.proof_file_type, p.note, p.created_at,
-           t.name, t.apartment, t.chat_id, t.next_payment_date
+           t.name, t.apartment, t.chat_id, t.next_payment_date, p.created_ts
     FROM payments p
     JOIN tenants t ON t.id = p.tenant_id
     WHERE p.status='pending'
@@ -1337,7 +2504,13 @@ def get_pending_payments_db(building_id: int | None = None):
         sql += " AND p.building_id=?"
         params.append(building_id)
 
-    sql += " ORDER BY p.created_at DESC"
+    after = decode_cursor(cursor, 2)
+    if after:
+        sql += " AND (p.created_ts, p.id) < (?, ?)"
+        params.extend(after)
+
+    sql += " ORDER BY p.created_ts DESC, p.id DESC LIMIT ?"
+    params.append(limit)
 
     cur.execute(sql, params)
     rows = cur.fetchall()
@@ -1351,6 +2524,7 @@ def get_pending_payments_db(building_id: int | None = None):
         "note": r[10], "created_at": r[11],
         "tenant_name": r[12], "apartment": r[13],
         "chat_id": r[14], "next_payment_date": r[15],
+        "created_ts": r[16],
     } for r in rows]
 
 def get_payment_by_id_db(payment_id: int) -> dict | None:
@@ -1429,9 +2603,10 @@ def is_fully_registered(tenant: dict) -> bool:
 
     return True
 
-def should_add_payment_cta(tenant: dict):
+def should_add_payment_cta(tenant: dict, has_pending: bool | None = None):
     """
     Returns: (show_button: bool, reason: str | None)
+    has_pending: pass it when already known to skip the pending-payment query.
     """
     if not is_fully_registered(tenant):
         return False, None
@@ -1445,7 +2620,9 @@ def should_add_payment_cta(tenant: dict):
     except Exception:
         return False, None
 
-    if tenant_has_pending_payment_db(tenant["id"]):
+    if has_pending is None:
+        has_pending = tenant_has_pending_payment_db(tenant["id"])
+    if has_pending:
         return False, None
 
     today = date.today()
@@ -1480,10 +2657,10 @@ def create_pending_payment_db(chat_id: int, amount_cents: int, method: str, peri
     try:
         cur.execute(
             """
-            INSERT INTO payments (building_id, tenant_id, amount_cents, currency, method, status, period_ym, proof_file_id)
-            VALUES (?, ?, ?, 'ILS', ?, 'pending', ?, 'TEMP')
+            INSERT INTO payments (building_id, tenant_id, amount_cents, currency, method, status, period_ym, proof_file_id, created_ts)
+            VALUES (?, ?, ?, 'ILS', ?, 'pending', ?, 'TEMP', ?)
             """,
-            (tenant["building_id"], tenant["id"], int(amount_cents), method, period_ym),
+            (tenant["building_id"], tenant["id"], int(amount_cents), method, period_ym, now_utc_ts()),
         )
         conn.commit()
         payment_id = cur.lastrowid
@@ -1567,88 +2744,150 @@ def set_next_payment_date_from_months_db(tenant_id: int, months: int) -> str:
     return new_dt.isoformat()
 
 def approve_payment_db(payment_id: int, approved_by: str = "admin") -> bool:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE payments
-        SET status='approved', approved_at=datetime('now'), approved_by=?
-        WHERE id=? AND status='pending'
-        """,
-        (approved_by, payment_id),
-    )
-    conn.commit()
-    ok = (cur.rowcount or 0) > 0
-    conn.close()
-    return ok
+    with db() as conn:
+        r = conn.execute(
+            """
+            UPDATE payments
+            SET status='approved', approved_at=datetime('now'), approved_by=?
+            WHERE id=? AND status='pending'
+            RETURNING building_id, created_ts, created_at, method, amount_cents
+            """,
+            (approved_by, payment_id),
+        ).fetchone()
+        if r:
+            _bump_payments_rollup(conn, r, "approved")
+    return r is not None
 
 def reject_payment_db(payment_id: int, note: str | None = None, approved_by: str = "admin") -> bool:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE payments
-        SET status='rejected', approved_at=datetime('now'), approved_by=?, note=COALESCE(?, note)
-        WHERE id=? AND status='pending'
-        """,
-        (approved_by, note, payment_id),
-    )
-    conn.commit()
-    ok = (cur.rowcount or 0) > 0
-    conn.close()
-    return ok
+    with db() as conn:
+        r = conn.execute(
+            """
+            UPDATE payments
+            SET status='rejected', approved_at=datetime('now'), approved_by=?, note=COALESCE(?, note)
+            WHERE id=? AND status='pending'
+            RETURNING building_id, created_ts, created_at, method, amount_cents
+            """,
+            (approved_by, note, payment_id),
+        ).fetchone()
+        if r:
+            _bump_payments_rollup(conn, r, "rejected")
+    return r is not None
 
-def get_due_tenants_db(building_id: int | None, days_ahead: int = 0):
-    conn = get_connection()
-    cur = conn.cursor()
+def get_tenant_dues_db(building_id: int | None, days_ahead: int = 14, today: date | None = None) -> dict:
+    """
+    Tenants with a next_payment_date, bucketed in one indexed range read:
+      overdue    – before today
+      due_now    – today or earlier (overdue included)
+      due_soon   – after today, up to today + days_ahead
+      this_month – anywhere in today's calendar month
+    Dates are 'YYYY-MM-DD' strings compared as such; "today" is UTC.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    until = today + timedelta(days=max(0, int(days_ahead)))
+    month_start = today.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+    today_s, until_s = today.isoformat(), until.isoformat()
+    month_start_s, month_end_s = month_start.isoformat(), month_end.isoformat()
 
     sql = """
-    SELECT id, name, apartment, next_payment_date, building_id
+    SELECT id, name, apartment, next_payment_date, payment_type, building_id, chat_id
     FROM tenants
-    WHERE next_payment_date IS NOT NULL
-      AND date(next_payment_date) <= date('now', ?)
+    WHERE next_payment_date > ''
+      AND next_payment_date <= ?
     """
-    params = [f"+{int(days_ahead)} days"]
+    params = [max(until_s, month_end_s)]
+    if building_id:
+        sql += " AND building_id = ?"
+        params.append(building_id)
+    sql += " ORDER BY next_payment_date ASC"
+
+    conn = get_connection()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+
+    res = {
+        "today": today_s,
+        "until": until_s,
+        "month": month_start_s[:7],
+        "overdue": [],
+        "due_now": [],
+        "due_soon": [],
+        "this_month": [],
+    }
+    for r in rows:
+        d = r[3]
+        t = {
+            "id": r[0], "name": r[1], "apartment": r[2],
+            "next_payment_date": d, "payment_type": r[4],
+            "building_id": r[5], "chat_id": r[6],
+        }
+        if d < today_s:
+            res["overdue"].append(t)
+        if d <= today_s:
+            res["due_now"].append(t)
+        elif d <= until_s:
+            res["due_soon"].append(t)
+        if month_start_s <= d <= month_end_s:
+            res["this_month"].append(t)
+    return res
+
+def period_ts_range(year: int, month: int | None = None) -> tuple[int, int]:
+    """[start, end) epoch range (UTC) of a year, or of one month in it."""
+    if month:
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = datetime(year + (month == 12), month % 12 + 1, 1, tzinfo=timezone.utc)
+    else:
+        start = datetime(year, 1, 1, tzinfo=timezone.utc)
+        end = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp()), int(end.timestamp())
+
+def _payments_history_filter(building_id: int | None, year: int | None, month: int | None) -> tuple[str, list]:
+    q = ""
+    params = []
 
     if building_id:
-        sql += " AND building_id=?"
+        q += " AND p.building_id=?"
         params.append(building_id)
 
-    sql += " ORDER BY date(next_payment_date) ASC"
+    if year:
+        start, end = period_ts_range(int(year), int(month) if month else None)
+        q += " AND p.created_ts >= ? AND p.created_ts < ?"
+        params.extend([start, end])
+    elif month:
+        # month of any year – rare, no range possible
+        q += " AND strftime('%m', p.created_at) = ?"
+        params.append(f"{int(month):02d}")
 
-    cur.execute(sql, params)
-    rows = cur.fetchall()
-    conn.close()
-    return [
-        {"id": r[0], "name": r[1], "apartment": r[2], "next_payment_date": r[3], "building_id": r[4]}
-        for r in rows
-    ]
+    return q, params
 
-def get_payments_history_db(building_id: int | None, year: int | None = None, month: int | None = None):
+def get_payments_history_db(
+    building_id: int | None,
+    year: int | None = None,
+    month: int | None = None,
+    limit: int = 100,
+    cursor: str | None = None,
+):
     conn = get_connection()
     cur = conn.cursor()
 
     q = """
-    SELECT p.id, t.name, t.apartment, t.building_id,
-           p.amount_cents, p.currency, p.method, p.created_at
+    SELECT p.id, t.name, t.apartment, p.building_id,
+           p.amount_cents, p.currency, p.method, p.created_at, p.created_ts
     FROM payments p
     JOIN tenants t ON t.id = p.tenant_id
     WHERE p.status='approved'
     """
-    params = []
-
-    if building_id:
-        q += " AND t.building_id=?"
-        params.append(building_id)
+    where, params = _payments_history_filter(building_id, year, month)
+    q += where
 
-    if year:
-        q += " AND strftime('%Y', p.created_at) = ?"
-        params.append(str(year))
-    if month:
-        q += " AND strftime('%m', p.created_at) = ?"
-        params.append(f"{int(month):02d}")
+    after = decode_cursor(cursor, 2)
+    if after:
+        q += " AND (p.created_ts, p.id) < (?, ?)"
+        params.extend(after)
 
-    q += " ORDER BY p.created_at DESC"
+    q += " ORDER BY p.created_ts DESC, p.id DESC LIMIT ?"
+    params.append(limit)
 
     cur.execute(q, params)
     rows = cur.fetchall()
@@ -1663,8 +2902,79 @@ def get_payments_history_db(building_id: int | None, year: int | None = None, mo
         "currency": r[5],
         "method": r[6],
         "created_at": r[7],
+        "created_ts": r[8],
     } for r in rows]
 
+def get_payments_history_totals_db(building_id: int | None, year: int | None = None, month: int | None = None) -> dict:
+    """
+    Count and sum of approved payments over the whole filter (not just one
+    page), plus a per-method breakdown – read from payments_monthly, so the
+    cost doesn't grow with the number of payments.
+    """
+    q = """
+        SELECT method, SUM(count), SUM(sum_cents)
+        FROM payments_monthly
+        WHERE status = 'approved'
+    """
+    params = []
+    if building_id:
+        q += " AND building_id = ?"
+        params.append(building_id)
+    if year and month:
+        q += " AND ym = ?"
+        params.append(f"{int(year):04d}-{int(month):02d}")
+    elif year:
+        q += " AND ym BETWEEN ? AND ?"
+        params.extend([f"{int(year):04d}-01", f"{int(year):04d}-12"])
+    elif month:
+        q += " AND substr(ym, 6, 2) = ?"
+        params.append(f"{int(month):02d}")
+    q += " GROUP BY method ORDER BY SUM(sum_cents) DESC"
+
+    conn = get_connection()
+    rows = conn.execute(q, params).fetchall()
+    conn.close()
+
+    by_method = [{"method": r[0], "count": r[1], "sum_cents": r[2]} for r in rows]
+    return {
+        "count": sum(m["count"] for m in by_method),
+        "sum_cents": sum(m["sum_cents"] for m in by_method),
+        "by_method": by_method,
+    }
+
+# 'YYYY-MM' of a payment, UTC, as the history filter's period_ts_range counts it
+_PAYMENT_YM_SQL = "COALESCE(strftime('%Y-%m', {ts}, 'unixepoch'), substr({at}, 1, 7), '')"
+
+_PAYMENTS_ROLLUP_REBUILD_SQL = f"""
+    INSERT INTO payments_monthly (building_id, ym, status, method, count, sum_cents)
+    SELECT COALESCE(building_id, 0), {_PAYMENT_YM_SQL.format(ts="created_ts", at="created_at")},
+           status, COALESCE(method, ''), COUNT(*), COALESCE(SUM(amount_cents), 0)
+    FROM payments
+    WHERE status IN ('approved', 'rejected')
+    GROUP BY 1, 2, 3, 4
+"""
+
+def _bump_payments_rollup(conn, payment, status: str) -> None:
+    """Add one payment (building_id, created_ts, created_at, method, amount_cents) to its month."""
+    conn.execute(
+        f"""
+        INSERT INTO payments_monthly (building_id, ym, status, method, count, sum_cents)
+        VALUES (COALESCE(?, 0), {_PAYMENT_YM_SQL.format(ts="?", at="?")}, ?, COALESCE(?, ''), 1, COALESCE(?, 0))
+        ON CONFLICT (building_id, ym, status, method) DO UPDATE SET
+            count = count + 1,
+            sum_cents = sum_cents + excluded.sum_cents
+        """,
+        (payment[0], payment[1], payment[2], status, payment[3], payment[4]),
+    )
+
+def rebuild_payments_rollup_db() -> int:
+    """Recompute payments_monthly from payments (repair / after bulk edits); returns row count."""
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM payments_monthly")
+        conn.execute(_PAYMENTS_ROLLUP_REBUILD_SQL)
+        return conn.execute("SELECT COUNT(*) FROM payments_monthly").fetchone()[0]
+
 
 #------- POLLS------
 
@@ -1707,15 +3017,19 @@ def create_poll_db(building_id: int, title: str, description: str, target_group:
 
     cur.execute(
         """
-        INSERT INTO polls(building_id, title, description, target_group, is_anonymous, closes_at)
-        VALUES(?,?,?,?,?,?)
+        INSERT INTO polls(building_id, title, description, target_group, is_anonymous, closes_at, created_ts)
+        VALUES(?,?,?,?,?,?,?)
         """,
-        (building_id, title, description, target_group, is_anonymous, closes_at),
+        (building_id, title, description, target_group, is_anonymous, closes_at, now_utc_ts()),
     )
     poll_id = cur.lastrowid
 
     for opt in clean_opts:
         cur.execute("INSERT INTO poll_options(poll_id, option_text) VALUES(?,?)", (poll_id, opt))
+        cur.execute(
+            "INSERT INTO poll_option_tallies(poll_id, option_id, votes) VALUES(?,?,0)",
+            (poll_id, cur.lastrowid),
+        )
 
     conn.commit()
     conn.close()
@@ -1740,7 +3054,7 @@ def list_polls_db(building_id: int | None = None, status: str | None = None, lim
         sql += " AND status=?"
         params.append(status)
 
-    sql += " ORDER BY created_at DESC LIMIT ?"
+    sql += " ORDER BY created_ts DESC, id DESC LIMIT ?"
     params.append(int(limit))
 
     cur.execute(sql, params)
@@ -1760,88 +3074,91 @@ def get_poll_with_options_db(poll_id: int):
     cur.execute(
         """
         SELECT id, building_id, title, description, target_group, is_anonymous, status, closes_at, sent_at, created_at
-        FROM polls WHERE id=?
-        """,
-        (poll_id,),
-    )
-    p = cur.fetchone()
-    if not p:
-        conn.close()
-        return None
-
-    cur.execute("SELECT id, option_text FROM poll_options WHERE poll_id=? ORDER BY id", (poll_id,))
-    opts = cur.fetchall()
-
-    conn.close()
-    return {
-        "id": p[0], "building_id": p[1], "title": p[2], "description": p[3],
-        "target_group": p[4], "is_anonymous": p[5], "status": p[6],
-        "closes_at": p[7],"sent_at": p[8],"created_at": p[9],
-        "options": [{"id": r[0], "text": r[1]} for r in opts],
-    }
-
-def cast_vote_db(poll_id: int, option_id: int, tenant_id: int):
-    """
-    Returns:
-      ok True/False
-      error: already_voted / poll_closed / invalid_option
-    """
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("SELECT status FROM polls WHERE id=?", (poll_id,))
-    r = cur.fetchone()
-    if not r:
-        conn.close()
-        return {"ok": False, "error": "poll_not_found"}
-    if r[0] != "open":
-        conn.close()
-        return {"ok": False, "error": "poll_closed"}
-
-    cur.execute("SELECT 1 FROM poll_options WHERE id=? AND poll_id=?", (option_id, poll_id))
-    if not cur.fetchone():
-        conn.close()
-        return {"ok": False, "error": "invalid_option"}
-
-    try:
-        cur.execute(
-            "INSERT INTO poll_votes(poll_id, option_id, tenant_id) VALUES(?,?,?)",
-            (poll_id, option_id, tenant_id),
-        )
-        conn.commit()
-    except Exception:
-        conn.close()
-        return {"ok": False, "error": "already_voted"}
-
-    conn.close()
-    return {"ok": True}
-
-def poll_results_db(poll_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, option_text FROM poll_options WHERE poll_id=? ORDER BY id", (poll_id,))
-    opts = cur.fetchall()
-
-    cur.execute(
-        """
-        SELECT option_id, COUNT(*)
-        FROM poll_votes
-        WHERE poll_id=?
-        GROUP BY option_id
+        FROM polls WHERE id=?
         """,
         (poll_id,),
     )
-    counts = {row[0]: row[1] for row in cur.fetchall()}
+    p = cur.fetchone()
+    if not p:
+        conn.close()
+        return None
 
-    cur.execute("SELECT COUNT(*) FROM poll_votes WHERE poll_id=?", (poll_id,))
-    total = int(cur.fetchone()[0] or 0)
+    cur.execute("SELECT id, option_text FROM poll_options WHERE poll_id=? ORDER BY id", (poll_id,))
+    opts = cur.fetchall()
 
     conn.close()
+    return {
+        "id": p[0], "building_id": p[1], "title": p[2], "description": p[3],
+        "target_group": p[4], "is_anonymous": p[5], "status": p[6],
+        "closes_at": p[7],"sent_at": p[8],"created_at": p[9],
+        "options": [{"id": r[0], "text": r[1]} for r in opts],
+    }
 
-    out = []
-    for oid, txt in opts:
-        out.append({"option_id": oid, "text": txt, "votes": int(counts.get(oid, 0))})
+def cast_vote_db(poll_id: int, option_id: int, tenant_id: int):
+    """
+    Record a vote and bump its tallies in one write transaction.
+    Returns:
+      ok True/False
+      error: already_voted / poll_closed / invalid_option
+    """
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+
+        r = conn.execute(
+            """
+            SELECT p.status, o.id
+            FROM polls p
+            LEFT JOIN poll_options o ON o.id = ? AND o.poll_id = p.id
+            WHERE p.id = ?
+            """,
+            (option_id, poll_id),
+        ).fetchone()
+        if not r:
+            return {"ok": False, "error": "poll_not_found"}
+        if r[0] != "open":
+            return {"ok": False, "error": "poll_closed"}
+        if r[1] is None:
+            return {"ok": False, "error": "invalid_option"}
+
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO poll_votes(poll_id, option_id, tenant_id) VALUES(?,?,?)",
+            (poll_id, option_id, tenant_id),
+        )
+        if cur.rowcount != 1:
+            return {"ok": False, "error": "already_voted"}
+
+        conn.execute(
+            """
+            INSERT INTO poll_option_tallies(poll_id, option_id, votes) VALUES(?,?,1)
+            ON CONFLICT(poll_id, option_id) DO UPDATE SET votes = votes + 1
+            """,
+            (poll_id, option_id),
+        )
+        conn.execute("UPDATE polls SET total_votes = total_votes + 1 WHERE id=?", (poll_id,))
+
+    return {"ok": True}
+
+def poll_results_db(poll_id: int):
+    """Results from the tallies: one row per option, whatever the vote count."""
+    with db() as conn:
+        rows = conn.execute(
+            """
+            SELECT p.total_votes, o.id, o.option_text, COALESCE(t.votes, 0)
+            FROM polls p
+            LEFT JOIN poll_options o ON o.poll_id = p.id
+            LEFT JOIN poll_option_tallies t ON t.poll_id = p.id AND t.option_id = o.id
+            WHERE p.id = ?
+            ORDER BY o.id
+            """,
+            (poll_id,),
+        ).fetchall()
+
+    total = int(rows[0][0] or 0) if rows else 0
+    out = [
+        {"option_id": oid, "text": txt, "votes": int(votes)}
+        for _, oid, txt, votes in rows
+        if oid is not None
+    ]
 
     return {"poll_id": poll_id, "total_votes": total, "options": out}
 
@@ -1853,14 +3170,6 @@ def close_poll_db(poll_id: int):
     conn.close()
     return True
 
-def mark_poll_sent_db(poll_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE polls SET sent_at=datetime('now') WHERE id=? AND (sent_at IS NULL OR sent_at='')", (poll_id,))
-    conn.commit()
-    changed = cur.rowcount
-    conn.close()
-    return changed > 0
 #----------Announcement--------#
 
 def create_announcement_db(building_id: int, title: str, body: str, target_group: str):
@@ -1868,10 +3177,10 @@ def create_announcement_db(building_id: int, title: str, body: str, target_group
     cur = conn.cursor()
     cur.execute(
         """
-        INSERT INTO announcements(building_id, title, body, target_group)
-        VALUES(?,?,?,?)
+        INSERT INTO announcements(building_id, title, body, target_group, created_ts)
+        VALUES(?,?,?,?,?)
         """,
-        (building_id, title.strip(), body.strip(), target_group),
+        (building_id, title.strip(), body.strip(), target_group, now_utc_ts()),
     )
     conn.commit()
     new_id = cur.lastrowid
@@ -1882,20 +3191,26 @@ def list_announcements_db(building_id: int | None = None, limit: int = 50):
     conn = get_connection()
     cur = conn.cursor()
 
-    sql = "SELECT id, building_id, title, body, target_group, created_at FROM announcements"
+    sql = """
+    SELECT a.id, a.building_id, a.title, a.body, a.target_group, a.created_at,
+           j.id, j.total, j.sent, j.failed
+    FROM announcements a
+    LEFT JOIN delivery_jobs j ON j.kind = 'announcement' AND j.ref_id = a.id
+    """
     params = []
     if building_id:
-        sql += " WHERE building_id=?"
+        sql += " WHERE a.building_id=?"
         params.append(building_id)
 
-    sql += " ORDER BY created_at DESC LIMIT ?"
+    sql += " ORDER BY a.created_ts DESC, a.id DESC LIMIT ?"
     params.append(int(limit))
 
     cur.execute(sql, params)
     rows = cur.fetchall()
     conn.close()
     return [
-        {"id": r[0], "building_id": r[1], "title": r[2], "body": r[3], "target_group": r[4], "created_at": r[5]}
+        {"id": r[0], "building_id": r[1], "title": r[2], "body": r[3], "target_group": r[4], "created_at": r[5],
+         "job_id": r[6], "total": r[7], "sent": r[8], "failed": r[9]}
         for r in rows
     ]
 
@@ -1923,6 +3238,657 @@ def get_recipients_chat_ids_by_group_db(building_id: int, target_group: str):
     return [int(r[0]) for r in rows if r[0]]
 
 
+# ─────────── Delivery outbox helpers ───────────
+
+def create_delivery_job_db(
+    kind: str,
+    ref_id: int | None,
+    building_id: int | None,
+    chat_ids: list[int],
+    text: str,
+    reply_markup: dict | None = None,
+) -> int:
+    """Queue one message per distinct chat_id in a single transaction; returns the job id."""
+    messages = [{"chat_id": cid, "text": text, "reply_markup": reply_markup} for cid in chat_ids]
+    return create_delivery_job_messages_db(kind, ref_id, building_id, messages)
+
+def create_delivery_job_messages_db(
+    kind: str,
+    ref_id: int | None,
+    building_id: int | None,
+    messages: list[dict],
+) -> int:
+    """
+    Like create_delivery_job_db, but each message carries its own text and
+    reply_markup: [{"chat_id", "text", "reply_markup"}]. The first message
+    per chat_id wins.
+    """
+    now = now_utc_ts()
+    rows = {}
+    for m in messages:
+        cid = int(m["chat_id"] or 0)
+        if cid and cid not in rows:
+            markup = m.get("reply_markup")
+            rows[cid] = (m["text"], json.dumps(markup, ensure_ascii=False) if markup else None)
+
+    with db() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO delivery_jobs (kind, ref_id, building_id, total, created_ts, finished_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (kind, ref_id, building_id, len(rows), now, None if rows else now),
+        )
+        job_id = cur.lastrowid
+        conn.executemany(
+            """
+            INSERT INTO outbox_messages (job_id, chat_id, text, reply_markup, next_attempt_ts)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(job_id, cid, text, markup, now) for cid, (text, markup) in rows.items()],
+        )
+    return job_id
+
+def claim_outbox_batch_db(limit: int, lease_seconds: int = 60) -> list[dict]:
+    """
+    Atomically lease up to `limit` due messages to the calling dispatcher.
+    A lease that runs out (dispatcher died mid-send) makes the row claimable
+    again – except in at_most_once jobs, where it is marked failed instead.
+    """
+    now = now_utc_ts()
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+
+        interrupted = conn.execute(
+            """
+            SELECT m.id FROM outbox_messages m
+            JOIN delivery_jobs j ON j.id = m.job_id
+            WHERE m.status = 'sending' AND m.lease_until_ts < ? AND j.at_most_once = 1
+            """,
+            (now,),
+        ).fetchall()
+        for (msg_id,) in interrupted:
+            _finish_outbox_message(conn, msg_id, "failed", "failed", last_error="interrupted mid-send, not retried")
+
+        rows = conn.execute(
+            """
+            UPDATE outbox_messages
+            SET status = 'sending', lease_until_ts = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox_messages
+                WHERE status = 'queued' AND next_attempt_ts <= ?
+                UNION ALL
+                SELECT id FROM outbox_messages
+                WHERE status = 'sending' AND lease_until_ts < ?
+                LIMIT ?
+            )
+            RETURNING id, job_id, chat_id, text, reply_markup, attempts, lease_until_ts
+            """,
+            (now + lease_seconds, now, now, int(limit)),
+        ).fetchall()
+
+        job_ids = sorted({r[1] for r in rows})
+        at_most_once = set()
+        if job_ids:
+            marks = ",".join("?" * len(job_ids))
+            at_most_once = {
+                r[0]
+                for r in conn.execute(
+                    f"SELECT id FROM delivery_jobs WHERE id IN ({marks}) AND at_most_once = 1", job_ids
+                )
+            }
+
+    return [
+        {
+            "id": r[0],
+            "job_id": r[1],
+            "chat_id": r[2],
+            "text": r[3],
+            "reply_markup": json.loads(r[4]) if r[4] else None,
+            "attempts": r[5],
+            "lease_until_ts": r[6],
+            "at_most_once": r[1] in at_most_once,
+        }
+        for r in rows
+    ]
+
+def _finish_outbox_message(conn, msg_id: int, status: str, counter: str, **cols) -> None:
+    sets = ", ".join(f"{k} = ?" for k in cols)
+    cur = conn.execute(
+        f"""
+        UPDATE outbox_messages
+        SET status = ?, lease_until_ts = NULL{", " + sets if sets else ""}
+        WHERE id = ? AND status = 'sending'
+        RETURNING job_id
+        """,
+        (status, *cols.values(), msg_id),
+    )
+    r = cur.fetchone()
+    if not r:
+        return
+    conn.execute(
+        f"""
+        UPDATE delivery_jobs
+        SET {counter} = {counter} + 1,
+            finished_ts = CASE WHEN sent + failed + 1 >= total THEN ? ELSE finished_ts END
+        WHERE id = ?
+        """,
+        (now_utc_ts(), r[0]),
+    )
+
+def mark_outbox_sent_db(msg_id: int, message_id: int | None = None) -> None:
+    with db() as conn:
+        _finish_outbox_message(
+            conn, msg_id, "sent", "sent", message_id=message_id, sent_ts=now_utc_ts(), last_error=None
+        )
+
+def mark_outbox_failed_db(msg_id: int, error: str) -> None:
+    with db() as conn:
+        _finish_outbox_message(conn, msg_id, "failed", "failed", last_error=(error or "")[:500])
+
+def mark_outbox_retry_db(msg_id: int, next_attempt_ts: int, error: str) -> None:
+    with db() as conn:
+        conn.execute(
+            """
+            UPDATE outbox_messages
+            SET status = 'queued', lease_until_ts = NULL, next_attempt_ts = ?, last_error = ?
+            WHERE id = ? AND status = 'sending'
+            """,
+            (int(next_attempt_ts), (error or "")[:500], msg_id),
+        )
+
+def queue_poll_delivery_db(poll_id: int, building_id: int, chat_ids: list[int], text: str, reply_markup: dict) -> dict:
+    """
+    Idempotent poll broadcast: the first call creates the poll's delivery job,
+    later calls only queue recipients that have no delivery row yet (e.g. newly
+    registered tenants), so nobody ever gets the poll twice. Marks the poll sent.
+    """
+    now = now_utc_ts()
+    markup = json.dumps(reply_markup, ensure_ascii=False) if reply_markup else None
+    unique_ids = list(dict.fromkeys(int(c) for c in chat_ids if c))
+
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        r = conn.execute("SELECT id FROM delivery_jobs WHERE kind = 'poll' AND ref_id = ?", (poll_id,)).fetchone()
+        created = r is None
+        if created:
+            job_id = conn.execute(
+                """
+                INSERT INTO delivery_jobs (kind, ref_id, building_id, total, created_ts, at_most_once)
+                VALUES ('poll', ?, ?, 0, ?, 1)
+                """,
+                (poll_id, building_id, now),
+            ).lastrowid
+        else:
+            job_id = r[0]
+
+        added = 0
+        for cid in unique_ids:
+            cur = conn.execute(
+                """
+                INSERT OR IGNORE INTO outbox_messages (job_id, chat_id, text, reply_markup, next_attempt_ts)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (job_id, cid, text, markup, now),
+            )
+            added += cur.rowcount
+
+        conn.execute(
+            """
+            UPDATE delivery_jobs
+            SET total = total + ?,
+                finished_ts = CASE WHEN ? > 0 THEN NULL WHEN finished_ts IS NULL AND sent + failed >= total THEN ? ELSE finished_ts END
+            WHERE id = ?
+            """,
+            (added, added, now, job_id),
+        )
+        conn.execute(
+            "UPDATE polls SET sent_at=datetime('now') WHERE id=? AND (sent_at IS NULL OR sent_at='')",
+            (poll_id,),
+        )
+
+    return {"job_id": job_id, "created": created, "queued": added}
+
+def get_poll_delivery_db(poll_id: int) -> dict | None:
+    with db() as conn:
+        r = conn.execute("SELECT id FROM delivery_jobs WHERE kind = 'poll' AND ref_id = ?", (poll_id,)).fetchone()
+    return get_delivery_job_db(r[0]) if r else None
+
+def list_delivery_messages_db(job_id: int, status: str | None = None, limit: int = 200) -> list[dict]:
+    """Per-recipient delivery rows of a job (who got it, Telegram message_id, last error)."""
+    sql = """
+    SELECT m.id, m.chat_id, m.status, m.attempts, m.message_id, m.last_error, m.sent_ts,
+           t.name, t.apartment
+    FROM outbox_messages m
+    LEFT JOIN tenants t ON t.chat_id = m.chat_id
+    WHERE m.job_id = ?
+    """
+    params: list = [job_id]
+    if status:
+        sql += " AND m.status = ?"
+        params.append(status)
+    sql += " ORDER BY m.id LIMIT ?"
+    params.append(int(limit))
+
+    with db() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [
+        {
+            "id": r[0], "chat_id": r[1], "status": r[2], "attempts": r[3],
+            "message_id": r[4], "last_error": r[5], "sent_ts": r[6],
+            "tenant_name": r[7], "apartment": r[8],
+        }
+        for r in rows
+    ]
+
+def get_delivery_job_db(job_id: int) -> dict | None:
+    with db() as conn:
+        r = conn.execute(
+            """
+            SELECT id, kind, ref_id, building_id, total, sent, failed, created_ts, finished_ts
+            FROM delivery_jobs WHERE id = ?
+            """,
+            (job_id,),
+        ).fetchone()
+    if not r:
+        return None
+    return {
+        "id": r[0], "kind": r[1], "ref_id": r[2], "building_id": r[3],
+        "total": r[4], "sent": r[5], "failed": r[6],
+        "pending": max(r[4] - r[5] - r[6], 0),
+        "done": r[8] is not None,
+        "created_ts": r[7], "finished_ts": r[8],
+    }
+
+
+# ─────────── Telegram media helpers ───────────
+
+def register_telegram_media_db(file_id: str, file_unique_id: str) -> dict:
+    """Remember a Telegram file (nothing is downloaded yet); keeps the newest file_id."""
+    with db() as conn:
+        conn.execute(
+            """
+            INSERT INTO telegram_media (file_unique_id, file_id, created_ts)
+            VALUES (?, ?, ?)
+            ON CONFLICT(file_unique_id) DO UPDATE SET file_id = excluded.file_id
+            """,
+            (file_unique_id, file_id, now_utc_ts()),
+        )
+    return get_telegram_media_db(file_unique_id)
+
+
+def get_telegram_media_db(file_unique_id: str) -> dict | None:
+    conn = get_connection()
+    r = conn.execute(
+        """
+        SELECT file_unique_id, file_id, stored_name, size_bytes, blob_sha256, created_ts, fetched_ts
+        FROM telegram_media
+        WHERE file_unique_id = ?
+        """,
+        (file_unique_id,),
+    ).fetchone()
+    conn.close()
+    return dict(r) if r else None
+
+
+def mark_telegram_media_stored_db(file_unique_id: str, sha256: str) -> str | None:
+    """
+    Point a fetched Telegram file at its upload blob (the processed one, if
+    that content was processed before) and give the tickets showing it their
+    reference. Returns the blob's rel_path, None if the blob is unknown.
+    """
+    with db() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        r = conn.execute(
+            """
+            SELECT COALESCE(p.sha256, u.sha256), COALESCE(p.rel_path, u.rel_path), COALESCE(p.size_bytes, u.size_bytes)
+            FROM upload_blobs u
+            LEFT JOIN upload_blobs p ON p.sha256 = u.processed_sha256
+            WHERE u.sha256 = ?
+            """,
+            (sha256,),
+        ).fetchone()
+        if not r:
+            return None
+        blob, rel_path, size_bytes = r
+        conn.execute(
+            """
+            UPDATE telegram_media
+            SET stored_name = ?, size_bytes = ?, blob_sha256 = ?, fetched_ts = ?
+            WHERE file_unique_id = ?
+            """,
+            (rel_path, size_bytes, blob, now_utc_ts(), file_unique_id),
+        )
+        # tickets filed before the file was fetched (or before gc_uploads dropped it)
+        conn.execute(
+            "UPDATE tickets SET image_blob = ? WHERE image_media = ? AND image_blob IS NOT ?",
+            (blob, file_unique_id, blob),
+        )
+    return rel_path
+
+# ─────────── Upload blob helpers ───────────
+
+_BLOB_URL_RE = re.compile(r"/uploads/cas/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.")
+_TELEGRAM_MEDIA_URL_RE = re.compile(r"/media/telegram/([A-Za-z0-9_-]+)")
+
+
+def upload_blob_key(image_url: str | None) -> str | None:
+    """sha256 of the content-addressed upload an image URL points at (None for other URLs)."""
+    m = _BLOB_URL_RE.search(image_url or "")
+    return m.group(1) if m else None
+
+
+def telegram_media_key(image_url: str | None) -> str | None:
+    """file_unique_id of a /media/telegram/ image URL (None for other URLs)."""
+    m = _TELEGRAM_MEDIA_URL_RE.search(image_url or "")
+    return m.group(1) if m else None
+
+
+def register_upload_blob_db(sha256: str, rel_path: str, size_bytes: int) -> bool:
+    """Record a stored blob; True if it is new, False if it was already known (dedup hit)."""
+    now = now_utc_ts()
+    with db() as conn:
+        cur = conn.execute(
+            """
+            INSERT OR IGNORE INTO upload_blobs (sha256, rel_path, size_bytes, created_ts, last_seen_ts)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (sha256, rel_path, size_bytes, now, now),
+        )
+        if cur.rowcount:
+            return True
+        # seen again: restart its grace period for the garbage collector
+        conn.execute("UPDATE upload_blobs SET last_seen_ts = ? WHERE sha256 = ?", (now, sha256))
+        return False
+
+
+def get_upload_blob_db(sha256: str) -> dict | None:
+    """A stored blob, with the path of its processed version if it has one."""
+    conn = get_connection()
+    r = conn.execute(
+        """
+        SELECT u.sha256, u.rel_path, u.size_bytes, u.ref_count, p.sha256, p.rel_path
+        FROM upload_blobs u
+        LEFT JOIN upload_blobs p ON p.sha256 = u.processed_sha256
+        WHERE u.sha256 = ?
+        """,
+        (sha256,),
+    ).fetchone()
+    conn.close()
+    if not r:
+        return None
+    return {
+        "sha256": r[0], "rel_path": r[1], "size_bytes": r[2], "ref_count": r[3],
+        "processed_sha256": r[4], "processed_rel_path": r[5],
+    }
+
+
+def _processed_image(conn, image_url: str | None, image_blob: str | None) -> tuple[str | None, str | None]:
+    """(image_url, image_blob) moved to the processed blob when the upload already has one."""
+    if not image_blob:
+        return image_url, image_blob
+    r = conn.execute(
+        """
+        SELECT u.rel_path, p.sha256, p.rel_path
+        FROM upload_blobs u JOIN upload_blobs p ON p.sha256 = u.processed_sha256
+        WHERE u.sha256 = ?
+        """,
+        (image_blob,),
+    ).fetchone()
+    if not r:
+        return image_url, image_blob
+    return image_url.replace(r[0], r[2]), r[1]
+
+
+def link_processed_upload_blob_db(sha256: str, processed_sha256: str) -> int:
+    """
+    Record that blob `sha256` was re-encoded as `processed_sha256` and move
+    its tickets (image_blob and image_url) and Telegram media over. Returns
+    tickets moved.
+    """
+    if sha256 == processed_sha256:
+        return 0
+    with db() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "SELECT sha256, rel_path, size_bytes FROM upload_blobs WHERE sha256 IN (?, ?)", (sha256, processed_sha256)
+        ).fetchall()
+        paths = {r[0]: r[1] for r in rows}
+        if len(paths) < 2:
+            # the original was collected meanwhile; the processed blob will be too
+            return 0
+        conn.execute("UPDATE upload_blobs SET processed_sha256 = ? WHERE sha256 = ?", (processed_sha256, sha256))
+        conn.execute(
+            "UPDATE telegram_media SET stored_name = ?, size_bytes = ?, blob_sha256 = ? WHERE blob_sha256 = ?",
+            (paths[processed_sha256], next(r[2] for r in rows if r[0] == processed_sha256), processed_sha256, sha256),
+        )
+        cur = conn.execute(
+            """
+            UPDATE tickets SET image_url = replace(image_url, ?, ?), image_blob = ?
+            WHERE image_blob = ?
+            """,
+            (paths[sha256], paths[processed_sha256], processed_sha256, sha256),
+        )
+        return cur.rowcount
+
+
+def list_orphan_upload_blobs_db(seen_before_ts: int, limit: int = 500) -> list[dict]:
+    conn = get_connection()
+    rows = conn.execute(
+        """
+        SELECT sha256, rel_path, size_bytes
+        FROM upload_blobs
+        WHERE ref_count <= 0 AND last_seen_ts < ?
+        LIMIT ?
+        """,
+        (seen_before_ts, limit),
+    ).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def delete_orphan_upload_blob_db(sha256: str, seen_before_ts: int) -> bool:
+    """Drop a blob row only if it is still unreferenced and untouched; True if deleted."""
+    with db() as conn:
+        cur = conn.execute(
+            "DELETE FROM upload_blobs WHERE sha256 = ? AND ref_count <= 0 AND last_seen_ts < ?",
+            (sha256, seen_before_ts),
+        )
+        return cur.rowcount > 0
+
+
+def known_upload_blobs_db(keys: list[str]) -> set[str]:
+    if not keys:
+        return set()
+    conn = get_connection()
+    rows = conn.execute(
+        f"SELECT sha256 FROM upload_blobs WHERE sha256 IN ({','.join('?' * len(keys))})",
+        keys,
+    ).fetchall()
+    conn.close()
+    return {r[0] for r in rows}
+
+
+def recount_upload_blob_refs_db() -> int:
+    """Rebuild ref_count from tickets.image_blob (repair tool); returns rows changed."""
+    with db() as conn:
+        cur = conn.execute(
+            """
+            UPDATE upload_blobs
+            SET ref_count = (SELECT COUNT(*) FROM tickets t WHERE t.image_blob = upload_blobs.sha256)
+            WHERE ref_count != (SELECT COUNT(*) FROM tickets t WHERE t.image_blob = upload_blobs.sha256)
+            """
+        )
+        return cur.rowcount
+
+# ─────────── Payment reminder helpers ───────────
+
+def pending_payment_tenant_ids_db() -> set[int]:
+    """Tenants with a payment waiting for approval (they are not reminded)."""
+    conn = get_connection()
+    rows = conn.execute("SELECT DISTINCT tenant_id FROM payments WHERE status = 'pending'").fetchall()
+    conn.close()
+    return {r[0] for r in rows}
+
+def queue_payment_reminders_db(reminders: list[dict], dry_run: bool = False) -> dict:
+    """
+    reminders: [{"tenant_id", "building_id", "chat_id", "period_ym", "stage",
+    "text", "reply_markup"}]. Skips any (tenant_id, period_ym, stage) already
+    reminded and queues the rest as one delivery job per building, all in one
+    transaction. dry_run does the same work and rolls it back.
+    Returns {"queued", "duplicates", "jobs": [job ids]}.
+    """
+    now = now_utc_ts()
+    fresh: dict[int | None, list[dict]] = {}
+    duplicates = 0
+    jobs = []
+
+    with db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for r in reminders:
+            cur = conn.execute(
+                """
+                INSERT INTO payment_reminders (tenant_id, period_ym, stage, chat_id, building_id, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (tenant_id, period_ym, stage) DO NOTHING
+                """,
+                (r["tenant_id"], r["period_ym"], r["stage"], r["chat_id"], r["building_id"], now),
+            )
+            if cur.rowcount:
+                fresh.setdefault(r["building_id"], []).append(r)
+            else:
+                duplicates += 1
+
+        for building_id, batch in fresh.items():
+            job_id = create_delivery_job_messages_db("payment_reminder", None, building_id, batch)
+            jobs.append(job_id)
+            conn.executemany(
+                "UPDATE payment_reminders SET job_id = ? WHERE tenant_id = ? AND period_ym = ? AND stage = ?",
+                [(job_id, r["tenant_id"], r["period_ym"], r["stage"]) for r in batch],
+            )
+
+        if dry_run:
+            conn.rollback()
+            jobs = []
+
+    return {"queued": sum(len(b) for b in fresh.values()), "duplicates": duplicates, "jobs": jobs}
+
+def acquire_scheduler_lease_db(name: str, owner: str, ttl_seconds: int) -> bool:
+    """
+    Take or renew the lease on job `name` for `ttl_seconds`. True if `owner`
+    holds it now: it was free, expired, or already this owner's.
+    """
+    now = now_utc_ts()
+    with db() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO scheduler_leases (name, owner, until_ts) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, until_ts = excluded.until_ts
+            WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.until_ts < ?
+            """,
+            (name, owner, now + ttl_seconds, now),
+        )
+        return cur.rowcount > 0
+
+def release_scheduler_lease_db(name: str, owner: str) -> None:
+    with db() as conn:
+        conn.execute("DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (name, owner))
+
+# ─────────── Dashboard summary cache ───────────
+
+# triggers keep rows current; the TTL only bounds how stale a missed write can leave one
+DASHBOARD_SUMMARY_TTL = int(os.getenv("DASHBOARD_SUMMARY_TTL", "300"))
+# rows kept per list in a summary (the dashboard shows 20)
+DASHBOARD_SUMMARY_ROWS = 20
+
+def _build_dashboard_summary(conn, building_id: int | None, today: date) -> dict:
+    where, params = ("WHERE building_id = ?", [building_id]) if building_id else ("", [])
+
+    tenants = conn.execute(
+        f"""
+        SELECT id, name, apartment, tenant_type, email, payment_type, next_payment_date,
+               parking_slots, chat_id, building_id
+        FROM tenants {where}
+        ORDER BY building_id, apartment, name
+        """,
+        params,
+    ).fetchall()
+    missing = []
+    linked = 0
+    for r in tenants:
+        t = {
+            "id": r[0], "name": r[1], "apartment": r[2], "tenant_type": r[3],
+            "email": r[4], "payment_type": r[5], "next_payment_date": r[6],
+            "parking_slots": r[7], "chat_id": r[8], "building_id": r[9],
+        }
+        if str(t["chat_id"] or "").strip():
+            linked += 1
+        miss = compute_missing_tenant_fields(t)
+        if miss:
+            missing.append({**t, "missing": miss})
+
+    tickets = dict(conn.execute(f"SELECT status, COUNT(*) FROM tickets {where} GROUP BY status", params).fetchall())
+    pending = conn.execute(
+        "SELECT COUNT(*) FROM payments WHERE status = 'pending'" + (" AND building_id = ?" if building_id else ""),
+        params,
+    ).fetchone()[0]
+    due = get_tenant_dues_db(building_id, days_ahead=0, today=today)["this_month"]
+
+    return {
+        "tenant_count": len(tenants),
+        "linked_count": linked,
+        "missing_count": len(missing),
+        "tenants_missing": missing[:DASHBOARD_SUMMARY_ROWS],
+        "due_this_month_count": len(due),
+        "due_this_month": due[:DASHBOARD_SUMMARY_ROWS],
+        "open_tickets": tickets.get("open", 0),
+        "in_progress_tickets": tickets.get("in_progress", 0),
+        "pending_payments": pending,
+    }
+
+def get_dashboard_summary_db(building_id: int | None) -> dict:
+    """
+    Tenant / ticket / payment counts, first tenants missing details and
+    first tenants due this month for the dashboard – one point read while
+    the cached row is current, else recomputed and stored.
+    """
+    key = int(building_id or 0)
+    today = datetime.now(timezone.utc).date()
+    now = now_utc_ts()
+
+    conn = get_connection()
+    r = conn.execute(
+        "SELECT as_of, computed_ts, summary FROM dashboard_summaries WHERE building_id = ?",
+        (key,),
+    ).fetchone()
+    conn.close()
+    if r and r[0] == today.isoformat() and r[1] + DASHBOARD_SUMMARY_TTL > now:
+        return {**json.loads(r[2]), "computed_ts": r[1]}
+
+    with db() as conn:
+        # one read snapshot, no write lock: writers carry on while this is built
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        r = conn.execute("SELECT gen FROM dashboard_summary_gens WHERE building_id = ?", (key,)).fetchone()
+        gen = r[0] if r else 0
+        summary = _build_dashboard_summary(conn, building_id, today)
+
+    with db() as conn:
+        # kept only if no write bumped the generation since the snapshot
+        conn.execute(
+            """
+            INSERT INTO dashboard_summaries (building_id, as_of, computed_ts, summary)
+            SELECT ?, ?, ?, ?
+            WHERE COALESCE((SELECT gen FROM dashboard_summary_gens WHERE building_id = ?), 0) = ?
+            ON CONFLICT (building_id) DO UPDATE SET
+                as_of = excluded.as_of, computed_ts = excluded.computed_ts, summary = excluded.summary
+            """,
+            (key, today.isoformat(), now, json.dumps(summary, ensure_ascii=False), key, gen),
+        )
+    return {**summary, "computed_ts": now}
+
 #--- tenants portal----#
 
 def create_tenant_portal_token_db(tenant_id: int, ttl_minutes: int = 30) -> dict:
@@ -1930,17 +3896,18 @@ def create_tenant_portal_token_db(tenant_id: int, ttl_minutes: int = 30) -> dict
     Creates a one-time-ish login token (we still allow reuse until expiry unless you enforce used_at).
     """
     token = secrets.token_urlsafe(32)
-    expires = datetime.now(timezone.utc) + timedelta(minutes=ttl_minutes)
+    now = datetime.now(timezone.utc)
+    expires = now + timedelta(minutes=ttl_minutes)
     expires_at = expires.isoformat()
 
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
         """
-        INSERT INTO tenant_portal_tokens(tenant_id, token, expires_at)
-        VALUES(?,?,?)
+        INSERT INTO tenant_portal_tokens(tenant_id, token, expires_at, expires_ts, created_ts)
+        VALUES(?,?,?,?,?)
         """,
-        (tenant_id, token, expires_at),
+        (tenant_id, token, expires_at, int(expires.timestamp()), int(now.timestamp())),
     )
     conn.commit()
     conn.close()
@@ -1952,7 +3919,7 @@ def get_tenant_portal_token_db(token: str) -> dict | None:
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT id, tenant_id, token, expires_at, used_at, created_at
+        SELECT id, tenant_id, token, expires_at, used_at, created_at, expires_ts
         FROM tenant_portal_tokens
         WHERE token=?
         """,
@@ -1969,6 +3936,7 @@ def get_tenant_portal_token_db(token: str) -> dict | None:
         "expires_at": r[3],
         "used_at": r[4],
         "created_at": r[5],
+        "expires_ts": r[6],
     }
 
 
@@ -1983,7 +3951,10 @@ def mark_tenant_portal_token_used_db(token_id: int):
     conn.close()
 
 
-def is_token_expired(expires_at_iso: str) -> bool:
+def is_token_expired(expires_at_iso: str | int) -> bool:
+    if isinstance(expires_at_iso, int):
+        # expires_ts (epoch seconds)
+        return now_utc_ts() > expires_at_iso
     try:
         # stored in UTC isoformat
         exp = datetime.fromisoformat(expires_at_iso.replace("Z", "+00:00"))
@@ -2006,6 +3977,56 @@ def is_tenant_fully_registered(tenant: dict) -> bool:
         return False
     return True
 
+def get_bot_context_db(chat_id: int, default_lang: str = "he") -> dict:
+    """
+    Everything the bot needs to answer an update, in one joined query:
+    language, tenant row, registration state and payment-CTA state.
+    """
+    with db() as conn:
+        r = conn.execute(
+            """
+            SELECT us.language,
+                   t.id, t.building_id, t.name, t.apartment, t.tenant_type, t.email,
+                   t.payment_type, t.next_payment_date, t.parking_slots, t.chat_id,
+                   EXISTS (
+                       SELECT 1 FROM payments p WHERE p.tenant_id = t.id AND p.status = 'pending'
+                   )
+            FROM (SELECT ? AS chat_id) c
+            LEFT JOIN user_settings us ON us.chat_id = c.chat_id
+            LEFT JOIN tenants t ON t.chat_id = c.chat_id AND c.chat_id > 0
+            LIMIT 1
+            """,
+            (chat_id,),
+        ).fetchone()
+
+        lang = r[0]
+        if lang is None:
+            # same first-contact behaviour as get_user_language_db
+            lang = default_lang
+            conn.execute(
+                "INSERT OR IGNORE INTO user_settings (chat_id, language) VALUES (?, ?)",
+                (chat_id, lang),
+            )
+
+    tenant = None
+    if r[1] is not None and int(r[2] or 0) > 0:
+        tenant = {
+            "id": r[1], "building_id": r[2], "name": r[3], "apartment": r[4],
+            "tenant_type": r[5], "email": r[6], "payment_type": r[7],
+            "next_payment_date": r[8], "parking_slots": r[9], "chat_id": r[10],
+        }
+
+    show_pay, reason = should_add_payment_cta(tenant, has_pending=bool(r[11])) if tenant else (False, None)
+
+    return {
+        "chat_id": chat_id,
+        "language": lang,
+        "tenant": tenant,
+        "is_registered": bool(tenant and (tenant.get("apartment") or "").strip()),
+        "is_fully_registered": is_tenant_fully_registered(tenant),
+        "payment_cta": {"show": show_pay, "reason": reason},
+    }
+
 
 # ------- Dashboard data fetchers (תתאים אם שמות הטבלאות אצלך שונים) -------
 
@@ -2616,6 +4637,7 @@ def link_telegram_admin_to_building_db(chat_id: str, email: str, building_id: in
 
     conn.commit()
     conn.close()
+    invalidate_tenant_cache(chat_id=chat_id)
 
 def link_staff_user_telegram_db(email: str, chat_id: str):
     conn = get_connection()
@@ -2694,4 +4716,5 @@ def reset_user_by_chat_id_db(chat_id: str):
         pass
 
     conn.commit()
-    conn.close()
\ No newline at end of file
+    conn.close()
+    invalidate_tenant_cache(chat_id=chat_id)
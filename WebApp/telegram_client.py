@@ -0,0 +1,139 @@
+"""
+Process-wide HTTP client for the Telegram Bot API.
+
+One requests.Session per process keeps a pool of keep-alive connections to
+api.telegram.org, so messages and proof downloads reuse TCP/TLS sessions
+instead of handshaking on every call. Point TELEGRAM_API_BASE at a local fake
+server, or pass your own requests adapter, to run without Telegram.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "16"))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+TELEGRAM_DOWNLOAD_TIMEOUT = float(os.getenv("TELEGRAM_DOWNLOAD_TIMEOUT", "20"))
+
+
+class TelegramClient:
+    """
+    Thin wrapper over a pooled requests.Session.
+
+    adapter: any requests transport adapter; defaults to an HTTPAdapter with
+    TELEGRAM_POOL_SIZE keep-alive connections and no automatic retries
+    (callers decide what is safe to retry).
+    """
+
+    def __init__(
+        self,
+        token: str | None,
+        base_url: str = TELEGRAM_API_BASE,
+        pool_size: int = TELEGRAM_POOL_SIZE,
+        timeout: tuple[float, float] = (TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT),
+        adapter: requests.adapters.BaseAdapter | None = None,
+    ):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.pid = os.getpid()
+
+        self.session = requests.Session()
+        adapter = adapter or HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base_url}/bot{self.token}"
+
+    def call(self, method: str, payload: dict | None = None, params: dict | None = None, timeout=None) -> requests.Response:
+        """POST a Bot API method (JSON body) or GET it with query params."""
+        url = f"{self.api_url}/{method}"
+        if payload is not None:
+            return self.session.post(url, json=payload, timeout=timeout or self.timeout)
+        return self.session.get(url, params=params, timeout=timeout or self.timeout)
+
+    def send_message(self, chat_id: int, text: str, reply_markup: dict | None = None) -> requests.Response:
+        payload = {"chat_id": chat_id, "text": text}
+        if reply_markup:
+            payload["reply_markup"] = reply_markup
+        return self.call("sendMessage", payload)
+
+    def deliver(self, chat_id: int, text: str, reply_markup: dict | None = None) -> dict:
+        """
+        sendMessage for the outbox dispatcher: reports the outcome instead of
+        raising, so failed sends can be retried or given up on.
+        """
+        if not self.token:
+            return {"ok": False, "error": "BOT_TOKEN not set", "permanent": True}
+
+        try:
+            resp = self.send_message(chat_id, text, reply_markup)
+        except requests.RequestException as e:
+            # only a failed connect proves nothing reached Telegram
+            return {"ok": False, "error": str(e), "ambiguous": not isinstance(e, requests.ConnectTimeout)}
+
+        try:
+            data = resp.json()
+        except ValueError:
+            data = {}
+
+        if resp.ok and data.get("ok"):
+            return {"ok": True, "message_id": (data.get("result") or {}).get("message_id")}
+
+        error = f"{resp.status_code} {data.get('description') or resp.text[:200]}"
+        if resp.status_code == 429:
+            retry_after = (data.get("parameters") or {}).get("retry_after") or 5
+            return {"ok": False, "error": error, "retry_after": int(retry_after)}
+        # 400 chat not found / 403 bot blocked by the user: retrying won't help
+        return {"ok": False, "error": error, "permanent": resp.status_code in (400, 403)}
+
+    def get_file_path(self, file_id: str) -> str | None:
+        r = self.call("getFile", params={"file_id": file_id})
+        if not r.ok:
+            return None
+        j = r.json() or {}
+        return (j.get("result") or {}).get("file_path")
+
+    def download_file(self, file_path: str, stream: bool = True) -> requests.Response:
+        """
+        GET a file from Telegram's file storage.
+        With stream=True the caller must close() the response to give the
+        connection back to the pool.
+        """
+        url = f"{self.base_url}/file/bot{self.token}/{file_path}"
+        return self.session.get(url, stream=stream, timeout=(self.timeout[0], TELEGRAM_DOWNLOAD_TIMEOUT))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_CLIENT: TelegramClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_telegram_client() -> TelegramClient:
+    """Return this process's client (re-created after a gunicorn fork)."""
+    global _CLIENT
+    client = _CLIENT
+    if client is None or client.pid != os.getpid():
+        with _CLIENT_LOCK:
+            if _CLIENT is None or _CLIENT.pid != os.getpid():
+                # pooled sockets must not be shared with the parent process
+                _CLIENT = TelegramClient(
+                    os.getenv("BOT_TOKEN"),
+                    base_url=os.getenv("TELEGRAM_API_BASE", TELEGRAM_API_BASE),
+                )
+            client = _CLIENT
+    return client
+
+
+def set_telegram_client(client: TelegramClient | None) -> None:
+    """Swap the process-wide client, e.g. for one pointed at a fake Telegram server."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT = client
@@ -0,0 +1,182 @@
+"""
+Content-addressed storage for uploaded images.
+
+Each upload is hashed (sha256) while it is streamed to disk and stored once
+under static/uploads/cas/<aa>/<bb>/<sha256><ext>; the same photo uploaded
+again reuses the existing file. upload_blobs tracks every stored file and
+how many tickets point at it, and gc_uploads() removes files no ticket has
+referenced for UPLOAD_GC_GRACE_SECONDS.
+
+A blob's name is always the hash of the bytes in it: process_upload() never
+rewrites an original, it stores the re-encoded image as a new blob and
+records original -> processed (upload_blobs.processed_sha256), moving the
+original's tickets over so that it becomes garbage.
+"""
+import hashlib
+import io
+import logging
+import os
+import uuid
+
+from images import output_extension, render_image, thumb_name
+from shahenbot_db import (
+    delete_orphan_upload_blob_db,
+    known_upload_blobs_db,
+    link_processed_upload_blob_db,
+    list_orphan_upload_blobs_db,
+    now_utc_ts,
+    register_upload_blob_db,
+)
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CAS_DIR = "cas"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# an upload normally becomes a ticket within minutes; keep unreferenced blobs a day
+UPLOAD_GC_GRACE_SECONDS = int(os.getenv("UPLOAD_GC_GRACE_SECONDS", str(24 * 3600)))
+
+
+def blob_rel_path(sha256: str, ext: str) -> str:
+    """Path of a blob relative to the upload folder (two levels of 256 shards)."""
+    return f"{UPLOAD_CAS_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def blob_sha256(rel_path: str) -> str:
+    return os.path.basename(rel_path).split(".", 1)[0]
+
+
+def store_upload(stream, upload_root: str, ext: str) -> tuple[str, bool]:
+    """
+    Copy `stream` into the store. Returns (path relative to upload_root,
+    created); created is False when identical content was already stored.
+    """
+    return store_chunks(iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""), upload_root, ext)
+
+
+def store_chunks(chunks, upload_root: str, ext: str, max_bytes: int | None = None) -> tuple[str, bool]:
+    """store_upload for an iterable of byte chunks (e.g. a streamed download); ValueError past max_bytes."""
+    incoming = os.path.join(upload_root, UPLOAD_CAS_DIR, ".incoming")
+    os.makedirs(incoming, exist_ok=True)
+    tmp = os.path.join(incoming, f"{uuid.uuid4().hex}.part")
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as out:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ValueError(f"upload larger than {max_bytes} bytes")
+                out.write(chunk)
+
+        sha256 = digest.hexdigest()
+        rel_path = blob_rel_path(sha256, ext)
+        dest = os.path.join(upload_root, rel_path)
+        created = not os.path.exists(dest)
+        if created:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    register_upload_blob_db(sha256, rel_path, size)
+    return rel_path, created
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{uuid.uuid4().hex}.part"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def process_upload(upload_root: str, rel_path: str) -> str | None:
+    """
+    Re-encode the stored original at `rel_path` into a blob of its own (with
+    its thumbnail) and move the original's tickets to it. Returns the
+    processed blob's path, or None if the original is not a readable image.
+    """
+    ext = output_extension()
+    rendered = render_image(os.path.join(upload_root, rel_path), ext)
+    if not rendered:
+        return None
+
+    processed, _created = store_upload(io.BytesIO(rendered["data"]), upload_root, ext)
+    thumb = os.path.join(upload_root, thumb_name(processed))
+    if not os.path.exists(thumb):
+        # before the link: a ticket moved to the blob may be shown right away
+        _write_atomic(thumb, rendered["thumb"])
+
+    moved = link_processed_upload_blob_db(blob_sha256(rel_path), blob_sha256(processed))
+    logger.info(
+        "processed %s -> %s: %s bytes -> %s (thumb %s), %s tickets moved",
+        rel_path, processed, rendered["original_bytes"], rendered["bytes"], rendered["thumb_bytes"], moved,
+    )
+    return processed
+
+
+def _remove(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def gc_uploads(upload_root: str, grace_seconds: int = UPLOAD_GC_GRACE_SECONDS, dry_run: bool = False) -> dict:
+    """
+    Delete blobs no ticket references (and stray files the table does not
+    know), once they are older than grace_seconds.
+    """
+    cutoff = now_utc_ts() - grace_seconds
+    report = {"orphans": 0, "strays": 0, "bytes_freed": 0, "dry_run": dry_run}
+
+    # 1) rows with ref_count 0: the row goes first, so a racing upload re-creates it
+    while True:
+        batch = list_orphan_upload_blobs_db(cutoff)
+        if not batch:
+            break
+        for blob in batch:
+            if dry_run:
+                report["orphans"] += 1
+                report["bytes_freed"] += blob["size_bytes"]
+                continue
+            if not delete_orphan_upload_blob_db(blob["sha256"], cutoff):
+                continue
+            path = os.path.join(upload_root, blob["rel_path"])
+            stem, ext = os.path.splitext(path)
+            report["bytes_freed"] += _remove(path) + _remove(f"{stem}_thumb{ext}")
+            report["orphans"] += 1
+        if dry_run:
+            break
+
+    # 2) files without a row (crashed uploads, half-written temp files)
+    cas_root = os.path.join(upload_root, UPLOAD_CAS_DIR)
+    for dirpath, _dirs, files in os.walk(cas_root):
+        candidates = {}
+        for name in files:
+            path = os.path.join(dirpath, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            key = name.split(".", 1)[0].removesuffix("_thumb")
+            candidates.setdefault(key, []).append(path)
+
+        keys = list(candidates)
+        known = set()
+        for i in range(0, len(keys), 500):
+            known |= known_upload_blobs_db(keys[i:i + 500])
+
+        for key, paths in candidates.items():
+            if key in known:
+                continue
+            for path in paths:
+                report["strays"] += 1
+                report["bytes_freed"] += os.path.getsize(path) if dry_run else _remove(path)
+
+    return report
@@ -0,0 +1,41 @@
+import os
+from pathlib import Path
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+for sub in ("WebApp", "TelegramBot"):
+    sys.path.insert(0, str(ROOT / sub))
+
+# nothing under test may start background senders or talk to Telegram
+os.environ.setdefault("OUTBOX_DISPATCHER", "0")
+os.environ.setdefault("BOT_TOKEN", "123:test")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """shahenbot_db pointed at a fresh, fully migrated database in tmp_path."""
+    import shahenbot_db
+
+    monkeypatch.setattr(shahenbot_db, "DB_PATH", tmp_path / "shahenbot.db")
+    monkeypatch.setattr(shahenbot_db, "_POOL", None)
+    shahenbot_db.TENANT_CACHE.invalidate()
+    shahenbot_db.init_db()
+    yield shahenbot_db
+
+    pool = shahenbot_db.get_pool()
+    pool.release(force=True)
+    while not pool._idle.empty():
+        pool._idle.get_nowait().close()
+    shahenbot_db.TENANT_CACHE.invalidate()
+
+
+@pytest.fixture
+def fake_api():
+    """FakeTelegramServer on a free local port."""
+    from fake_telegram import FakeTelegramServer
+
+    server = FakeTelegramServer().start()
+    yield server
+    server.stop()
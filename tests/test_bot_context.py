@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+import pytest
+
+import ShahenBot
+from api_client import ApiClient
+
+CONTEXT = {
+    "language": "en",
+    "tenant": {"id": 1, "name": "Dana", "apartment": "4"},
+    "is_registered": True,
+    "is_fully_registered": True,
+    "payment_cta": {"show": True, "reason": None},
+}
+
+
+def _context_with(monkeypatch, handler) -> dict:
+    monkeypatch.setattr(ShahenBot, "api", ApiClient("http://api.test", transport=httpx.MockTransport(handler)))
+    return asyncio.run(ShahenBot.api_get_bot_context(77))
+
+
+@pytest.fixture(autouse=True)
+def fresh_language_cache():
+    ShahenBot.LANG_CACHE.invalidate(77)
+    yield
+    ShahenBot.LANG_CACHE.invalidate(77)
+
+
+def test_context_comes_from_the_api(monkeypatch):
+    assert _context_with(monkeypatch, lambda request: httpx.Response(200, json=CONTEXT)) == CONTEXT
+    assert ShahenBot.LANG_CACHE.get(77) == "en"
+
+
+def _timeout(request):
+    raise httpx.ConnectTimeout("api down", request=request)
+
+
+@pytest.mark.parametrize(
+    "handler",
+    [
+        _timeout,
+        lambda request: httpx.Response(502, text="bad gateway"),
+        lambda request: httpx.Response(200, text="<html>"),
+        lambda request: httpx.Response(200, json=["not", "a", "context"]),
+    ],
+)
+def test_api_failure_falls_back_to_a_usable_context(monkeypatch, handler):
+    ShahenBot.LANG_CACHE.set(77, "fr")
+
+    ctx = _context_with(monkeypatch, handler)
+
+    assert ctx == ShahenBot.fallback_bot_context(77)
+    assert ctx["language"] == "fr" and ctx["tenant"] is None and not ctx["payment_cta"]["show"]
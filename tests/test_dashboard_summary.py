@@ -0,0 +1,48 @@
+import threading
+
+import shahenbot_db
+
+
+def _add_tenant(db, name, building_id=1):
+    with db.db() as conn:
+        conn.execute("INSERT INTO tenants (name, apartment, building_id) VALUES (?, '1', ?)", (name, building_id))
+
+
+def _cached(db, building_id):
+    with db.db() as conn:
+        return conn.execute("SELECT 1 FROM dashboard_summaries WHERE building_id = ?", (building_id,)).fetchone()
+
+
+def test_summary_is_cached_until_a_write_changes_it(db):
+    _add_tenant(db, "a")
+    assert db.get_dashboard_summary_db(1)["tenant_count"] == 1
+    assert _cached(db, 1) and not _cached(db, 2)
+
+    _add_tenant(db, "b", building_id=2)
+    assert _cached(db, 1)  # another building's write leaves it alone
+
+    _add_tenant(db, "c")
+    assert not _cached(db, 1)
+    assert db.get_dashboard_summary_db(1)["tenant_count"] == 2
+
+
+def test_write_during_rebuild_is_not_blocked_and_not_lost(db, monkeypatch):
+    _add_tenant(db, "a")
+    build = shahenbot_db._build_dashboard_summary
+
+    def build_while_a_tenant_is_added(conn, building_id, today):
+        summary = build(conn, building_id, today)
+        # another worker writes while this one is still building: it must not wait for us
+        writer = threading.Thread(target=_add_tenant, args=(db, "b"))
+        writer.start()
+        writer.join(5)
+        assert not writer.is_alive()
+        return summary
+
+    with monkeypatch.context() as m:
+        m.setattr(shahenbot_db, "_build_dashboard_summary", build_while_a_tenant_is_added)
+        assert db.get_dashboard_summary_db(1)["tenant_count"] == 1
+
+    # the summary built before that write was not stored as current
+    assert not _cached(db, 1)
+    assert db.get_dashboard_summary_db(1)["tenant_count"] == 2
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+from delivery import DISPATCHER_LEASE, OutboxDispatcher, RateLimiter
+from telegram_client import TelegramClient
+
+PAY = {"inline_keyboard": [[{"text": "pay", "callback_data": "pay_open"}]]}
+
+
+@pytest.fixture
+def client(fake_api):
+    client = TelegramClient("123:test", base_url=fake_api.base_url)
+    yield client
+    client.close()
+
+
+def _dispatcher(send, workers=4, per_second=1000.0, per_chat_interval=0.0):
+    return OutboxDispatcher(send, workers=workers, limiter=RateLimiter(per_second, per_chat_interval))
+
+
+def _queue(db, chat_ids, text="hello", reply_markup=None):
+    return db.create_delivery_job_messages_db(
+        "test", None, 1, [{"chat_id": c, "text": f"{text} {c}", "reply_markup": reply_markup} for c in chat_ids]
+    )
+
+
+def _make_due(db):
+    # stands in for waiting out retry_after / the backoff
+    with db.db() as conn:
+        conn.execute("UPDATE outbox_messages SET next_attempt_ts = 0 WHERE status = 'queued'")
+
+
+def test_messages_are_delivered(db, fake_api, client):
+    job_id = _queue(db, [101, 102, 103], reply_markup=PAY)
+
+    assert _dispatcher(client.deliver).run_once() == 3
+
+    job = db.get_delivery_job_db(job_id)
+    assert (job["sent"], job["failed"], job["done"]) == (3, 0, True)
+    assert sorted(m["chat_id"] for m in fake_api.sent) == [101, 102, 103]
+    assert all(m["reply_markup"] == PAY and m["text"] == f"hello {m['chat_id']}" for m in fake_api.sent)
+
+    rows = db.list_delivery_messages_db(job_id)
+    assert {r["message_id"] for r in rows} == {m["message_id"] for m in fake_api.sent}
+    assert all(r["status"] == "sent" and r["attempts"] == 1 for r in rows)
+    # nothing left to claim
+    assert _dispatcher(client.deliver).run_once() == 0
+
+
+def test_blocked_chat_fails_without_retry(db, fake_api, client):
+    fake_api.fail_chat_ids = {102}
+    job_id = _queue(db, [101, 102])
+
+    _dispatcher(client.deliver).run_once()
+
+    job = db.get_delivery_job_db(job_id)
+    assert (job["sent"], job["failed"], job["done"]) == (1, 1, True)
+    [failed] = db.list_delivery_messages_db(job_id, "failed")
+    assert failed["chat_id"] == 102 and failed["last_error"].startswith("403")
+    _make_due(db)
+    assert _dispatcher(client.deliver).run_once() == 0
+
+
+def test_rate_limited_message_is_retried(db, fake_api, client):
+    fake_api.rate_limit_every = 2  # the second sendMessage gets 429, retry_after 1
+    job_id = _queue(db, [101, 102])
+    dispatcher = _dispatcher(client.deliver, workers=1)
+
+    assert dispatcher.run_once() == 2
+    [queued] = db.list_delivery_messages_db(job_id, "queued")
+    assert queued["last_error"].startswith("429") and queued["attempts"] == 1
+    assert db.get_delivery_job_db(job_id)["pending"] == 1
+
+    # not due again until retry_after has passed
+    assert dispatcher.run_once() == 0
+    _make_due(db)
+    started = time.monotonic()
+    assert dispatcher.run_once() == 1
+    # the limiter keeps the chat back for retry_after as well
+    assert time.monotonic() - started >= 0.5
+
+    job = db.get_delivery_job_db(job_id)
+    assert (job["sent"], job["failed"], job["done"]) == (2, 0, True)
+    [retried] = [r for r in db.list_delivery_messages_db(job_id) if r["id"] == queued["id"]]
+    assert retried["status"] == "sent" and retried["attempts"] == 2
+    assert len(fake_api.sent) == 2
+
+
+def test_sends_are_spaced_by_the_rate_limiter(db, client):
+    sent_at = {}
+
+    def send(chat_id, text, reply_markup):
+        sent_at.setdefault(chat_id, []).append(time.monotonic())
+        return client.deliver(chat_id, text, reply_markup)
+
+    # two jobs -> two messages into chat 101, plus four other chats
+    _queue(db, [101, 102, 103])
+    _queue(db, [101, 104, 105])
+
+    started = time.monotonic()
+    assert _dispatcher(send, workers=6, per_second=20, per_chat_interval=0.3).run_once() == 6
+
+    # 20/s overall: the sixth slot comes up 5 * 50ms after the first
+    assert max(t for ts in sent_at.values() for t in ts) - started >= 0.25
+    # one per 0.3s into the same chat
+    assert max(sent_at[101]) - started >= 0.3
+
+
+def test_only_the_lease_holder_sends(db, client):
+    senders = []
+
+    def sender(name):
+        def send(chat_id, text, reply_markup):
+            senders.append(name)
+            return client.deliver(chat_id, text, reply_markup)
+        return send
+
+    dispatchers = [_dispatcher(sender("first")), _dispatcher(sender("second"))]
+    job_id = _queue(db, range(101, 111))
+    for d in dispatchers:
+        d.start()
+    try:
+        deadline = time.monotonic() + 10
+        while not db.get_delivery_job_db(job_id)["done"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        for d in dispatchers:
+            d.stop(5)
+
+    assert db.get_delivery_job_db(job_id)["sent"] == 10
+    assert len(senders) == 10 and len(set(senders)) == 1
+
+
+def test_standby_takes_over_a_released_lease(db, client):
+    first, second = _dispatcher(client.deliver), _dispatcher(client.deliver)
+
+    assert first.holds_lease() and not second.holds_lease()
+    db.release_scheduler_lease_db(DISPATCHER_LEASE, first.owner)
+    assert second.holds_lease()
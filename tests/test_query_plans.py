@@ -0,0 +1,139 @@
+"""
+Every read helper in shahenbot_db must be served by an index.
+
+The helpers run against a freshly migrated database while a trace
+callback records each statement they execute; every recorded statement is
+then EXPLAINed and must not contain a full table scan. A new read helper
+fails test_every_read_helper_is_audited until it is added to READ_CALLS
+(or, for a deliberate whole-table read, to WHOLE_TABLE_READS).
+"""
+import inspect
+
+import pytest
+
+import shahenbot_db
+from shahenbot_db import encode_cursor
+
+READ_PREFIXES = ("get_", "list_", "find_", "search_", "poll_", "tenant_has_", "known_", "pending_", "resolve_")
+
+# helper name -> argument tuples to call it with (one plan per code path)
+READ_CALLS = {
+    "get_user_language_db": [(1,)],
+    "get_tenant_by_id_db": [(1,)],
+    "get_tenant_by_chat_id_db": [(1,)],
+    "get_bot_context_db": [(1,)],
+    "get_ticket_recipients_db": [(1, 1)],
+    "get_tenants_db": [(200, None, 1), (200, None, 1, encode_cursor("1", "x", 1))],
+    "get_tenants_summary_db": [(1,)],
+    "get_tenants_by_building_apartment_db": [(1, "1")],
+    "get_tickets_db": [
+        (100, "open", None, None, 1),
+        (100, None, None, None, 1, encode_cursor(0, 1)),
+        (100, None, None, "x", 1),
+    ],
+    "search_tickets_db": [("x", 100, None, None, 1), ("x", 100, "open", None, 1, encode_cursor(0, 1, 10))],
+    "get_ticket_by_id_db": [(1,)],
+    "get_tickets_for_chat_db": [(1,)],
+    "find_open_ticket_by_category_db": [(1, "x")],
+    "get_ticket_watchers_db": [(1,)],
+    "get_building_by_id_db": [(1,)],
+    "get_building_by_code_db": [("B1",)],
+    "get_building_request_db": [(1,)],
+    "get_staff_user_by_username_db": [("x",)],
+    "get_staff_user_by_email_db": [("x@example.com",)],
+    "get_staff_user_by_id_db": [(1,)],
+    "get_user_by_id_db": [(1,)],
+    "get_user_by_email_db": [("x@example.com",)],
+    "get_tenant_dues_db": [(1, 14), (None, 14)],
+    "pending_payment_tenant_ids_db": [()],
+    "get_dashboard_summary_db": [(1,)],
+    "get_pending_payments_db": [(1,), (1, 50, encode_cursor(0, 1))],
+    "get_payments_history_db": [(1, 2024, 1, 100, encode_cursor(0, 1))],
+    "get_payments_history_totals_db": [(None, 2024), (1, 2024, 1)],
+    "get_payment_by_id_db": [(1,)],
+    "tenant_has_pending_payment_db": [(1,)],
+    "get_poll_with_options_db": [(1,)],
+    "poll_results_db": [(1,)],
+    "list_polls_db": [(1,)],
+    "get_poll_delivery_db": [(1,)],
+    "list_announcements_db": [(1,)],
+    "get_recipients_chat_ids_by_group_db": [(1, "owners"), (1, "renters"), (1, "all")],
+    "get_delivery_job_db": [(1,)],
+    "list_delivery_messages_db": [(1,), (1, "failed")],
+    "get_telegram_media_db": [("x",)],
+    "get_upload_blob_db": [("a" * 64,)],
+    "list_orphan_upload_blobs_db": [(0,)],
+    "known_upload_blobs_db": [(["a" * 64],)],
+    "get_tenant_portal_token_db": [("x",)],
+    "list_tenant_tickets_db": [(1,)],
+    "list_tenant_payments_db": [(1,)],
+    "list_building_announcements_db": [(1,)],
+}
+
+# reads that return (or look through) a whole, small table on purpose
+WHOLE_TABLE_READS = {
+    "get_schema_version_db",           # one row per migration
+    "get_buildings_db",                # super admin building list
+    "list_buildings_db",               # super admin building list / LIKE search
+    "list_staff_users_db",             # super admin staff list
+    "list_building_requests_db",       # pending sign-up requests, a handful
+    "get_building_by_unique_db",       # sign-up duplicate check on normalized address
+    "resolve_building_by_street_number_db",  # bot registration, once per tenant
+    "get_tenants_by_apartment_db",     # legacy lookup without a building
+}
+
+
+def _read_helpers() -> set[str]:
+    return {
+        name
+        for name, fn in inspect.getmembers(shahenbot_db, inspect.isfunction)
+        if fn.__module__ == shahenbot_db.__name__ and name.endswith("_db") and name.startswith(READ_PREFIXES)
+    }
+
+
+def _full_scans(plan: list[str]) -> list[str]:
+    coroutines = {d.split()[1] for d in plan if d.startswith("CO-ROUTINE ")}
+    scans = []
+    for detail in plan:
+        # "SCAN tenants" is a full table scan; "SCAN t USING INDEX ..." walks an index
+        if not detail.startswith("SCAN ") or "INDEX" in detail:
+            continue
+        if detail.startswith(("SCAN CONSTANT ROW", "SCAN (")) or detail.split()[1] in coroutines:
+            # a VALUES list or a subquery's result, not a table
+            continue
+        scans.append(detail)
+    return scans
+
+
+def test_every_read_helper_is_audited():
+    unaudited = _read_helpers() - set(READ_CALLS) - WHOLE_TABLE_READS
+    assert not unaudited, f"add these to READ_CALLS or WHOLE_TABLE_READS: {sorted(unaudited)}"
+    assert not set(READ_CALLS) - _read_helpers(), "READ_CALLS names a helper that no longer exists"
+
+
+@pytest.mark.parametrize("name", sorted(READ_CALLS))
+def test_read_helper_uses_indexes(db, name):
+    fn = getattr(db, name)
+    statements = []
+    with db.db() as conn:
+        # the helper borrows this same thread connection, so the trace sees it
+        conn.set_trace_callback(statements.append)
+        try:
+            for args in READ_CALLS[name]:
+                fn(*args)
+        finally:
+            conn.set_trace_callback(None)
+
+        planned = 0
+        for sql in dict.fromkeys(statements):
+            head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+            if head not in ("SELECT", "WITH", "UPDATE", "DELETE"):
+                continue
+            if "sqlite_master" in sql or "'main'." in sql:
+                # schema probes and FTS5's own shadow-table reads
+                continue
+            plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+            planned += 1
+            assert not _full_scans(plan), f"full scan in {name}:\n{sql}\n{plan}"
+
+    assert planned, f"{name} executed no statement to check"
@@ -0,0 +1,120 @@
+from datetime import date
+
+import pytest
+
+from delivery import OutboxDispatcher, RateLimiter
+from reminders import PAY_BUTTON, ReminderScheduler, run_payment_reminders
+from telegram_client import TelegramClient
+
+TODAY = date(2024, 5, 10)
+
+
+@pytest.fixture
+def tenants(db):
+    """Tenants due around TODAY (run with days_ahead=3); name -> tenant id."""
+    rows = [
+        # name, building_id, next_payment_date, chat_id
+        ("overdue", 1, "2024-05-01", 201),
+        ("soon", 1, "2024-05-12", 202),
+        ("other building", 2, "2024-05-11", 203),
+        ("later", 1, "2024-05-30", 204),
+        ("no telegram", 1, "2024-05-09", None),
+        ("paid, awaiting approval", 1, "2024-05-10", 206),
+    ]
+    ids = {}
+    with db.db() as conn:
+        for name, building_id, due, chat_id in rows:
+            ids[name] = conn.execute(
+                """
+                INSERT INTO tenants (name, apartment, building_id, next_payment_date, payment_type, chat_id)
+                VALUES (?, '1', ?, ?, 'monthly', ?)
+                """,
+                (name, building_id, due, chat_id),
+            ).lastrowid
+        conn.execute(
+            """
+            INSERT INTO payments (building_id, tenant_id, amount_cents, method, status, proof_file_id)
+            VALUES (1, ?, 10000, 'bit', 'pending', 'file')
+            """,
+            (ids["paid, awaiting approval"],),
+        )
+    return ids
+
+
+def _outbox(db):
+    with db.db() as conn:
+        return conn.execute("SELECT chat_id, text FROM outbox_messages ORDER BY chat_id").fetchall()
+
+
+def _reminded(db):
+    with db.db() as conn:
+        return conn.execute("SELECT tenant_id, period_ym, stage FROM payment_reminders ORDER BY tenant_id, stage").fetchall()
+
+
+def test_one_pass_queues_each_due_tenant_once(db, tenants):
+    report = run_payment_reminders(days_ahead=3, today=TODAY)
+
+    assert (report["candidates"], report["eligible"]) == (5, 3)
+    assert (report["queued"], report["duplicates"]) == (3, 0)
+    assert len(report["jobs"]) == 2  # one delivery job per building
+    assert [r[0] for r in _outbox(db)] == [201, 202, 203]
+    assert [tuple(r) for r in _reminded(db)] == [
+        (tenants["overdue"], "2024-05", "overdue"),
+        (tenants["soon"], "2024-05", "upcoming"),
+        (tenants["other building"], "2024-05", "upcoming"),
+    ]
+
+
+def test_second_pass_queues_nothing(db, tenants):
+    run_payment_reminders(days_ahead=3, today=TODAY)
+    outbox, reminded = _outbox(db), _reminded(db)
+
+    report = run_payment_reminders(days_ahead=3, today=TODAY)
+
+    assert (report["queued"], report["duplicates"], report["jobs"]) == (0, 3, [])
+    assert _outbox(db) == outbox and _reminded(db) == reminded
+
+
+def test_passing_the_due_date_sends_the_overdue_reminder(db, tenants):
+    run_payment_reminders(days_ahead=3, today=TODAY)
+
+    report = run_payment_reminders(days_ahead=3, today=date(2024, 5, 13))
+
+    # "soon" and "other building" are overdue now; "overdue" was already told
+    assert (report["queued"], report["duplicates"]) == (2, 1)
+    assert sum(1 for r in _reminded(db) if r[2] == "overdue") == 3
+
+
+def test_dry_run_changes_nothing(db, tenants):
+    report = run_payment_reminders(dry_run=True, days_ahead=3, today=TODAY)
+
+    assert (report["queued"], report["jobs"]) == (3, [])
+    assert _outbox(db) == [] and _reminded(db) == []
+    assert run_payment_reminders(days_ahead=3, today=TODAY)["queued"] == 3
+
+
+def test_queued_reminders_reach_telegram(db, tenants, fake_api):
+    run_payment_reminders(days_ahead=3, today=TODAY)
+    client = TelegramClient("123:test", base_url=fake_api.base_url)
+
+    OutboxDispatcher(client.deliver, limiter=RateLimiter(1000, 0)).run_once()
+    client.close()
+
+    sent = {m["chat_id"]: m for m in fake_api.sent}
+    assert sorted(sent) == [201, 202, 203]
+    assert all(m["reply_markup"] == PAY_BUTTON for m in sent.values())
+    assert "2024-05-01" in sent[201]["text"] and "2024-05-12" in sent[202]["text"]
+
+
+def test_only_the_lease_holder_runs_the_scheduler(db):
+    first, second = ReminderScheduler(dry_run=True), ReminderScheduler(dry_run=True)
+
+    assert first.run_once() is not None
+    assert second.run_once() is None
+    assert first.run_once() is not None  # renewing its own lease
+
+    # the holder stopped renewing
+    with db.db() as conn:
+        conn.execute("UPDATE scheduler_leases SET until_ts = 0")
+    assert second.run_once() is not None
+    assert first.run_once() is None
@@ -0,0 +1,66 @@
+from shahenbot_db import next_page_cursor, ticket_cursor_keys
+
+
+def _add_tickets(db, descriptions, building_id=1):
+    with db.db() as conn:
+        for i, text in enumerate(descriptions):
+            conn.execute(
+                """
+                INSERT INTO tickets (building_id, chat_id, category, description, language, status, created_at, created_ts)
+                VALUES (?, ?, 'x', ?, 'he', 'open', '2024-01-01', ?)
+                """,
+                (building_id, 1000 + i, text, 1_700_000_000 + i),
+            )
+
+
+def _all_pages(db, search, limit, building_id=1, between_pages=None):
+    seen, cursor = [], None
+    while True:
+        rows = db.get_tickets_db(limit=limit, search=search, building_id=building_id, cursor=cursor)
+        seen.extend(r["id"] for r in rows)
+        cursor = next_page_cursor(rows, limit, *ticket_cursor_keys(search))
+        if not cursor:
+            return seen
+        if between_pages:
+            between_pages()
+
+
+def test_search_pages_cover_ties_exactly_once(db):
+    # many identical documents -> identical bm25, plus a spread of distinct ranks
+    _add_tickets(db, ["leak in the elevator"] * 23 + [f"leak {'water ' * n}pipe" for n in range(17)])
+    _add_tickets(db, ["leak next door"] * 5, building_id=2)
+
+    full = [r["id"] for r in db.get_tickets_db(limit=1000, search="leak", building_id=1)]
+    assert len(full) == 40
+
+    for limit in (1, 3, 7, 40):
+        assert _all_pages(db, "leak", limit) == full
+
+
+def test_search_pages_ignore_tickets_filed_mid_paging(db):
+    _add_tickets(db, ["broken door"] * 10)
+    full = [r["id"] for r in db.get_tickets_db(limit=1000, search="door", building_id=1)]
+
+    paged = _all_pages(db, "door", 4, between_pages=lambda: _add_tickets(db, ["broken door"]))
+    assert paged == full
+
+
+def test_numbers_match_ticket_text_not_ids(db):
+    with db.db() as conn:
+        conn.execute("INSERT INTO tenants (name, apartment, building_id, chat_id) VALUES ('Dana', '12', 7, 5551234)")
+        for chat_id, text in ((5551234, "broken elevator"), (1000, "elevator stuck on floor 7")):
+            conn.execute(
+                """
+                INSERT INTO tickets (building_id, chat_id, category, description, language, status, created_at, created_ts)
+                VALUES (7, ?, 'x', ?, 'he', 'open', '2024-01-01', 1700000000)
+                """,
+                (chat_id, text),
+            )
+
+    def found(search):
+        return [r["description"] for r in db.get_tickets_db(limit=10, search=search, building_id=7)]
+
+    assert found("7") == ["elevator stuck on floor 7"]
+    assert found("555") == []
+    # the tenant's apartment is searchable text
+    assert found("12") == ["broken elevator"]
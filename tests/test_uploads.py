@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image
+
+from images import thumb_name
+from upload_store import blob_sha256, gc_uploads, process_upload, store_chunks, store_upload
+
+
+@pytest.fixture
+def upload_root(tmp_path):
+    return str(tmp_path / "uploads")
+
+
+@pytest.fixture
+def tenant_chat(db):
+    with db.db() as conn:
+        conn.execute("INSERT INTO tenants (name, apartment, building_id, chat_id) VALUES ('t', '1', 1, 500)")
+    return 500
+
+
+def _photo() -> io.BytesIO:
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"
+    buf = io.BytesIO()
+    Image.new("RGB", (2400, 1800), (200, 40, 40)).save(buf, "JPEG", quality=95, exif=exif)
+    buf.seek(0)
+    return buf
+
+
+def _sha_of_file(upload_root, rel_path) -> str:
+    with open(os.path.join(upload_root, rel_path), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _url(rel_path) -> str:
+    return f"http://localhost/static/uploads/{rel_path}"
+
+
+def test_every_blob_is_named_by_the_hash_of_its_bytes(db, upload_root):
+    original, created = store_upload(_photo(), upload_root, ".jpg")
+    assert created
+
+    processed = process_upload(upload_root, original)
+
+    assert processed and processed != original
+    for rel_path in (original, processed):
+        assert _sha_of_file(upload_root, rel_path) == blob_sha256(rel_path)
+    assert os.path.exists(os.path.join(upload_root, thumb_name(processed)))
+    with Image.open(os.path.join(upload_root, processed)) as im:
+        assert max(im.size) <= 1600 and not im.getexif()
+
+    blob = db.get_upload_blob_db(blob_sha256(original))
+    assert blob["processed_sha256"] == blob_sha256(processed)
+    assert blob["processed_rel_path"] == processed
+
+
+def test_processing_moves_existing_tickets(db, upload_root, tenant_chat):
+    original, _ = store_upload(_photo(), upload_root, ".jpg")
+    ticket = db.create_ticket_db(tenant_chat, "x", "broken", image_url=_url(original))
+    assert ticket["image_url"] == _url(original)
+
+    processed = process_upload(upload_root, original)
+
+    assert db.get_ticket_by_id_db(ticket["id"])["image_url"] == _url(processed)
+    assert db.get_upload_blob_db(blob_sha256(original))["ref_count"] == 0
+    assert db.get_upload_blob_db(blob_sha256(processed))["ref_count"] == 1
+
+
+def test_tickets_filed_after_processing_get_the_processed_image(db, upload_root, tenant_chat):
+    original, _ = store_upload(_photo(), upload_root, ".jpg")
+    processed = process_upload(upload_root, original)
+
+    ticket = db.create_ticket_db(tenant_chat, "x", "broken", image_url=_url(original))
+
+    assert ticket["image_url"] == _url(processed)
+    assert db.get_upload_blob_db(blob_sha256(processed))["ref_count"] == 1
+
+
+def test_gc_drops_the_replaced_original(db, upload_root, tenant_chat):
+    original, _ = store_upload(_photo(), upload_root, ".jpg")
+    db.create_ticket_db(tenant_chat, "x", "broken", image_url=_url(original))
+    processed = process_upload(upload_root, original)
+
+    report = gc_uploads(upload_root, grace_seconds=-60)
+
+    assert report["orphans"] == 1 and report["strays"] == 0
+    assert not os.path.exists(os.path.join(upload_root, original))
+    assert os.path.exists(os.path.join(upload_root, processed))
+    assert os.path.exists(os.path.join(upload_root, thumb_name(processed)))
+
+
+def _chunks(stream, size=1000):
+    return iter(lambda: stream.read(size), b"")
+
+
+def test_telegram_media_is_stored_and_referenced_like_uploads(db, upload_root, tenant_chat):
+    db.register_telegram_media_db("file-id", "uniq1")
+    # the bot files the ticket before anyone opened the photo
+    ticket = db.create_ticket_db(tenant_chat, "x", "broken", image_url="http://localhost/media/telegram/uniq1")
+    assert ticket["image_url"] == "http://localhost/media/telegram/uniq1"
+
+    fetched, created = store_chunks(_chunks(_photo()), upload_root, ".jpg")
+    assert created and db.mark_telegram_media_stored_db("uniq1", blob_sha256(fetched)) == fetched
+    assert db.get_upload_blob_db(blob_sha256(fetched))["ref_count"] == 1
+
+    processed = process_upload(upload_root, fetched)
+
+    media = db.get_telegram_media_db("uniq1")
+    assert (media["stored_name"], media["blob_sha256"]) == (processed, blob_sha256(processed))
+    assert db.get_upload_blob_db(blob_sha256(processed))["ref_count"] == 1
+    assert db.get_ticket_by_id_db(ticket["id"])["image_url"] == "http://localhost/media/telegram/uniq1"
+
+    later = db.create_ticket_db(tenant_chat, "x", "still broken", image_url="http://localhost/media/telegram/uniq1")
+    assert later["image_url"] == "http://localhost/media/telegram/uniq1"
+    assert db.get_upload_blob_db(blob_sha256(processed))["ref_count"] == 2
+
+    gc_uploads(upload_root, grace_seconds=-60)
+    assert not os.path.exists(os.path.join(upload_root, fetched))
+    assert os.path.exists(os.path.join(upload_root, processed))
+
+
+def test_refetched_telegram_media_reuses_the_processed_blob(db, upload_root):
+    db.register_telegram_media_db("file-id", "uniq1")
+    original, _ = store_upload(_photo(), upload_root, ".jpg")
+    processed = process_upload(upload_root, original)
+
+    fetched, created = store_chunks(_chunks(_photo()), upload_root, ".jpg")
+
+    assert fetched == original and not created
+    assert db.mark_telegram_media_stored_db("uniq1", blob_sha256(fetched)) == processed
+
+
+def test_store_chunks_enforces_max_bytes(db, upload_root):
+    with pytest.raises(ValueError):
+        store_chunks(_chunks(_photo()), upload_root, ".jpg", max_bytes=1000)
+    assert os.listdir(os.path.join(upload_root, "cas", ".incoming")) == []
+    assert db.list_orphan_upload_blobs_db(2**40) == []
@@ -0,0 +1,111 @@
+import json
+from pathlib import Path
+import threading
+
+import pytest
+from flask import Flask
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from webhook import WEBHOOK_PATH, WebhookBridge, create_blueprint
+
+SECRET = "test-secret_1"
+UPDATE = json.loads((Path(__file__).parent / "fixtures" / "update_message.json").read_text(encoding="utf-8"))
+
+
+class Received(list):
+    """Updates that reached the bot's handlers."""
+
+    def __init__(self):
+        super().__init__()
+        self.first = threading.Event()
+
+    async def handler(self, update, context):
+        self.append(update)
+        self.first.set()
+
+
+def _bridge(fake_api, received=None, secret=SECRET, **kwargs) -> WebhookBridge:
+    # a real Application whose Bot API calls (getMe on start) go to the fake server
+    application = ApplicationBuilder().token("123:test").base_url(f"{fake_api.base_url}/bot").updater(None).build()
+    if received is not None:
+        application.add_handler(MessageHandler(filters.TEXT, received.handler))
+    return WebhookBridge(application, secret=secret, webhook_url="", **kwargs)
+
+
+@pytest.fixture
+def client_for(fake_api):
+    bridges = []
+
+    def make(**kwargs):
+        bridge = _bridge(fake_api, **kwargs)
+        bridge.start()
+        bridges.append(bridge)
+        app = Flask(__name__)
+        app.register_blueprint(create_blueprint(bridge))
+        return app.test_client()
+
+    yield make
+    for bridge in bridges:
+        bridge.stop()
+
+
+def _post(client, body, secret=SECRET, **kwargs):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret is not None else {}
+    return client.post(WEBHOOK_PATH, headers=headers, **({"json": body} if body is not None else kwargs))
+
+
+def test_update_is_queued_for_the_handlers(client_for):
+    received = Received()
+    client = client_for(received=received)
+
+    resp = _post(client, UPDATE)
+
+    assert resp.status_code == 200 and resp.get_json() == {"ok": True}
+    assert received.first.wait(10)
+    assert received[0].update_id == UPDATE["update_id"]
+    assert received[0].effective_chat.id == UPDATE["message"]["chat"]["id"]
+    assert received[0].message.text == UPDATE["message"]["text"]
+
+
+@pytest.mark.parametrize("secret", [None, "", "wrong", SECRET + "x"])
+def test_bad_secret_is_forbidden(client_for, secret):
+    received = Received()
+    client = client_for(received=received)
+
+    assert _post(client, UPDATE, secret=secret).status_code == 403
+    assert not received.first.wait(0.2)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"data": "not json", "content_type": "application/json"},
+        {"data": json.dumps([UPDATE]), "content_type": "application/json"},
+        {"data": json.dumps({"message": UPDATE["message"]}), "content_type": "application/json"},
+        {"data": "update_id=1", "content_type": "application/x-www-form-urlencoded"},
+    ],
+)
+def test_malformed_body_is_rejected(client_for, kwargs):
+    client = client_for()
+    assert _post(client, None, **kwargs).status_code == 400
+
+
+def test_full_queue_asks_telegram_to_retry(client_for):
+    client = client_for(max_queue=0)
+
+    resp = _post(client, UPDATE)
+
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "5"
+
+
+@pytest.mark.parametrize("secret", ["", "has spaces", "x" * 257])
+def test_bridge_refuses_to_start_without_a_valid_secret(fake_api, secret):
+    bridge = _bridge(fake_api, secret=secret)
+    with pytest.raises(RuntimeError, match="WEBHOOK_SECRET"):
+        bridge.start()
+
+
+@pytest.mark.parametrize("header", [None, "", "anything"])
+def test_bridge_without_secret_accepts_nothing(fake_api, header):
+    assert not _bridge(fake_api, secret="").check_secret(header)